@@ -0,0 +1,78 @@
+"""
+Benchmark of insert-to-first-APDU latency.
+
+The emulated reader inserts a card through LocalCardObeserver.update (the same
+callback CardMonitor uses) after a random delay, while the main thread runs the
+interactive path: WaitForCard -> waitForConnection -> first APDU (LOAD KEYS).
+The old polling loop (sleep 0.3 s per spin) is measured as a reference; it
+does not include the extra CardRequest the old waitForConnection made.
+
+Run: python benchmarks/bench_card_wait.py [taps]
+"""
+import io
+import os
+import sys
+import time
+import random
+import threading
+import contextlib
+import statistics
+
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, os.path.join(src_path, 'nfc_reader'))
+
+import do_card
+import do_comm
+import card_data
+from emulator import EmulatedReader, MifareClassic1K
+
+
+class TimedReader(EmulatedReader):
+    #emulated reader remembering time of insertion and of the first APDU after it
+    def insert(self, card):
+        self.insertedAt, self.firstApduAt = time.perf_counter(), None
+        return super().insert(card)
+
+    def process(self, apdu):
+        if self.firstApduAt is None:
+            self.firstApduAt = time.perf_counter()
+        return super().process(apdu)
+
+
+def insertLater(reader, delay):
+    time.sleep(delay)
+    reader.insert(MifareClassic1K())
+
+
+def pollingWait(e: threading.Event):
+    #reference: wait loop as it was before event driven waiting
+    while not e.is_set():
+        time.sleep(0.3)
+
+
+def measureTap(waitFunction) -> float:
+    insertEvent = threading.Event()
+    reader      = TimedReader()
+    observer    = do_card.CardProcessor.LocalCardObeserver(insertEvent, reader)
+    inserter    = threading.Thread(target=insertLater, args=(reader, random.uniform(0.05, 0.5)))
+    inserter.start()
+    waitFunction(insertEvent)
+    isOk, connection = observer.waitForConnection()
+    do_comm.fnLoadKey(connection, card_data.MIFARE_1K_default_key)
+    inserter.join()
+    observer.connections.release()
+    return (reader.firstApduAt - reader.insertedAt) * 1000
+
+
+def report(name: str, latencies: list[float]):
+    print(f"{name:<14} median {statistics.median(latencies):8.2f} ms   max {max(latencies):8.2f} ms")
+
+
+if __name__ == "__main__":
+    taps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with contextlib.redirect_stdout(io.StringIO()):
+        eventLatencies   = [measureTap(do_card.WaitForCard) for _ in range(taps)]
+        pollingLatencies = [measureTap(pollingWait) for _ in range(taps)]
+    print(f"insert-to-first-APDU latency, {taps} taps")
+    report("event driven", eventLatencies)
+    report("polling 0.3 s", pollingLatencies)
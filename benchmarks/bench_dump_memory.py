@@ -0,0 +1,44 @@
+"""
+Memory and construction time of card dumps.
+
+Measures bytes allocated per dumpMifare_1k() (and per compactDumpMifare_1k() for
+comparison) with tracemalloc over a batch of live dumps, and the time to construct
+one dump, the object CardProcessor allocates for every tap.
+
+Run: python benchmarks/bench_dump_memory.py [dumps]
+"""
+import gc
+import os
+import sys
+import timeit
+import tracemalloc
+
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, os.path.join(src_path, 'nfc_reader'))
+
+import card_data
+
+
+def bytesPerDump(factory, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dumps  = [factory() for _ in range(count)]
+    after  = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del dumps
+    return (after - before) / count
+
+
+def constructTime(factory, count: int) -> float:
+    return min(timeit.repeat(factory, number=count, repeat=5)) / count * 1e6
+
+
+if __name__ == "__main__":
+    count     = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    factories = [("dumpMifare_1k", card_data.dumpMifare_1k)]
+    if hasattr(card_data, "compactDumpMifare_1k"):
+        factories.append(("compactDumpMifare_1k", card_data.compactDumpMifare_1k))
+    print(f"{count} dumps")
+    for name, factory in factories:
+        print(f"  {name:<22} {bytesPerDump(factory, count):9.0f} bytes/dump   {constructTime(factory, count):8.2f} us/dump")
@@ -0,0 +1,50 @@
+"""
+Throughput of full card dumps against the emulated reader.
+
+Every tap inserts a fresh MifareClassic1K, opens a connection and runs do_wr.fnRead,
+the same as CardProcessor does for A_READ. Reports time per dump and APDUs per
+dump by instruction, so round-trip savings show up even with zero latency.
+
+Run: python benchmarks/bench_read_throughput.py [taps] [latency ms] [jitter ms]
+"""
+import io
+import os
+import sys
+import time
+import contextlib
+import statistics
+
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, os.path.join(src_path, 'nfc_reader'))
+
+import do_wr
+import card_data
+from emulator import EmulatedReader, MifareClassic1K
+
+INS_NAMES = {0x82: "LOAD KEYS", 0x86: "AUTH", 0xB0: "READ", 0xD6: "WRITE", 0xCA: "GET DATA"}
+
+
+def measureDump(reader: EmulatedReader) -> float:
+    reader.insert(MifareClassic1K())
+    start = time.perf_counter()
+    connection = reader.createConnection()
+    connection.connect()
+    dump = card_data.dumpMifare_1k()
+    with contextlib.redirect_stdout(io.StringIO()):
+        do_wr.fnRead(connection, dump, card_data.key())
+    connection.disconnect()
+    elapsed = time.perf_counter() - start
+    reader.remove()
+    return elapsed * 1000
+
+
+if __name__ == "__main__":
+    taps    = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    jitter  = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    reader  = EmulatedReader(latency=latency, jitter=jitter, seed=1)
+    times   = [measureDump(reader) for _ in range(taps)]
+    print(f"full dump, {taps} taps, latency {latency * 1000:.1f} ms +/- {jitter * 1000:.1f} ms")
+    print(f"  median {statistics.median(times):8.2f} ms   max {max(times):8.2f} ms")
+    for ins, count in sorted(reader.stats.items()):
+        print(f"  {INS_NAMES.get(ins, hex(ins)):<10} {count / taps:6.1f} APDU/dump")
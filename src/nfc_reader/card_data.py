@@ -24,47 +24,117 @@ class status(Enum):
     S_WRITE_ERROR= "WRITE ERROR"
     S_KEY_ERROR  = "KEY ERROR"
     S_NO_READERS = "NO READERS"
+    S_NO_ACCESS  = "NO ACCESS"   #access conditions forbid operation with available keys, nothing was sent
+    S_VERIFY_ERROR = "VERIFY ERROR" #block read back after write differs from written data
 
 
+#Access bytes 6..8 of sector trailer keep C1, C2, C3 of blocks 0-3 (trailer is 3) twice, direct and inverted:
+#  b6: ~C2(3-0) ~C1(3-0)
+#  b7:  C1(3-0) ~C3(3-0)
+#  b8:  C3(3-0)  C2(3-0)
+#Direct bits b7(7-4), b8 form 12 bits index C3(11-8) C2(7-4) C1(3-0) into ACCESS_TABLE.
+#Each row is (C1C2C3 of blocks 0-3, inverted copy as (b6 << 4) | b7(3-0) expected for valid access bytes).
+def _accessTableRow(index: int) -> (tuple[int], int):
+    conditions = tuple((((index >> i) & 1) << 2) | (((index >> (4 + i)) & 1) << 1) | ((index >> (8 + i)) & 1)
+                       for i in range(MIFARE_1K_blocks_per_sector))
+    b6 = ~index & 0xFF
+    b7 = (~index >> 8) & 0x0F
+    return conditions, (b6 << 4) | b7
+
+ACCESS_TABLE = tuple(_accessTableRow(index) for index in range(1 << 12))
+
+
+#decode access bytes 6..8: returns (valid, (C1C2C3 of block 0, 1, 2, trailer)),
+#valid is False when inverted copy does not match (card blocks such sector)
+def decodeAccessBits(accessBytes) -> (bool, tuple[int]):
+    b6, b7, b8 = accessBytes[0], accessBytes[1], accessBytes[2]
+    conditions, inverted = ACCESS_TABLE[(b8 << 4) | (b7 >> 4)]
+    return inverted == ((b6 << 4) | (b7 & 0x0F)), conditions
+
+
+#decode access conditions from bytes 6 and 7 only (no validity check), returns C1C2C3 of blocks 0-3
 def parseAccessBits(b6, b7):
-    b6 ^= 0xFF #C23│C22│C21│C20│C13│C12│C11│C10 (7-1)
-    b7 ^= 0xFF #C33│C32│C31│C30│C23│C22│C21│C20
-    #b8 ^= 0xFF #~C13│~C12│~C11│~C10│~C33│~C32│~C31│~C30│ it's checking byte that duplicate info
-    blockAcess=bytearray(MIFARE_1K_blocks_per_sector)
-    blockAcess[0] = ( (b6       & 0x01)  << 2) | ( (b7       & 0x01) < 1) | ((b7 >> 4) & 0x01)
-    blockAcess[1] = (((b6 >> 1) & 0x01)  << 2) | (((b7 >> 1) & 0x01) < 1) | ((b7 >> 5) & 0x01)
-    blockAcess[2] = (((b6 >> 2) & 0x01)  << 2) | (((b7 >> 2) & 0x01) < 1) | ((b7 >> 6) & 0x01)
-    blockAcess[3] = (((b6 >> 3) & 0x01)  << 2) | (((b7 >> 3) & 0x01) < 1) | ((b7 >> 7) & 0x01)
-    return blockAcess
-    
+    conditions, _ = ACCESS_TABLE[(b7 >> 4) | (~b6 & 0xF0) | ((~b7 & 0x0F) << 8)]
+    return bytearray(conditions)
+
+#access rights of data block for each C1C2C3: keys allowed to Read, Write, Increment, Decrement/transfer/restore
 bitAccessMap = {
     0b000: "R(A,B) W(A,B) I(A,B) D(A,B)",
-    0b001: "R(A,B) W(B,B) I(-) D(-)",
-    0b010: "R(A,B) W(B) I(A,B) D(A,B)",
+    0b001: "R(A,B) W(-) I(-) D(A,B)",
+    0b010: "R(A,B) W(-) I(-) D(-)",
     0b011: "R(B) W(B) I(-) D(-)",
-    0b100: "R(A,B) W(B) I(A,B) D(A,B)",
-    0b101: "R(B) W(-) I(-,B) D(-,B)",
-    0b110: "R(A,B) W(-,B) I(-) D(-)",
-    0b111: "R(A,B) W(-) I(-) D(-)"
+    0b100: "R(A,B) W(B) I(-) D(-)",
+    0b101: "R(B) W(-) I(-) D(-)",
+    0b110: "R(A,B) W(B) I(B) D(A,B)",
+    0b111: "R(-) W(-) I(-) D(-)"
 } 
 
+#the same rights as key type letters (keyType.value), for planning of operations:
+#data block C1C2C3 -> keys allowed to (read, write, increment, decrement/transfer/restore)
+DATA_BLOCK_RIGHTS = {
+    0b000: ("AB", "AB", "AB", "AB"),
+    0b010: ("AB", "",   "",   ""  ),
+    0b100: ("AB", "B",  "",   ""  ),
+    0b110: ("AB", "B",  "B",  "AB"),
+    0b001: ("AB", "",   "",   "AB"),
+    0b011: ("B",  "B",  "",   ""  ),
+    0b101: ("B",  "",   "",   ""  ),
+    0b111: ("",   "",   "",   ""  ),
+}
+
+#sector trailer C1C2C3 -> keys allowed to (write key A, read access bits, write access bits, read key B, write key B).
+#When key B is readable (read key B allowed to A), key B can not be used for authentication of data operations.
+TRAILER_RIGHTS = {
+    0b000: ("A",  "A",  "",  "A", "A"),
+    0b010: ("",   "A",  "",  "A", "" ),
+    0b100: ("B",  "AB", "",  "",  "B"),
+    0b110: ("",   "AB", "",  "",  "" ),
+    0b001: ("A",  "A",  "A", "A", "A"),
+    0b011: ("B",  "AB", "B", "",  "B"),
+    0b101: ("",   "AB", "B", "",  "" ),
+    0b111: ("",   "AB", "",  "",  "" ),
+}
+
+#Value block: signed 32-bit value kept three times (direct, inverted, direct; little endian) and one byte
+#address (direct, inverted, direct, inverted). Card checks the format on INCREMENT/DECREMENT/RESTORE.
+#  bytes 0-3: value  4-7: ~value  8-11: value  12: addr  13: ~addr  14: addr  15: ~addr
+VALUE_MIN = -(1 << 31)
+VALUE_MAX = (1 << 31) - 1
+
+def encodeValueBlock(value: int, address: int = 0) -> bytes:
+    if not VALUE_MIN <= value <= VALUE_MAX  or  not 0 <= address <= 0xFF:
+        raise ValueError(f"value {value} or address {address} out of range")
+    direct   = (value & 0xFFFFFFFF).to_bytes(4, "little")
+    inverted = (~value & 0xFFFFFFFF).to_bytes(4, "little")
+    return direct + inverted + direct + bytes((address, ~address & 0xFF, address, ~address & 0xFF))
+
+#returns (valid, value, address) of 16 bytes of block; valid is False when copies do not match
+def decodeValueBlock(data) -> (bool, int, int):
+    data = bytes(data)
+    if len(data) != MIFARE_1K_bytes_per_block:
+        return False, 0, 0
+    value   = int.from_bytes(data[0:4], "little", signed=True)
+    address = data[12]
+    valid   = (data[0:4] == data[8:12]  and  int.from_bytes(data[4:8], "little") == (~value & 0xFFFFFFFF)
+               and  data[14] == address  and  data[13] == data[15] == (~address & 0xFF))
+    return valid, value, address
+
 def bytes2str(b) -> str:
     return "[" + " ".join(f"{ch:02X}" for ch in b) + "]"
 
 #return array of strings, where each string is human representation of block access rights
 def accessBitsToStr(accessBytes) -> [str]:
-    blockAcess = parseAccessBits(accessBytes[0], accessBytes[1])
-    resultStrBlocks = [""  for _ in range(MIFARE_1K_blocks_per_sector)]
-    for i in range(MIFARE_1K_blocks_per_sector):
-        resultStrBlocks[i] = bitAccessMap.get(blockAcess[i])
-    return resultStrBlocks
+    conditions = decodeAccessBits(accessBytes)[1] if len(accessBytes) > 2 else parseAccessBits(accessBytes[0], accessBytes[1])
+    return [bitAccessMap[condition] for condition in conditions]
 
 class keyType(Enum):
     KT_A = "A"
     KT_B = "B"
 
 class key:
-    def __init__(self, kType = keyType.KT_B, kData: list[bytes] = MIFARE_1K_default_key):
+    __slots__ = ("keyType", "keyData")
+
+    def __init__(self, kType = keyType.KT_A, kData: list[bytes] = MIFARE_1K_default_key):
         self.keyType = kType
         self.keyData = kData
 
@@ -72,10 +142,71 @@ class key:
         return f"{self.keyType.value}:{bytes2str(self.keyData)}"
 
 
-#full dump data for Mifare 1k card
+#Keys to try for each sector: sector -> ordered candidate keys (with type), tried one by one until
+#authentication succeeds. Sectors without own keys use default keys (they are also tried after own keys).
+#Key file: one key per line "<sector|*> <A|B> <12 hex digits>", '*' is default key, '#' starts comment:
+#   *  A  FFFFFFFFFFFF
+#   1  A  A0A1A2A3A4A5
+#   1  B  B0 B1 B2 B3 B4 B5
+class KeyMap:
+    def __init__(self, defaultKeys: list[key] = None):
+        self.defaultKeys = list(defaultKeys) if defaultKeys is not None else [key()]
+        self.sectorKeys  = {}   #sector -> [key]
+
+    def addKey(self, k: key, nSector: int = None) -> None:
+        keys = self.defaultKeys if nSector is None else self.sectorKeys.setdefault(nSector, [])
+        if not any(k.keyType == known.keyType  and  bytes(k.keyData) == bytes(known.keyData) for known in keys):
+            keys.append(k)
+
+    #own keys of sector first, then default keys not tried yet
+    def candidates(self, nSector: int) -> list[key]:
+        keys = list(self.sectorKeys.get(nSector, []))
+        for k in self.defaultKeys:
+            if not any(k.keyType == known.keyType  and  bytes(k.keyData) == bytes(known.keyData) for known in keys):
+                keys.append(k)
+        return keys
+
+    #called by read/write engines when key opened sector (hook for plans learning keys, see do_wr.KeySearch)
+    def success(self, nSector: int, k: key) -> None:
+        pass
+
+    @classmethod
+    def fromFile(cls, fileName: str) -> "KeyMap":
+        with open(fileName, encoding="utf-8") as f:
+            return cls.fromLines(f)
+
+    #raises ValueError with line number for wrong line
+    @classmethod
+    def fromLines(cls, lines) -> "KeyMap":
+        keyMap = cls(defaultKeys=[])
+        for nLine, line in enumerate(lines, start=1):
+            fields = line.split("#", 1)[0].split(None, 2)
+            if len(fields) == 0:
+                continue
+            try:
+                if len(fields) != 3:
+                    raise ValueError("expected: <sector|*> <A|B> <key>")
+                nSector = None if fields[0] == "*" else int(fields[0])
+                if nSector is not None  and  not 0 <= nSector < MIFARE_1K_total_sectors:
+                    raise ValueError(f"sector must be 0-{MIFARE_1K_total_sectors - 1} or *")
+                keyData = bytearray.fromhex(fields[2])
+                if len(keyData) != MIFARE_1K_bytes_per_key:
+                    raise ValueError(f"key must be {MIFARE_1K_bytes_per_key} bytes")
+                keyMap.addKey(key(keyType(fields[1].upper()), keyData), nSector)
+            except ValueError as e:
+                raise ValueError(f"line {nLine}: {e}") from None
+        if len(keyMap.defaultKeys) == 0  and  len(keyMap.sectorKeys) == 0:
+            keyMap.defaultKeys.append(key())
+        return keyMap
+
+
+#full dump data for Mifare 1k card.
+#Parts of dump are slotted (one dump is over a hundred of objects), dump itself keeps __dict__ for extra attributes.
 class dumpMifare_1k:
     #data of each block
-    class block:            
+    class block:
+        __slots__ = ("data", "status")
+
         def __init__(self):
             self.data   = bytearray(MIFARE_1K_bytes_per_block)
             self.status = status.S_NOINIT
@@ -95,6 +226,8 @@ class dumpMifare_1k:
 
     #data of block 0 of secor 0
     class head:
+        __slots__ = ("UID", "BCC", "SAK", "SIGN")
+
         def __init__(self):
             self.UID  = bytearray(4)  #(0-3) first 4 bytes (unique ID of card)
             self.BCC  = 0x00          #(4-4) 4th byte (ecc of UID)
@@ -113,6 +246,8 @@ class dumpMifare_1k:
 
     #data of trailer block (3) of each sector
     class trailer:
+        __slots__ = ("keyA", "keyB", "accessBits", "GPB", "status")
+
         def __init__(self):
             self.keyA       = key(keyType.KT_A) 
             self.keyB       = key(keyType.KT_B) 
@@ -135,21 +270,210 @@ class dumpMifare_1k:
 
     #data of entire sector     
     class sector:
+        __slots__ = ("blocks", "trailer", "status")
+
         def __init__(self):
             self.blocks  = [dumpMifare_1k.block() for _ in range(MIFARE_1K_blocks_per_sector)]
             self.trailer = dumpMifare_1k.trailer()
             self.status  = status.S_NOINIT
     
     def __init__(self):
-        self.head    = dumpMifare_1k.head()
-        self.sectors = [dumpMifare_1k.sector() for _ in range(MIFARE_1K_total_sectors)]
-        self.ATR     = bytearray(0)
-        self.status  = status.S_NOINIT
+        self.head     = dumpMifare_1k.head()
+        self.sectors  = [dumpMifare_1k.sector() for _ in range(MIFARE_1K_total_sectors)]
+        self.ATR      = bytearray(0)
+        self.status   = status.S_NOINIT
+        self.restored = 0       #sectorMask of sectors with data restored from earlier tap of the card, not read in this one
+
+
+#bit mask of sector numbers (bit n is sector n), e.g. dumpMifare_1k.restored
+def sectorMask(sectors) -> int:
+    mask = 0
+    for nSector in sectors:
+        mask |= 1 << nSector
+    return mask
+
+
+############################################################################################################
+#code of status in compact status arrays (S_NOINIT is 0, so new zeroed array means "not initialized")
+STATUS_CODES = tuple(status)
+STATUS_INDEX = {s: code for code, s in enumerate(STATUS_CODES)}
+
+MIFARE_1K_total_blocks = MIFARE_1K_total_sectors * MIFARE_1K_blocks_per_sector
+MIFARE_1K_image_size   = MIFARE_1K_total_blocks * MIFARE_1K_bytes_per_block
+
+
+#full dump data for Mifare 1k card kept in one 1024 byte image and two status arrays.
+#Same interface as dumpMifare_1k (sectors[].blocks[].data/status, sectors[].trailer, head), but block, sector,
+#trailer and head are small views created on access: block data is memoryview slice of the image,
+#nothing is allocated per block while the dump is stored.
+class compactDumpMifare_1k:
+    __slots__ = ("image", "blockStatus", "sectorStatus", "ATR", "status", "restored")
+
+    #view of one block of the image
+    class blockView:
+        __slots__ = ("dump", "nBlock")
+
+        def __init__(self, dump, nBlock: int):
+            self.dump   = dump
+            self.nBlock = nBlock
+
+        @property
+        def data(self) -> memoryview:
+            offset = self.nBlock * MIFARE_1K_bytes_per_block
+            return memoryview(self.dump.image)[offset:offset + MIFARE_1K_bytes_per_block]
+
+        @data.setter
+        def data(self, data):
+            if len(data) != MIFARE_1K_bytes_per_block: #slice assignment of other length would resize the image
+                raise ValueError(f"block data must be {MIFARE_1K_bytes_per_block} bytes")
+            offset = self.nBlock * MIFARE_1K_bytes_per_block
+            self.dump.image[offset:offset + MIFARE_1K_bytes_per_block] = bytes(data)
+
+        @property
+        def status(self) -> status:
+            return STATUS_CODES[self.dump.blockStatus[self.nBlock]]
+
+        @status.setter
+        def status(self, value: status):
+            self.dump.blockStatus[self.nBlock] = STATUS_INDEX[value]
+
+        toStr = dumpMifare_1k.block.toStr
+
+    #view of block 0 of sector 0
+    class headView:
+        __slots__ = ("dump",)
+
+        def __init__(self, dump):
+            self.dump = dump
+
+        def _slice(self, begin: int, end: int) -> memoryview:
+            return memoryview(self.dump.image)[begin:end]
+
+        UID  = property(lambda self: self._slice(0, 4))
+        BCC  = property(lambda self: self.dump.image[4])
+        SAK  = property(lambda self: self._slice(5, 8))
+        SIGN = property(lambda self: self._slice(8, 16))
+
+        def read(self, block):
+            #head is a view of block 0, read data is already in place
+            if block.status == status.S_OK  and  getattr(block, "dump", None) is not self.dump:
+                self.dump.sectors[0].blocks[0].data = block.data
+
+        toStr = dumpMifare_1k.head.toStr
+
+    #view of trailer block (3) of a sector, trailer is processed when its block is read
+    class trailerView:
+        __slots__ = ("dump", "nBlock")
+
+        def __init__(self, dump, nSector: int):
+            self.dump   = dump
+            self.nBlock = nSector * MIFARE_1K_blocks_per_sector + MIFARE_1K_blocks_per_sector - 1
+
+        def _slice(self, begin: int, end: int) -> memoryview:
+            offset = self.nBlock * MIFARE_1K_bytes_per_block
+            return memoryview(self.dump.image)[offset + begin:offset + end]
+
+        keyA       = property(lambda self: key(keyType.KT_A, self._slice(0, 6)))
+        keyB       = property(lambda self: key(keyType.KT_B, self._slice(10, 16)))
+        accessBits = property(lambda self: self._slice(6, 9))
+        GPB        = property(lambda self: self.dump.image[self.nBlock * MIFARE_1K_bytes_per_block + 9])
+
+        #status of trailer is status of its block
+        @property
+        def status(self) -> status:
+            return STATUS_CODES[self.dump.blockStatus[self.nBlock]]
+
+        @status.setter
+        def status(self, value: status):
+            self.dump.blockStatus[self.nBlock] = STATUS_INDEX[value]
+
+        def processLastBlock(self, data):
+            block        = compactDumpMifare_1k.blockView(self.dump, self.nBlock)
+            block.data   = bytes(data) #copy: data may be a view of the same block
+            block.status = status.S_OK
+
+        toStr = dumpMifare_1k.trailer.toStr
+
+    #view of entire sector
+    class sectorView:
+        __slots__ = ("dump", "nSector", "blocks")
+
+        def __init__(self, dump, nSector: int):
+            nBlock0      = nSector * MIFARE_1K_blocks_per_sector
+            self.dump    = dump
+            self.nSector = nSector
+            self.blocks  = [compactDumpMifare_1k.blockView(dump, nBlock0 + i) for i in range(MIFARE_1K_blocks_per_sector)]
+
+        @property
+        def trailer(self):
+            return compactDumpMifare_1k.trailerView(self.dump, self.nSector)
+
+        @property
+        def status(self) -> status:
+            return STATUS_CODES[self.dump.sectorStatus[self.nSector]]
+
+        @status.setter
+        def status(self, value: status):
+            self.dump.sectorStatus[self.nSector] = STATUS_INDEX[value]
+
+    #sequence of sector views, len() and indexing like list of dumpMifare_1k.sector
+    class sectorList:
+        __slots__ = ("dump",)
+
+        def __init__(self, dump):
+            self.dump = dump
+
+        def __len__(self) -> int:
+            return MIFARE_1K_total_sectors
+
+        def __getitem__(self, nSector: int):
+            if nSector < 0:
+                nSector += MIFARE_1K_total_sectors
+            if not 0 <= nSector < MIFARE_1K_total_sectors:
+                raise IndexError("sector index out of range")
+            return compactDumpMifare_1k.sectorView(self.dump, nSector)
+
+        def __iter__(self):
+            return (compactDumpMifare_1k.sectorView(self.dump, n) for n in range(MIFARE_1K_total_sectors))
+
+    def __init__(self, image=None):
+        if image is not None  and  len(image) != MIFARE_1K_image_size:
+            raise ValueError(f"card image must be {MIFARE_1K_image_size} bytes")
+        self.image        = bytearray(image) if image is not None else bytearray(MIFARE_1K_image_size)
+        self.blockStatus  = bytearray(MIFARE_1K_total_blocks)  #STATUS_INDEX code of each block
+        self.sectorStatus = bytearray(MIFARE_1K_total_sectors)
+        self.ATR          = bytearray(0)
+        self.status       = status.S_NOINIT
+        self.restored     = 0       #see dumpMifare_1k.restored, int mask keeps dump without per-instance containers
+
+    @property
+    def head(self):
+        return compactDumpMifare_1k.headView(self)
+
+    @property
+    def sectors(self):
+        return compactDumpMifare_1k.sectorList(self)
+
+    #copy of dumpMifare_1k (e.g. to keep many read dumps in memory)
+    @classmethod
+    def fromDump(cls, dump: dumpMifare_1k) -> "compactDumpMifare_1k":
+        compact = cls()
+        for iSector, sector in enumerate(dump.sectors):
+            compactSector        = compact.sectors[iSector]
+            compactSector.status = sector.status
+            for block, compactBlock in zip(sector.blocks, compactSector.blocks):
+                if len(block.data) == MIFARE_1K_bytes_per_block:
+                    compactBlock.data = block.data
+                compactBlock.status = block.status
+        compact.ATR    = bytearray(dump.ATR)
+        compact.status = dump.status
+        return compact
 
 ############################################################################################################
 #dump sector
 def printSector(n : int, sector : dumpMifare_1k.sector):
-    print(f"sector {n:02d} {sector.status.value}; {sector.trailer.toStr()} -----------------------------------------------")
+    valid = sector.trailer.status != status.S_OK  or  decodeAccessBits(sector.trailer.accessBits)[0]
+    print(f"sector {n:02d} {sector.status.value}; {sector.trailer.toStr()}{'' if valid else ' (access bits are not valid)'} -----------------------------------------------")
     accessBitsStr = accessBitsToStr(sector.trailer.accessBits)
     for iBlock, block in enumerate(sector.blocks):
         print (f" {iBlock:02d} {block.toStr(iBlock + 1 < MIFARE_1K_blocks_per_sector)}  access: {accessBitsStr[iBlock]}")
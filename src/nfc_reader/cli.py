@@ -1,7 +1,23 @@
-from nfc_reader.do_card import startObserver  # type: ignore[import-not-found]
+import os
+import sys
+import argparse
 
+#modules of package import each other by plain names (import card_data), as when run as scripts
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from nfc_reader.do_card import startObserver, startUidObserver  # type: ignore[import-not-found]  # noqa: E402
+import card_data  # noqa: E402
 
-def main() -> None:
-    #Console entry point: waits for card and prints dump.
-    startObserver()
 
+def main() -> None:
+    #Console entry point: waits for card and prints dump of sector 0 (only this sector is read),
+    #or only UID of card in "uid" mode (GET DATA, no keys).
+    parser = argparse.ArgumentParser(prog="nfc-read")
+    parser.add_argument("mode", nargs="?", choices=["dump", "uid"], default="dump")
+    parser.add_argument("--keys", metavar="FILE", help="key file with keys per sector (lines: <sector|*> <A|B> <key hex>)")
+    parser.add_argument("--trace", metavar="FILE", help="append every APDU with response and timing to binary trace file")
+    args = parser.parse_args()
+    if args.mode == "uid":
+        startUidObserver(trace=args.trace)
+    else:
+        startObserver(keyMap=card_data.KeyMap.fromFile(args.keys) if args.keys else None, trace=args.trace)
@@ -1,15 +1,17 @@
 import sys
-import time 
 import queue
 import threading
+import smartcard.scard
 import smartcard.System
 from enum                      import Enum
 from smartcard.CardRequest     import CardRequest
 from smartcard.CardMonitoring  import CardMonitor, CardObserver
 
 import card_data
+import do_comm
 import do_prompt
 import do_wr
+import do_trace
 
 
 TIME_TO_WAIT_CARD = 12
@@ -33,7 +35,8 @@ class BackgroundInputProcessor:
         self.resultQueue = queue.Queue(maxsize=1)
         self.cancelEvent = threading.Event()
         self.lock        = threading.Lock()  
-        self.key         = card_data.key() #default Key B:FFFFFFFFFFFF for card operations
+        self.key         = card_data.key() #default Key A:FFFFFFFFFFFF for card operations
+        self.keyMap      = card_data.KeyMap([self.key]) #keys per sector, entered key is default for all sectors
         self.writeData   = do_prompt.PromptAnswer_ForWrite()
         self.nSector     = -1
 
@@ -60,7 +63,8 @@ class BackgroundInputProcessor:
                 case do_prompt.actions.A_READ_KEY:
                     isOk, keyType, keyData = do_prompt.askKey_FromTerminal(card_data.MIFARE_1K_bytes_per_key, self.cancelEvent)
                     if isOk:
-                        self.key = card_data.key(keyType, keyData)
+                        self.key = card_data.key(card_data.keyType(keyType), keyData)
+                        self.keyMap.defaultKeys = [self.key]
 
                 case do_prompt.actions.A_PRINT_SECTOR:
                     isOk, self.nSector = do_prompt.askSectorNumber_FromTerminal(card_data.MIFARE_1K_total_sectors, self.cancelEvent)
@@ -101,6 +105,129 @@ class BackgroundInputProcessor:
             self.inputThread = None
 
 #=================================
+#UID of card in the field (GET DATA), None if reader does not answer it
+def fnCardUID(connection) -> bytes:
+    isOk, uid = do_comm.fnGetUID(connection)
+    return bytes(uid) if isOk else None
+
+
+#Keeps one card connection open while the same card stays in the field.
+#First use connects (power-up, anticollision, select); following operations only check the handle
+#with SCardReconnect(LEAVE_CARD), which keeps card powered and selected. Connection is closed only
+#when observer reports card removal or insertion, or a different card is seen: all MIFARE 1K cards have
+#the same ATR, so the card is recognised by UID (GET DATA) before the connection is reused.
+#trace: file APDUs of every connection are appended to (do_trace.TraceRecorder), None for no recording
+class CardConnectionManager:
+    def __init__(self, trace: str = None) -> None:
+        self.lock       = threading.RLock() #held by operation using connection and by release on removal
+        self.connection = None
+        self.ATR        = None
+        self.UID        = None              #UID of card the connection was opened to (None if unknown)
+        self.reused     = 0                 #operations served without new connect
+        self.trace      = trace
+
+    #card: smartcard.Card.Card reported by CardMonitor, connection is created from it directly
+    #(without CardRequest polling); if card is not known, falls back to CardRequest
+    def acquire(self, ATR=None, card=None):
+        with self.lock:
+            if self.connection is not None:
+                if ATR is None  or  list(ATR) == list(self.ATR):
+                    try:
+                        self.connection.reconnect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_LEAVE_CARD)
+                        if self.UID is not None  and  fnCardUID(self.connection) == self.UID:
+                            self.reused += 1
+                            return self.connection
+                    except Exception as e:
+                        sys.stdout.write(f"\nReconnect error {e}\n")
+                self.release()
+            if card is not None:
+                cardConnection = card.createConnection()
+            else:
+                cardConnection = CardRequest(timeout=1).waitforcard().connection
+            if self.trace is not None:
+                cardConnection = do_trace.TraceRecorder(cardConnection, self.trace)
+            cardConnection.connect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_UNPOWER_CARD)
+            self.connection, self.ATR = cardConnection, cardConnection.getATR()
+            self.UID = fnCardUID(cardConnection)
+            return cardConnection
+
+    #close connection (card is unpowered by disposition given on connect)
+    def release(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                try:
+                    self.connection.disconnect()
+                except Exception as e:
+                    sys.stdout.write(f"\nDisconnect error {e}\n")
+                if isinstance(self.connection, do_trace.TraceRecorder):
+                    self.connection.close()
+                self.connection, self.ATR, self.UID = None, None, None
+
+
+#Dump facade for displaying: sector is read from card on first access while card is in the field
+#and stays cached in dump until card is removed (invalidate). Loading goes through CardProcessor
+#thread, so facade must not be used by operations running in that thread (they use dump directly).
+class LazyCardDump:
+    class sectorList:
+        def __init__(self, lazyDump: "LazyCardDump") -> None:
+            self.lazyDump = lazyDump
+
+        def __len__(self) -> int:
+            return len(self.lazyDump.dump.sectors)
+
+        def __getitem__(self, nSector: int):
+            self.lazyDump.load([nSector])
+            return self.lazyDump.dump.sectors[nSector]
+
+        def __iter__(self):
+            self.lazyDump.load(list(range(len(self)))) #all missing sectors by one load
+            return (self.lazyDump.dump.sectors[nSector] for nSector in range(len(self)))
+
+    #loadSectors(list of sector numbers) -> bool reads sectors from card into dump
+    def __init__(self, dump: card_data.dumpMifare_1k, loadSectors: callable) -> None:
+        self.dump        = dump
+        self.loadSectors = loadSectors
+        self.lock        = threading.Lock()
+
+    def isLoaded(self, nSector: int) -> bool:
+        return self.dump.sectors[nSector].status not in (card_data.status.S_NOINIT, card_data.status.S_NOT_READ)
+
+    #read sectors which are not cached yet, sector with read error is cached as well (not retried on each access)
+    def load(self, sectors: list[int]) -> bool:
+        with self.lock:
+            total   = len(self.dump.sectors)
+            missing = list(dict.fromkeys(n % total for n in sectors if -total <= n < total  and  not self.isLoaded(n)))
+            return len(missing) == 0  or  self.loadSectors(missing)
+
+    #print head and sectors, sectors missing in cache are read by one load (one service thread round trip
+    #and one connection check) before printing instead of one load per accessed sector
+    def printDump(self, sectors: list[int]) -> None:
+        self.load([0] + list(sectors))
+        card_data.printDump(self, sectors=sectors)
+
+    #card removed: cached data does not belong to card in the field anymore
+    def invalidate(self) -> None:
+        for sector in self.dump.sectors:
+            do_wr.fnMarkNotRead(sector)
+        self.dump.restored = 0
+
+    @property
+    def head(self) -> card_data.dumpMifare_1k.head:
+        self.load([0])
+        return self.dump.head
+
+    @property
+    def sectors(self) -> "LazyCardDump.sectorList":
+        return LazyCardDump.sectorList(self)
+
+    def __getattr__(self, name: str):
+        return getattr(self.dump, name) #ATR, status
+
+
+class cardMessage(Enum):
+    M_LOAD_SECTORS = "load sectors into dump" #sectors are in CardProcessor.sectorsToLoad
+
+
 class CardProcessor():
     class processData():
         def __init__(self) -> None:
@@ -110,47 +237,64 @@ class CardProcessor():
             self.blockData   = bytearray(card_data.MIFARE_1K_bytes_per_block)
 
     class LocalCardObeserver(CardObserver):
-        def __init__(self, insertEvent: threading.Event) -> None:
+        #onRemove: called after card removal when its connection is closed
+        #trace: APDU trace file of card connections (see CardConnectionManager)
+        def __init__(self, insertEvent: threading.Event, monitor: CardMonitor = None, onRemove: callable = None,
+                     trace: str = None) -> None:
             super().__init__()
             self.insertEvent    = insertEvent
-            self.monitor        = CardMonitor()
+            self.onRemove       = onRemove
+            self.monitor        = monitor if monitor is not None else CardMonitor()
             self.ATR            = bytearray(0)
+            self.card           = None #last inserted card, connection is created from it
             self.inputProcessor = BackgroundInputProcessor()
+            self.connections    = CardConnectionManager(trace)
             self.monitor.addObserver(self)
 
         #callback function for smartcard library (background thread)
         def update(self, observable, handlers) -> None:
             inserted, removed = handlers
-            if len(inserted) != 0: #we have a card inserted
-                sys.stdout.write(f"\rInserted: {card_data.bytes2str(inserted[0].atr)}\n")
-                self.insertEvent.set()
             if len(removed) != 0:
                 self.insertEvent.clear()
                 sys.stdout.write(f"\rRemoved: {card_data.bytes2str(removed[0].atr)}\n")
                 self.inputProcessor.cancel()
+                self.connections.release()
+                self.card = None
+                if self.onRemove is not None:
+                    self.onRemove()
+            if len(inserted) != 0: #we have a card inserted
+                self.connections.release() #connection of previous card, even if its removal was not reported
+                self.card, self.ATR = inserted[0], inserted[0].atr
+                self.insertEvent.set() #printing can wait
+                sys.stdout.write(f"\rInserted: {card_data.bytes2str(inserted[0].atr)}\n")
+
 
+        #wait for inserted card, only on insertion event set by update(), no polling of reader;
+        #must be called without connections.lock, update() takes it to release connection of previous card
+        def waitForCard(self, timeout: float = 1) -> bool:
+            if self.insertEvent.wait(timeout=timeout):
+                return True
+            sys.stdout.write("\rconnection timeout            ")
+            return False
 
-        def waitForConnection(self):
-            self.insertEvent.wait(timeout=1)
-            if self.insertEvent.is_set():
+        #return connection to inserted card, reusing the one opened by previous operation
+        def waitForConnection(self, timeout: float = 1):
+            if self.waitForCard(timeout):
                 try:
-                    cardRequest    = CardRequest(timeout=1)
-                    cardService    = cardRequest.waitforcard()
-                    cardConnection = cardService.connection
-                    cardConnection.connect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_UNPOWER_CARD)
-                    self.ATR = cardConnection.getATR()
-                    return True, cardRequest, cardService, cardConnection
+                    return True, self.connections.acquire(self.ATR, self.card)
                 except Exception as e:
                     sys.stdout.write(f"\nConnection error {e}\n")
-            else:
-                sys.stdout.write("\rconnection timeout            ")
-            return False, None, None, None
+            return False, None
 
 
     def executeCommunication(self, operation: callable):  
-        isOkConnection, cardRequest, cardService, cardConnection = self.observer.waitForConnection()
-        isOkResult = isOkConnection and operation(cardConnection)
-        isOkConnection and cardConnection.disconnect()
+        #connection stays open after operation, it is closed on card removal; card is waited for outside
+        #of connection lock, the lock is held only by acquiring connection and by operation using it
+        isOkResult = False
+        if self.observer.waitForCard():
+            with self.observer.connections.lock:
+                isOkConnection, cardConnection = self.observer.waitForConnection(timeout=0)
+                isOkResult = isOkConnection and operation(cardConnection)
         self.responceQueue.put(actResponce.fromBool(isOkResult))
 
 
@@ -165,27 +309,74 @@ class CardProcessor():
                     case do_prompt.actions.A_QUIT:
                         doContinue = False
                         self.observer.monitor.deleteObserver(self.observer)
+                        self.observer.connections.release()
                         self.responceQueue.put(actResponce.A_RESPONCE_OK)
 
                     case do_prompt.actions.A_READ:
-                        self.executeCommunication(lambda conn: do_wr.fnRead (conn, self.dump, self.observer.inputProcessor.key))
+                        if self.resumable is not None:
+                            self.executeCommunication(lambda conn: do_wr.fnReadResumable(conn, self.dump, self.observer.inputProcessor.keyMap,
+                                                                                         self.resumable, self.sectorsToRead, self.retry))
+                        else:
+                            self.executeCommunication(lambda conn: do_wr.fnRead (conn, self.dump, self.observer.inputProcessor.keyMap, self.sectorsToRead,
+                                                                                 retry=self.retry))
+
+                    case cardMessage.M_LOAD_SECTORS:
+                        self.executeCommunication(lambda conn: do_wr.fnRead (conn, self.dump, self.observer.inputProcessor.keyMap, self.sectorsToLoad, keepOthers=True,
+                                                                             retry=self.retry))
 
                     case do_prompt.actions.A_WRITE:
-                        self.executeCommunication(lambda conn: do_wr.fnWrite(conn, self.observer.inputProcessor.writeData, self.observer.inputProcessor.key))
+                        self.executeCommunication(lambda conn: do_wr.fnWrite(conn, self.observer.inputProcessor.writeData, self.observer.inputProcessor.keyMap,
+                                                                             self.dump, self.diffWrite, retry=self.retry))
+
+                    case do_prompt.actions.A_UID:
+                        self.executeCommunication(self.readUID)
 
                 self.messageQueue.task_done()
         except Exception as e:
             print(f"{e}")
             
             
-    def __init__(self) -> None:
+    #monitor: source of insert/remove events, CardMonitor by default (emulator.EmulatedReader offline)
+    #keyMap: keys per sector for card operations (e.g. card_data.KeyMap.fromFile), default key for all sectors otherwise
+    #diffWrite: A_WRITE sends WRITE only for blocks which differ from card (compared with dump, see do_wr.fnWrite)
+    #resumable: partial dumps by UID (do_wr.ResumableReads), A_READ of a card which left the field during reading
+    #continues with its missing sectors on the next tap
+    #retry: do_comm.RetryPolicy of READ/WRITE failed with transient error (a flaky block does not spoil whole dump)
+    #trace: file every APDU with response and timing is appended to (do_trace), for replay without the card
+    def __init__(self, monitor: CardMonitor = None, keyMap: card_data.KeyMap = None, diffWrite: bool = True,
+                 resumable: do_wr.ResumableReads = None, retry: do_comm.RetryPolicy = None, trace: str = None) -> None:
         self.messageQueue     = queue.Queue(maxsize=2)
         self.responceQueue    = queue.Queue(maxsize=2)
         self.dump             = card_data.dumpMifare_1k()
+        self.sectorsToRead    = [0]   #sectors read by A_READ: only what is going to be displayed
+        self.sectorsToLoad    = []
+        self.UID              = bytearray(0) #UID read by A_UID
+        self.diffWrite        = diffWrite
+        self.resumable        = resumable
+        self.retry            = retry if retry is not None else do_comm.RetryPolicy()
+        self.lazyDump         = LazyCardDump(self.dump, self.loadSectors) #dump for displaying, reads sectors on access
         self.dataToProcess    = CardProcessor.processData()
         self.cardInsertedEvent= threading.Event()
         self.selfTask         = threading.Thread(target=self.process, daemon=True)
-        self.observer         = CardProcessor.LocalCardObeserver(self.cardInsertedEvent)
+        self.observer         = CardProcessor.LocalCardObeserver(self.cardInsertedEvent, monitor, self.lazyDump.invalidate, trace)
+        if keyMap is not None:
+            self.observer.inputProcessor.keyMap = keyMap
+
+    #read only UID of card (GET DATA, no keys), service thread operation for A_UID;
+    #UID read by connection manager when it checked the card is used without another APDU
+    def readUID(self, connection) -> bool:
+        connections = self.observer.connections
+        uid         = connections.UID if connection is connections.connection else fnCardUID(connection)
+        self.UID    = bytearray(uid) if uid is not None else bytearray(0)
+        return uid is not None
+
+    #read sectors into dump by service thread, only while card is in the field (called by lazyDump)
+    def loadSectors(self, sectors: list[int]) -> bool:
+        if not self.cardInsertedEvent.is_set()  or  threading.current_thread() is self.selfTask:
+            return False
+        self.sectorsToLoad = list(sectors)
+        self.messageQueue.put(cardMessage.M_LOAD_SECTORS)
+        return fnWaitForResponce(self.responceQueue)
 
 #waiting while ervice thread process it's queue
 def fnWaitForResponce(queueResponce: queue.Queue) -> bool:
@@ -197,21 +388,48 @@ def fnWaitForResponce(queueResponce: queue.Queue) -> bool:
 def printWaiting(e: threading.Event, s=" "):
     if not e.is_set():
         sys.stdout.write(f"\rwaiting or card {s}")
-        time.sleep(0.4)
+        e.wait(0.4)
 
+#spinner period is only an upper bound of redraw: e.wait() returns as soon as observer reports insertion
 def WaitForCard(e: threading.Event):
     nWaitStr = 0
     waitStr = ["( )", "(.)", "(-)", "(+)", "(-)", "(.)"]
     sys.stdout.write("\n")
-    while not e.is_set():
-        time.sleep(0.3)
+    while not e.wait(0.3):
         if nWaitStr >= len(waitStr)  or  nWaitStr < 0:
             nWaitStr = 0
-        if not e.is_set():
-            sys.stdout.write(f"\rwaiting or card {waitStr[nWaitStr]}")
+        sys.stdout.write(f"\rwaiting or card {waitStr[nWaitStr]}")
         nWaitStr += 1
 
 
+#Console entry point: waits for card, reads and prints only requested sectors (head is in sector 0)
+def startObserver(sectors: list[int] = [0], monitor: CardMonitor = None, keyMap: card_data.KeyMap = None,
+                  trace: str = None) -> bool:
+    processor = CardProcessor(monitor, keyMap, trace=trace)
+    processor.selfTask.start()
+    WaitForCard(processor.cardInsertedEvent)
+    processor.sectorsToRead = list(sectors)
+    processor.messageQueue.put(do_prompt.actions.A_READ)
+    isOk = fnWaitForResponce(processor.responceQueue)
+    card_data.printDump(processor.dump, sectors=sectors)
+    processor.messageQueue.put(do_prompt.actions.A_QUIT)
+    fnWaitForResponce(processor.responceQueue)
+    return isOk
+
+
+#Console entry point for identification: waits for card and prints its UID (one APDU, no keys)
+def startUidObserver(monitor: CardMonitor = None, trace: str = None) -> bool:
+    processor = CardProcessor(monitor, trace=trace)
+    processor.selfTask.start()
+    WaitForCard(processor.cardInsertedEvent)
+    processor.messageQueue.put(do_prompt.actions.A_UID)
+    isOk = fnWaitForResponce(processor.responceQueue)
+    print(f"UID:{card_data.bytes2str(processor.UID)}" if isOk else "fail to read UID")
+    processor.messageQueue.put(do_prompt.actions.A_QUIT)
+    fnWaitForResponce(processor.responceQueue)
+    return isOk
+
+
 ###################################################
 if __name__ == "__main__":
     readers = smartcard.System.readers()
@@ -219,8 +437,8 @@ if __name__ == "__main__":
         print("no readers")
     else:
         print(readers[0])
-        # Create input manager for interruptible user input
-        mainCardProcessor = CardProcessor()
+        # Create input manager for interruptible user input, optional argument is key file (see card_data.KeyMap)
+        mainCardProcessor = CardProcessor(keyMap=card_data.KeyMap.fromFile(sys.argv[1]) if len(sys.argv) > 1 else None)
         mainCardProcessor.selfTask.start()
         action = do_prompt.actions.A_READ
 
@@ -228,14 +446,15 @@ if __name__ == "__main__":
             while mainCardProcessor.selfTask.is_alive():
                 # Skip action processing if action is None (input was cancelled in previous iteration)
                 if action is not None:
-                    if action == do_prompt.actions.A_READ  or action == do_prompt.actions.A_WRITE:
+                    if action in (do_prompt.actions.A_READ, do_prompt.actions.A_WRITE, do_prompt.actions.A_UID):
                         WaitForCard(mainCardProcessor.cardInsertedEvent)
 
                     match action:
                         case do_prompt.actions.A_READ:
+                            mainCardProcessor.sectorsToRead = [0]
                             mainCardProcessor.messageQueue.put(do_prompt.actions.A_READ)
                             if fnWaitForResponce(mainCardProcessor.responceQueue):
-                                card_data.printSector(0, mainCardProcessor.dump.sectors[0])
+                                card_data.printSector(0, mainCardProcessor.lazyDump.sectors[0])
 
                         case do_prompt.actions.A_READ_KEY:
                             pass #already read key from terminal in background thread
@@ -243,7 +462,7 @@ if __name__ == "__main__":
                         case do_prompt.actions.A_PRINT_SECTOR:
                             nSector = mainCardProcessor.observer.inputProcessor.nSector
                             if nSector >= 0 and nSector < card_data.MIFARE_1K_total_sectors:
-                                card_data.printSector(nSector, mainCardProcessor.dump.sectors[nSector])
+                                card_data.printSector(nSector, mainCardProcessor.lazyDump.sectors[nSector])
                             else:
                                 print("Invalid sector number")
 
@@ -251,9 +470,14 @@ if __name__ == "__main__":
                                 mainCardProcessor.messageQueue.put(do_prompt.actions.A_WRITE)
                                 fnWaitForResponce(mainCardProcessor.responceQueue)
 
+                        case do_prompt.actions.A_UID:
+                            mainCardProcessor.messageQueue.put(do_prompt.actions.A_UID)
+                            if fnWaitForResponce(mainCardProcessor.responceQueue):
+                                print(f"UID:{card_data.bytes2str(mainCardProcessor.UID)}")
+
                         case do_prompt.actions.A_PRINT_ALL:
                             all_sectors = list(range(card_data.MIFARE_1K_total_sectors))
-                            card_data.printDump(mainCardProcessor.dump, sectors=all_sectors)
+                            mainCardProcessor.lazyDump.printDump(all_sectors)
 
                         case do_prompt.actions.A_QUIT:
                             mainCardProcessor.messageQueue.put(do_prompt.actions.A_QUIT)
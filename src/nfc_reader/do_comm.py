@@ -1,9 +1,130 @@
+import time
+import weakref
+from enum import Enum
 from smartcard.CardConnection import CardConnection
+from smartcard.CardConnectionObserver import CardConnectionObserver
+
+# number of volatile key slots (P2 of LOAD KEYS) available on ACR122-class readers
+READER_KEY_SLOTS = 2
+
+# status words as single int (SW1 << 8 | SW2), as in TransmitResult.sw
+SW_OK          = 0x9000
+SW_NO_RESPONSE = 0x0000 # transmit raised, card did not answer
+SW_FAIL        = 0x6300 # operation failed: wrong key for AUTH/LOAD KEYS, RF error or lost authentication otherwise
+
+# status words of errors which may pass when the APDU is sent again (RF noise, lost authentication)
+TRANSIENT_SW = frozenset((SW_FAIL, 0x6281, 0x6400, 0x6F00))
+
+# Precomputed APDUs. Block address is one byte, so tables cover every block of MIFARE 1K (0-63)
+# and of MIFARE 4K (0-255). Entries are immutable bytes; they are turned into the list pyscard
+# expects only at the transmit boundary (fnDoTransmit, iter_transmit).
+APDU_TABLE_BLOCKS = 256
+BYTES_PER_BLOCK   = 16
+
+# READ BINARY: [CLA, INS, P1, BlockAddr]
+APDU_READ_BLOCK = tuple(bytes((0xFF, 0xB0, 0x00, nBlock)) for nBlock in range(APDU_TABLE_BLOCKS))
+
+# GENERAL AUTHENTICATE: APDU_AUTH_BLOCK[0 key A / 1 key B][key slot][block]
+APDU_AUTH_BLOCK = tuple(
+    tuple(tuple(bytes((0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, nBlock, keyID, nSlot)) for nBlock in range(APDU_TABLE_BLOCKS))
+          for nSlot in range(READER_KEY_SLOTS))
+    for keyID in (0x60, 0x61))
+
+# GET DATA: UID of card in the field, answered by the reader without keys or authentication
+APDU_GET_UID = bytes((0xFF, 0xCA, 0x00, 0x00, 0x00))
+
+# VALUE BLOCK OPERATION (FF D7) operations, P1..Lc are [0x00, BlockAddr, Lc]
+VALUE_OP_STORE     = 0x00
+VALUE_OP_INCREMENT = 0x01
+VALUE_OP_DECREMENT = 0x02
+VALUE_OP_RESTORE   = 0x03
+
+# READ VALUE BLOCK: [CLA, INS, P1, BlockAddr, Le]
+APDU_READ_VALUE = tuple(bytes((0xFF, 0xB1, 0x00, nBlock, 0x04)) for nBlock in range(APDU_TABLE_BLOCKS))
+
+# UPDATE BINARY of one block can be assembled in place in a buffer owned by the caller (newWriteBuffer)
+APDU_WRITE_HEADER = bytes((0xFF, 0xD6, 0x00, 0x00, BYTES_PER_BLOCK))
+
 
 def bytes2str(b) -> str:
     return "[" + " ".join(f"{ch:02X}" for ch in b) + "]"
 
 
+class apduError(Enum):
+    E_OK          = "OK"
+    E_TRANSIENT   = "TRANSIENT"    #may pass when sent again (see TRANSIENT_SW)
+    E_AUTH        = "AUTH"         #AUTH/LOAD KEYS refused: wrong key, never passes with the same key
+    E_REFUSED     = "REFUSED"      #definitive: wrong length/parameters, unsupported command
+    E_NO_RESPONSE = "NO RESPONSE"  #transmit raised: card left the field or reader is gone
+
+
+def classifyStatus(ins: int, sw: int) -> apduError:
+    if sw == SW_OK:
+        return apduError.E_OK
+    if sw == SW_NO_RESPONSE:
+        return apduError.E_NO_RESPONSE
+    if sw == SW_FAIL  and  ins in (0x82, 0x86):
+        return apduError.E_AUTH
+    return apduError.E_TRANSIENT if sw in TRANSIENT_SW else apduError.E_REFUSED
+
+
+class TransmitResult:
+    """
+    Result of one APDU: status word, response data, error class and timing.
+
+    sw1, sw2: status word (0x00, 0x00 when transmit raised)
+    data:     response data without status word (None if there is no answer)
+    error:    apduError class of the status word for the INS of the APDU
+    elapsed:  seconds spent in transmit
+    reason:   text of the exception when transmit raised
+    The result is true when the APDU succeeded, so it can be tested as the bool
+    the helpers (fnLoadKey, fnSelectBlock, fnWriteBlock, fnValue*) used to return.
+    """
+    __slots__ = ("sw1", "sw2", "data", "error", "elapsed", "reason")
+
+    def __init__(self, sw1: int, sw2: int, data, error: apduError, elapsed: float, reason: str = None):
+        self.sw1     = sw1
+        self.sw2     = sw2
+        self.data    = data
+        self.error   = error
+        self.elapsed = elapsed
+        self.reason  = reason
+
+    @property
+    def ok(self) -> bool:
+        return self.error == apduError.E_OK
+
+    @property
+    def sw(self) -> int:
+        return (self.sw1 << 8) | self.sw2
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __repr__(self) -> str:
+        return f"TransmitResult({self.sw1:02X} {self.sw2:02X} {self.error.value} {self.elapsed * 1000:.2f} ms)"
+
+
+def _result(apdu, sw: int, data, elapsed: float, reason: str = None) -> TransmitResult:
+    return TransmitResult(sw >> 8, sw & 0xFF, data, classifyStatus(apdu[1] if len(apdu) > 1 else 0, sw), elapsed, reason)
+
+
+def fnTransmit(connection, data) -> TransmitResult:
+    """
+    Send an APDU and return TransmitResult, nothing is printed.
+
+    Status word, error class and timing are returned to the caller, which decides
+    whether to retry, to try another key or to log (e.g. a wrong key is E_AUTH,
+    a card that left the field is E_NO_RESPONSE).
+    """
+    start = time.perf_counter()
+    try:
+        response, sw1, sw2 = connection.transmit(data if type(data) is list else list(data))
+    except Exception as e:
+        return _result(data, SW_NO_RESPONSE, None, time.perf_counter() - start, str(e))
+    return _result(data, (sw1 << 8) | sw2, response, time.perf_counter() - start)
+
+
 def fnDoTransmit(connection, data: list[bytes]) -> (bool, list[bytes]):
     """
     Send an APDU (Application Protocol Data Unit) command to the NFC card.
@@ -29,27 +150,140 @@ def fnDoTransmit(connection, data: list[bytes]) -> (bool, list[bytes]):
     
     Returns:
         tuple: (True, response_data) if command succeeded (SW1=0x90, SW2=0x00),
-               False otherwise.
+               (False, None) otherwise.
                
     Note:
         Status words (SW1, SW2) indicate command result:
         - 0x9000: Success (SW1=0x90, SW2=0x00)
         - Other values indicate various error conditions
+        Nothing is printed: callers which need status word, error class or
+        timing of the failure use fnTransmit.
+    """
+    result = fnTransmit(connection, data)
+    return (True, result.data) if result.ok else (False, None)
+
+
+def _rawTransmitter(connection):
+    """
+    Return function(apdu) -> (hresult, response) calling SCardTransmit directly on
+    the PC/SC handle of connection, or None when connection is not a PC/SC one
+    (decorated connections are unwrapped unless the decorator overrides transmit,
+    other connections use transmit()).
+    It skips the Python layers of CardConnection.transmit (observer notification,
+    error checking chain, response normalisation) for every APDU of a batch.
+    Observers of the connection are not notified about APDUs sent this way.
     """
     try:
-        # Transmit APDU command to card and receive response
-        # response: data bytes returned by the card
-        # sw1, sw2: status words indicating command result
-        response, sw1, sw2 = connection.transmit(data)
-        # Check for success status (0x9000 = OK)
-        if (sw1 == 0x90) and (sw2 == 0x00):
-            return True, response
-    except Exception as e:
-        print(f"transmit error: {e}")
-    return False, None
+        import smartcard.scard
+        from smartcard.CardConnectionDecorator   import CardConnectionDecorator
+        from smartcard.pcsc.PCSCCardConnection import PCSCCardConnection, translateprotocolheader
+        card = connection
+        while isinstance(card, CardConnectionDecorator):
+            if type(card).transmit is not CardConnectionDecorator.transmit:
+                return None #decorator handles APDUs itself (e.g. do_trace.TraceRecorder)
+            card = card.component
+        if not isinstance(card, PCSCCardConnection)  or  card.hcard is None:
+            return None
+        pci   = translateprotocolheader(card.getProtocol())
+        hcard = card.hcard
+        return lambda apdu: smartcard.scard.SCardTransmit(hcard, pci, apdu)
+    except Exception:
+        return None
+
+
+def iter_transmit(connection, apdus, stop_on_error: bool = True):
+    """
+    Send prebuilt APDUs one after another, yielding TransmitResult of each as soon as it arrives.
+
+    Every result carries the status word (SW_NO_RESPONSE when transmit raised), the
+    data bytes without status word (None if there is no answer), the error class and
+    the time of the APDU. Nothing is printed. With stop_on_error the iteration ends
+    after the first failed APDU; after an exception it always ends.
+    APDUs are taken from apdus only when the previous answer was consumed, so a caller
+    that stops iterating sends nothing more.
+    When the connection is a PC/SC one, SCardTransmit is called on its handle
+    directly (see _rawTransmitter), so connection observers do not see these APDUs:
+    callers keeping state (AuthSession, KeySlotCache) must invalidate it on errors.
+    """
+    raw = _rawTransmitter(connection)
+    for apdu in apdus:
+        start = time.perf_counter()
+        try:
+            if raw is not None:
+                hresult, response = raw(list(apdu))
+                if hresult != 0  or  len(response) < 2:
+                    yield _result(apdu, SW_NO_RESPONSE, None, time.perf_counter() - start, f"SCardTransmit {hresult:#x}")
+                    return
+                sw, data = ((response[-2] & 0xFF) << 8) | (response[-1] & 0xFF), response[:-2]
+            else:
+                data, sw1, sw2 = connection.transmit(apdu if type(apdu) is list else list(apdu))
+                sw = (sw1 << 8) | sw2
+        except Exception as e:
+            yield _result(apdu, SW_NO_RESPONSE, None, time.perf_counter() - start, str(e))
+            return
+        result = _result(apdu, sw, data, time.perf_counter() - start)
+        yield result
+        if stop_on_error  and  not result.ok:
+            return
+
+
+def transmit_batch(connection, apdus, stop_on_error: bool = True) -> list[TransmitResult]:
+    """
+    Send prebuilt APDUs one after another and collect their results.
+
+    Results are the ones of iter_transmit collected into list, so the result
+    list may be shorter than apdus when the batch stopped on error.
+    """
+    return list(iter_transmit(connection, apdus, stop_on_error))
+
+
+class RetryPolicy:
+    """
+    Which failed READ/WRITE APDUs are repeated, how many times and after which pause.
 
+    A failed data command drops the card authentication, so the engines (do_wr)
+    authenticate the sector again before the repeated APDU. Status words of
+    transient errors (RF noise, lost authentication: 63 00, 62 81, 64 00, 6F 00)
+    are retried; everything else (wrong length, unsupported command, 6A xx...) is
+    definitive, as is a card that does not answer at all (SW_NO_RESPONSE). An
+    AUTH refused with 63 00 means wrong key: AuthSession never retries it, so a
+    policy never costs extra AUTH attempts with a wrong key.
 
-def fnLoadKey(connection: CardConnection, keyData: list[bytes]) -> bool:
+    attempts: total number of tries of one APDU (1 = no retry)
+    backoff:  pause in seconds before the first retry, multiplied by factor for
+              every next one
+
+    shouldRetry only answers whether a retry is allowed; the caller which repeats
+    the APDU calls wait first, which pauses and counts the retry.
+    """
+    TRANSIENT_SW = TRANSIENT_SW
+
+    def __init__(self, attempts: int = 3, backoff: float = 0.005, factor: float = 2.0, transient=TRANSIENT_SW):
+        self.attempts  = attempts
+        self.backoff   = backoff
+        self.factor    = factor
+        self.transient = frozenset(transient)
+        self.retries   = 0  # APDUs repeated so far
+
+    def isTransient(self, sw: int) -> bool:
+        return sw in self.transient
+
+    def shouldRetry(self, sw: int, failures: int) -> bool:
+        #failures: how many times the APDU has failed so far
+        return failures < self.attempts  and  self.isTransient(sw)
+
+    def delay(self, failures: int) -> float:
+        return self.backoff * self.factor ** (failures - 1)
+
+    def wait(self, failures: int) -> None:
+        #pause before the retry of APDU failed failures times so far
+        delay = self.delay(failures)
+        if delay > 0:
+            time.sleep(delay)
+        self.retries += 1
+
+
+def fnLoadKey(connection: CardConnection, keyData: list[bytes], nSlot: int = 0) -> TransmitResult:
     """
     Load authentication key into the reader's volatile memory.
     
@@ -60,18 +294,101 @@ def fnLoadKey(connection: CardConnection, keyData: list[bytes]) -> bool:
     - 0xFF: CLA (escape class for PC/SC)
     - 0x82: INS (LOAD KEYS instruction)
     - 0x00: P1 (Key structure - 0x00 = volatile memory)
-    - 0x00: P2 (Key number/slot - 0x00 = first slot)
+    - nSlot: P2 (Key number/slot - 0x00 = first slot, 0x01 = second slot)
     - Lc: Length of key data (typically 6 bytes for MIFARE)
     - KeyData: The actual key bytes to load
+
+    Returns:
+        TransmitResult: true if the key was loaded; a refused key is E_AUTH
     """
     # APDU: [CLA, INS, P1, P2, Lc, KeyData...]
-    Result, _ = fnDoTransmit(connection, [0xFF, 0x82, 0x00, 0x00, len(keyData)] + list(keyData)) 
-    if not Result:
-        print(f"fail to load key: {bytes2str(keyData)}")
-    return Result
+    return fnTransmit(connection, [0xFF, 0x82, 0x00, nSlot, len(keyData)] + list(keyData))
+
+
+class KeySlotCache(CardConnectionObserver):
+    """
+    Remember which key bytes sit in each volatile key slot of the reader.
+
+    LOAD KEYS is a reader-side command: the key stays in the reader until it is
+    overwritten or the connection is dropped, so sending the same key again for
+    every sector is a wasted round trip. The cache is bound to one connection
+    (see keySlotsFor) and forgets everything on connect/disconnect events and on
+    any failed APDU reported by the connection. A new key goes into a free slot
+    or replaces the least recently used one (see slotFor), so two keys used in
+    turn (key A and key B of a sector) are loaded once each.
+    """
+    def __init__(self, connection: CardConnection):
+        self.connection = weakref.proxy(connection)  # cache lives in keySlotsFor registry, so no strong ref
+        self.slots      = [None] * READER_KEY_SLOTS     # bytes of key loaded into slot or None
+        self.lastUse    = [0] * READER_KEY_SLOTS        # use tick of slot, the smallest is least recently used
+        self.tick       = 0
+        self.hits       = 0                             # LOAD KEYS commands skipped
+        connection.addObserver(self)
+
+    def invalidate(self) -> None:
+        self.slots = [None] * READER_KEY_SLOTS
 
+    def touch(self, nSlot: int) -> None:
+        self.tick += 1
+        self.lastUse[nSlot] = self.tick
 
-def fnSelectBlock(connection: CardConnection, nBlockThrowCard: int, keyTypeAB: str) -> bool:
+    def findSlot(self, keyData) -> int:
+        #return slot number which already holds keyData or -1
+        keyBytes = bytes(keyData)
+        for nSlot, slotKey in enumerate(self.slots):
+            if slotKey == keyBytes:
+                return nSlot
+        return -1
+
+    def slotFor(self, keyData) -> (int, TransmitResult):
+        #return (slot holding keyData, result of LOAD KEYS or None if key was there), loading it into a free
+        #or the least recently used slot; slot is -1 when LOAD KEYS failed
+        nSlot  = self.findSlot(keyData)
+        result = None
+        if nSlot >= 0:
+            self.hits += 1
+        else:
+            free   = [n for n, slotKey in enumerate(self.slots) if slotKey is None]
+            nSlot  = free[0] if len(free) > 0 else min(range(READER_KEY_SLOTS), key=lambda n: self.lastUse[n])
+            result = self.loadKey(keyData, nSlot)
+            if result is not None  and  not result.ok:
+                return -1, result
+        self.touch(nSlot)
+        return nSlot, result
+
+    def loadKey(self, keyData, nSlot: int = 0) -> TransmitResult:
+        #load key into slot; returns result of LOAD KEYS or None when the slot already holds the same key
+        keyBytes = bytes(keyData)
+        if self.slots[nSlot] == keyBytes:
+            self.hits += 1
+            return None
+        self.slots[nSlot] = None
+        result = fnLoadKey(self.connection, keyData, nSlot)
+        if not result.ok:
+            self.invalidate()
+        else:
+            self.slots[nSlot] = keyBytes
+        return result
+
+    #callback from smartcard library for every event of the observed connection
+    def update(self, cardconnection, ccevent) -> None:
+        if ccevent.type in ("connect", "disconnect"):
+            self.invalidate()
+        elif ccevent.type == "response" and ccevent.args[-2:] != [0x90, 0x00]:
+            self.invalidate()
+
+
+_keySlotCaches = weakref.WeakKeyDictionary()
+
+def keySlotsFor(connection: CardConnection) -> KeySlotCache:
+    #return key slot cache bound to connection, creating it on first use
+    cache = _keySlotCaches.get(connection)
+    if cache is None:
+        cache = _keySlotCaches[connection] = KeySlotCache(connection)
+    return cache
+
+
+def fnSelectBlock(connection: CardConnection, nBlockThrowCard: int, keyTypeAB: str, nSlot: int = 0) -> TransmitResult:
     """
     Authenticate to a specific block/sector on the MIFARE card.
     
@@ -79,37 +396,130 @@ def fnSelectBlock(connection: CardConnection, nBlockThrowCard: int, keyTypeAB: s
     access to a sector. After successful authentication, read/write operations
     are allowed for that sector.
     
-    APDU command format: [0xFF, 0x86, 0x00, 0x00, 0x05, KeyType, KeyStruct, BlockAddr, 0x60, 0x00]
+    APDU command format: [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, BlockAddr, KeyType, KeySlot]
     - 0xFF: CLA (escape class for PC/SC)
-    - 0x86: INS (PERFORM SECURITY OPERATION)
+    - 0x86: INS (GENERAL AUTHENTICATE)
     - 0x00: P1 (not used, set to 0)
     - 0x00: P2 (not used, set to 0)
     - 0x05: Lc (length of command data = 5 bytes)
-    - KeyType: 0x00 = Key A, 0x01 = Key B
-    - KeyStruct: 0x00 = Key stored in volatile memory (from fnLoadKey)
+    - 0x01: Version of authenticate data structure
+    - 0x00: Block address MSB (always 0 for MIFARE Classic)
     - BlockAddr: Absolute block number across entire card (0-63 for MIFARE 1K)
-    - 0x60: Authentication mode (MIFARE authentication)
-    - 0x00: Additional parameter (not used)
+    - KeyType: 0x60 = Key A, 0x61 = Key B
+    - KeySlot: Reader key slot loaded by fnLoadKey (0x00 or 0x01)
     
     Args:
         connection: Active card connection
         nBlockThrowCard: Absolute block number (0-63 for MIFARE 1K)
         keyTypeAB: 'A' or 'B' to specify which key type to use
+        nSlot: Reader key slot holding the key
     
     Returns:
-        bool: True if authentication succeeded, False otherwise
+        TransmitResult: true if authentication succeeded; wrong key is E_AUTH
     """
-    # Determine key type: 0x00 for Key A, 0x01 for Key B
-    keyID = 0x00 if keyTypeAB.upper() == 'A' else 0x01
-    # APDU: [CLA, INS, P1, P2, Lc, KeyType, KeyStruct, BlockAddr, AuthMode, Param]
+    # APDU: [CLA, INS, P1, P2, Lc, Version, AddrMSB, AddrLSB, KeyType, KeySlot] from table, 0x60 for Key A, 0x61 for Key B
+    return fnTransmit(connection, APDU_AUTH_BLOCK[0 if keyTypeAB.upper() == 'A' else 1][nSlot][nBlockThrowCard])
 
-    Result, _ = fnDoTransmit(connection, [0xFF, 0x86, 0x00, 0x00, 0x05, keyID, 0x00, nBlockThrowCard, 0x60, 0x00])
-    if not Result:    
-        print(f"Authentication failed by key{keyTypeAB} for block:{nBlockThrowCard//4}:{nBlockThrowCard%4}")
-    return Result
 
+class AuthSession(CardConnectionObserver):
+    """
+    Track which sector the card is currently authenticated to, and with which key.
 
-def fnWriteBlock(connection: CardConnection, nBlockThrowCard: int, data: list[bytes]) -> bool:
+    MIFARE Classic keeps one authenticated sector at a time: the state survives
+    any number of READ/WRITE commands inside that sector and is lost when another
+    sector is authenticated, when any command fails or when the card is reset.
+    authenticate() skips GENERAL AUTHENTICATE while (sector, key type, key) is
+    unchanged and reuses reader key slots through KeySlotCache. The session is
+    bound to one connection (see sessionFor) and is invalidated by connection
+    events and failed APDUs; callers sending APDUs outside of the connection
+    transmit (or catching errors themselves) should call invalidate().
+    """
+    def __init__(self, connection: CardConnection):
+        self.connection = weakref.proxy(connection)
+        self.keySlots   = keySlotsFor(connection)
+        self.sector     = -1    # sector authenticated now or -1
+        self.keyTypeAB  = ""    # 'A' or 'B'
+        self.keyData    = None  # bytes of key used for authentication
+        self.keyError   = False # last authenticate() failed on LOAD KEYS, not on AUTH
+        self.lastResult = None  # TransmitResult of the APDU which failed last authenticate(), None after success
+        self.skipped    = 0     # AUTH commands skipped
+        connection.addObserver(self)
+
+    def invalidate(self) -> None:
+        self.sector, self.keyTypeAB, self.keyData = -1, "", None
+
+    def isAuthenticated(self, nBlockThrowCard: int, keyTypeAB: str, keyData) -> bool:
+        return (self.sector == nBlockThrowCard // 4  and  self.keyTypeAB == keyTypeAB.upper()
+                and  self.keyData == bytes(keyData))
+
+    def authenticate(self, nBlockThrowCard: int, keyTypeAB: str, keyData) -> bool:
+        #authenticate sector of block if card is not authenticated to it with the same key already
+        self.keyError, self.lastResult = False, None
+        if self.isAuthenticated(nBlockThrowCard, keyTypeAB, keyData):
+            self.skipped += 1
+            return True
+        self.invalidate()
+        nSlot, result = self.keySlots.slotFor(keyData)
+        if nSlot < 0:
+            self.keyError, self.lastResult = True, result
+            return False
+        result = fnSelectBlock(self.connection, nBlockThrowCard, keyTypeAB, nSlot)
+        if not result.ok:
+            self.invalidate()
+            self.lastResult = result
+            return False
+        self.sector, self.keyTypeAB, self.keyData = nBlockThrowCard // 4, keyTypeAB.upper(), bytes(keyData)
+        return True
+
+    @property
+    def lastError(self) -> apduError:
+        #error class of the APDU which failed last authenticate(), None after success
+        return self.lastResult.error if self.lastResult is not None else None
+
+    #callback from smartcard library for every event of the observed connection
+    def update(self, cardconnection, ccevent) -> None:
+        if ccevent.type in ("connect", "reconnect", "disconnect"):
+            self.invalidate()
+        elif ccevent.type == "response" and ccevent.args[-2:] != [0x90, 0x00]:
+            self.invalidate()
+
+
+_authSessions = weakref.WeakKeyDictionary()
+
+def sessionFor(connection: CardConnection) -> AuthSession:
+    #return authentication session bound to connection, creating it on first use
+    session = _authSessions.get(connection)
+    if session is None:
+        session = _authSessions[connection] = AuthSession(connection)
+    return session
+
+
+#APDU builders for batches (transmit_batch) and for fnWriteBlock/fnReadBlock
+def newWriteBuffer() -> bytearray:
+    #buffer of one full block UPDATE BINARY APDU for apduWriteBlock
+    return bytearray(APDU_WRITE_HEADER) + bytearray(BYTES_PER_BLOCK)
+
+def apduWriteBlock(nBlockThrowCard: int, data, buffer: bytearray = None) -> bytearray:
+    """
+    Return UPDATE BINARY APDU [CLA, INS, P1, BlockAddr, Lc, Data...].
+
+    With buffer (newWriteBuffer) a full block is copied into it and the same buffer
+    is returned on every call: send it before building the next write APDU with the
+    same buffer (pass a generator, not a list, to transmit_batch). Without buffer,
+    or for data which is not a full block, a new APDU is returned.
+    """
+    if buffer is None  or  len(data) != BYTES_PER_BLOCK:
+        return bytearray((0xFF, 0xD6, 0x00, nBlockThrowCard, len(data))) + bytes(data)
+    buffer[3]  = nBlockThrowCard
+    buffer[5:] = data
+    return buffer
+
+def apduReadBlock(nBlockThrowCard: int) -> bytes:
+    # APDU: [CLA, INS, P1, BlockAddr]
+    return APDU_READ_BLOCK[nBlockThrowCard]
+
+
+def fnWriteBlock(connection: CardConnection, nBlockThrowCard: int, data: list[bytes]) -> TransmitResult:
     """
     Write data to a block on the MIFARE card.
     
@@ -130,13 +540,9 @@ def fnWriteBlock(connection: CardConnection, nBlockThrowCard: int, data: list[by
         data: List of bytes to write (must be 16 bytes for MIFARE 1K)
     
     Returns:
-        bool: True if write succeeded, False otherwise
+        TransmitResult: true if write succeeded
     """
-    # APDU: [CLA, INS, P1, BlockAddr, Lc, Data...]
-    Result, _ = fnDoTransmit(connection, [0xFF, 0xD6, 0x00, nBlockThrowCard, len(data)] + data)
-    if not Result:
-        print(f"fail to write block: {nBlockThrowCard//4}:{nBlockThrowCard%4}")
-    return Result
+    return fnTransmit(connection, apduWriteBlock(nBlockThrowCard, data))
 
 def fnReadBlock(connection: CardConnection, nBlockThrowCard: int) -> (bool, list[bytes]):
     """
@@ -159,5 +565,103 @@ def fnReadBlock(connection: CardConnection, nBlockThrowCard: int) -> (bool, list
     
     Returns: tuple: (True, response_data) if read succeeded, (False, None) otherwise
     """
-    # APDU: [CLA, INS, P1, BlockAddr, Length]
-    return fnDoTransmit(connection, [0xFF, 0xB0, 0x00, nBlockThrowCard])
+    return fnDoTransmit(connection, apduReadBlock(nBlockThrowCard))
+
+
+def apduValueBlock(nBlockThrowCard: int, op: int, value: int) -> bytes:
+    # APDU: [CLA, INS, P1, BlockAddr, Lc, VB_OP, VB_Value (4 bytes, signed, MSB first)]
+    if not -(1 << 31) <= value < (1 << 31):
+        raise ValueError(f"value {value} does not fit value block")
+    return bytes((0xFF, 0xD7, 0x00, nBlockThrowCard, 0x05, op)) + value.to_bytes(4, "big", signed=True)
+
+def fnValueStore(connection: CardConnection, nBlockThrowCard: int, value: int) -> TransmitResult:
+    """
+    Format a data block as value block holding value (see card_data.encodeValueBlock).
+
+    APDU command format: [0xFF, 0xD7, 0x00, BlockAddr, 0x05, 0x00, Value (4 bytes, MSB first)]
+    The reader writes the block in value block format, so it needs the write right of the
+    block. The address byte of the block is set to BlockAddr.
+
+    Returns:
+        TransmitResult: true if the block was written
+    """
+    return fnTransmit(connection, apduValueBlock(nBlockThrowCard, VALUE_OP_STORE, value))
+
+def fnValueIncrement(connection: CardConnection, nBlockThrowCard: int, value: int) -> TransmitResult:
+    """
+    Add value to value block on the card: INCREMENT + TRANSFER into the same block.
+
+    APDU command format: [0xFF, 0xD7, 0x00, BlockAddr, 0x05, 0x01, Value (4 bytes, MSB first)]
+    The card computes the new value itself: no read-modify-write round trips, and the card
+    refuses the operation (block unchanged) when the block is not in value block format,
+    when the result overflows or when access bits forbid increment (or transfer) with the
+    key used for authentication. The sector must be authenticated first.
+
+    Returns:
+        TransmitResult: true if the value block was updated
+    """
+    return fnTransmit(connection, apduValueBlock(nBlockThrowCard, VALUE_OP_INCREMENT, value))
+
+def fnValueDecrement(connection: CardConnection, nBlockThrowCard: int, value: int) -> TransmitResult:
+    """
+    Subtract value from value block on the card: DECREMENT + TRANSFER into the same block.
+
+    APDU command format: [0xFF, 0xD7, 0x00, BlockAddr, 0x05, 0x02, Value (4 bytes, MSB first)]
+    Checks are the ones of fnValueIncrement, with the decrement right of the block.
+
+    Returns:
+        TransmitResult: true if the value block was updated
+    """
+    return fnTransmit(connection, apduValueBlock(nBlockThrowCard, VALUE_OP_DECREMENT, value))
+
+def fnValueRestore(connection: CardConnection, nSourceBlock: int, nTargetBlock: int) -> TransmitResult:
+    """
+    Copy value block to other block of the same sector: RESTORE + TRANSFER.
+
+    APDU command format: [0xFF, 0xD7, 0x00, SourceBlockAddr, 0x02, 0x03, TargetBlockAddr]
+    The reader has no separate TRANSFER command: every value operation ends with TRANSFER,
+    RESTORE transfers the source value into the target block (backup of balance). Both
+    blocks must be in the authenticated sector, the source in value block format.
+
+    Returns:
+        TransmitResult: true if the target block was written
+    """
+    return fnTransmit(connection, bytes((0xFF, 0xD7, 0x00, nSourceBlock, 0x02, VALUE_OP_RESTORE, nTargetBlock)))
+
+def fnValueRead(connection: CardConnection, nBlockThrowCard: int) -> (TransmitResult, int):
+    """
+    Read value of value block.
+
+    APDU command format: [0xFF, 0xB1, 0x00, BlockAddr, 0x04]
+    The reader checks the value block format and answers with the value (4 bytes, MSB first).
+
+    Returns: tuple: (TransmitResult, value); value is None when the read failed or the
+             answer is not 4 bytes long
+    """
+    result = fnTransmit(connection, APDU_READ_VALUE[nBlockThrowCard])
+    if not result.ok  or  len(result.data) != 4:
+        return result, None
+    return result, int.from_bytes(bytes(result.data), "big", signed=True)
+
+
+def fnGetUID(connection: CardConnection) -> (bool, list[bytes]):
+    """
+    Read UID of the card in the field.
+
+    PC/SC GET DATA is answered by the reader from the anticollision data, so it
+    needs no key, no authentication and works whatever the sector 0 key is.
+    One APDU instead of LOAD KEYS + AUTH + READ of block 0.
+
+    APDU command format: [0xFF, 0xCA, P1, 0x00, Le]
+    - 0xFF: CLA (escape class for PC/SC)
+    - 0xCA: INS (GET DATA instruction)
+    - 0x00: P1 (0x00 = UID, 0x01 = historical bytes of ATS)
+    - 0x00: P2 (not used)
+    - 0x00: Le (full length: 4, 7 or 10 bytes of UID)
+
+    Args:
+        connection: Active card connection
+
+    Returns: tuple: (True, UID bytes) if command succeeded, (False, None) otherwise
+    """
+    return fnDoTransmit(connection, APDU_GET_UID)
@@ -11,6 +11,7 @@ class actions(Enum):
     A_PRINT_ALL      = "print all data"
     A_PRINT_SECTOR   = "print single sector"
     A_WRITE          = "write block interactively"
+    A_UID            = "read UID only (no keys)"
     A_QUIT           = "quit"
 
 class writeDatType(Enum):
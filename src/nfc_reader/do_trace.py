@@ -0,0 +1,156 @@
+import time
+import struct
+from smartcard.CardConnection          import CardConnection
+from smartcard.CardConnectionDecorator import CardConnectionDecorator
+from smartcard.Exceptions              import CardConnectionException
+
+import do_comm
+
+############################################################################################################
+#APDU trace file: append-only binary file, one header and records of APDUs in order of sending:
+#    header: TRACE_MAGIC (6 bytes) version (1 byte) reserved (1 byte)
+#    record: time (uint64, microseconds since epoch, when APDU was sent), elapsed (uint32, microseconds
+#            in transmit), SW (uint16, SW1 << 8 | SW2, do_comm.SW_NO_RESPONSE when transmit raised),
+#            command length (uint16), response length (uint16), command bytes, response bytes
+#All numbers are little endian. A record is written by one write() and flushed, so a trace of a process
+#killed in the middle of a tap ends with the last answered APDU (a truncated record is ignored on reading).
+TRACE_MAGIC   = b"NFCTRC"
+TRACE_VERSION = 1
+TRACE_HEADER  = struct.Struct("<6sBx")
+TRACE_RECORD  = struct.Struct("<QIHHH")
+
+
+class TraceError(Exception):
+    pass
+
+
+class TraceRecord:
+    __slots__ = ("time", "elapsed", "sw", "command", "response")
+
+    def __init__(self, time: float, elapsed: float, sw: int, command: bytes, response: bytes):
+        self.time     = time      #seconds since epoch
+        self.elapsed  = elapsed   #seconds in transmit
+        self.sw       = sw
+        self.command  = command
+        self.response = response
+
+    def toBytes(self) -> bytes:
+        return (TRACE_RECORD.pack(round(self.time * 1e6), min(round(self.elapsed * 1e6), 0xFFFFFFFF), self.sw,
+                                  len(self.command), len(self.response)) + self.command + self.response)
+
+    def __repr__(self) -> str:
+        return f"TraceRecord({do_comm.bytes2str(self.command)} -> {self.sw:04X} {self.elapsed * 1000:.2f} ms)"
+
+
+#decode trace file contents into list of TraceRecord
+def decodeTrace(data: bytes) -> list[TraceRecord]:
+    if len(data) < TRACE_HEADER.size:
+        raise TraceError("trace too short")
+    magic, version = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise TraceError("not an APDU trace")
+    if version != TRACE_VERSION:
+        raise TraceError(f"unsupported trace version {version}")
+    records = []
+    offset  = TRACE_HEADER.size
+    while offset + TRACE_RECORD.size <= len(data):
+        timeUs, elapsedUs, sw, nCommand, nResponse = TRACE_RECORD.unpack_from(data, offset)
+        offset += TRACE_RECORD.size
+        if offset + nCommand + nResponse > len(data):
+            break   #record cut by crash of recording process
+        command  = bytes(data[offset:offset + nCommand])
+        response = bytes(data[offset + nCommand:offset + nCommand + nResponse])
+        offset  += nCommand + nResponse
+        records.append(TraceRecord(timeUs / 1e6, elapsedUs / 1e6, sw, command, response))
+    return records
+
+
+def readTrace(path: str) -> list[TraceRecord]:
+    with open(path, "rb") as f:
+        return decodeTrace(f.read())
+
+
+############################################################################################################
+#Recording wrapper of card connection: every APDU sent through transmit (do_comm functions, engines of do_wr)
+#is appended to trace file with its response, SW and timing. Batches of do_comm.iter_transmit go through
+#transmit too: raw SCardTransmit is not used for a decorator which handles APDUs itself. Events and observers
+#are the ones of the wrapped connection.
+#    connection = TraceRecorder(card.createConnection(), "tap.trace")
+class TraceRecorder(CardConnectionDecorator):
+    def __init__(self, connection: CardConnection, path: str):
+        super().__init__(connection)
+        self.path    = path
+        self.file    = open(path, "ab")
+        self.records = 0    #APDUs recorded by this recorder
+        if self.file.tell() == 0:
+            self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+            self.file.flush()
+
+    def transmit(self, command, protocol=None):
+        sent  = time.time()
+        start = time.perf_counter()
+        try:
+            response, sw1, sw2 = self.component.transmit(command, protocol)
+        except Exception:
+            self.record(TraceRecord(sent, time.perf_counter() - start, do_comm.SW_NO_RESPONSE, bytes(command), b""))
+            raise
+        self.record(TraceRecord(sent, time.perf_counter() - start, (sw1 << 8) | sw2, bytes(command), bytes(response)))
+        return response, sw1, sw2
+
+    def record(self, record: TraceRecord) -> None:
+        if self.file is not None:
+            self.file.write(record.toBytes())
+            self.file.flush()
+            self.records += 1
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+############################################################################################################
+#Connection answering from trace: APDUs must come in recorded order, each one gets its recorded response
+#after recorded transmit time multiplied by scale (1.0 original timing, 0 no waiting). An APDU which differs
+#from the recorded one raises TraceError, so a replayed session fails as soon as code under test changes
+#what it sends (do_comm catches transmit errors, so the mismatch is also kept in error); an APDU recorded
+#without answer raises CardConnectionException as removed card did.
+#    connection = ReplayConnection(readTrace("tap.trace"), scale=0)
+#    connection.connect()
+#    do_wr.fnRead(connection, dump, key)
+class ReplayConnection(CardConnection):
+    def __init__(self, records: list[TraceRecord], scale: float = 1.0, reader: str = "Trace replay"):
+        super().__init__(reader)
+        self.records  = list(records)
+        self.scale    = scale
+        self.position = 0   #index of next record
+        self.waited   = 0.0 #seconds spent waiting for recorded timing
+        self.error    = None #first mismatch of sent and recorded APDUs
+
+    @classmethod
+    def fromFile(cls, path: str, scale: float = 1.0) -> "ReplayConnection":
+        return cls(readTrace(path), scale)
+
+    def remaining(self) -> int:
+        return len(self.records) - self.position
+
+    def doTransmit(self, command, protocol=None):
+        if self.position >= len(self.records):
+            return self.mismatch(f"APDU {do_comm.bytes2str(command)} after end of trace")
+        record = self.records[self.position]
+        if bytes(command) != record.command:
+            return self.mismatch(f"APDU {self.position}: {do_comm.bytes2str(command)}, "
+                                 f"recorded {do_comm.bytes2str(record.command)}")
+        self.position += 1
+        delay = record.elapsed * self.scale
+        if delay > 0:
+            time.sleep(delay)
+            self.waited += delay
+        if record.sw == do_comm.SW_NO_RESPONSE:
+            raise CardConnectionException("Card removed")
+        return list(record.response), record.sw >> 8, record.sw & 0xFF
+
+    def mismatch(self, message: str):
+        if self.error is None:
+            self.error = message
+        raise TraceError(message)
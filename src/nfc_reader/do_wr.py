@@ -1,4 +1,6 @@
+import os
 import sys
+import json
 import smartcard.scard
 from smartcard.CardRequest import CardRequest
 from smartcard.CardConnection import CardConnection
@@ -7,74 +9,464 @@ import card_data
 import do_prompt
 import do_comm
 
+VERIFY_RETRIES = 2 #how many times block which does not match after write is written again (verify mode, default policy)
+
 def printFailBlocks(nSector: int, sector: card_data.dumpMifare_1k.sector):
     failBlocks = []
     for iBlock, block in enumerate(sector.blocks):
-        if block.status != card_data.status.S_OK:
+        if block.status not in (card_data.status.S_OK, card_data.status.S_NO_ACCESS):
             failBlocks.append(iBlock)
     if len(failBlocks) > 0:
         print(f"Sector[{nSector}]: fail blocks {failBlocks}")
         
 ############################################################################################################
-#read all card info
-def fnRead(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key) -> bool:
-    totalBlocksToRead = len(dump.sectors) * len(dump.sectors[0].blocks)
-    totalFailCount    = 0
-    totalBlocksRead   = 0
-    try:
-        for iSector, sector in enumerate(dump.sectors):
-            nBlock0 = iSector * card_data.MIFARE_1K_blocks_per_sector
-            if not do_comm.fnLoadKey(connection, key.keyData):
-                sector.status = card_data.status.S_KEY_ERROR
-                totalFailCount += 1
+#candidate keys for sector from key plan: one card_data.key for all sectors, card_data.KeyMap
+#list of keys for all sectors, or mapping {sector: key or [keys]} (empty list if sector has no key)
+def keysForSector(key_plan, nSector: int) -> list[card_data.key]:
+    if isinstance(key_plan, card_data.key):
+        return [key_plan]
+    if isinstance(key_plan, card_data.KeyMap):
+        return key_plan.candidates(nSector)
+    if isinstance(key_plan, list):
+        return key_plan
+    keys = key_plan.get(nSector)
+    if keys is None:
+        return []
+    return [keys] if isinstance(keys, card_data.key) else list(keys)
+
+
+#authenticate sector with first candidate key accepted by card.
+#Returns (key, status): key is None and status is S_KEY_ERROR (no key / keys not accepted by reader)
+#or S_AUTH_ERROR (card refused keys) when no key fits.
+def authenticateSector(session: do_comm.AuthSession, nBlock0: int, key_plan) -> (card_data.key, card_data.status):
+    keyError = True
+    nSector  = nBlock0 // card_data.MIFARE_1K_blocks_per_sector
+    for key in keysForSector(key_plan, nSector):
+        if session.authenticate(nBlock0, key.keyType.value, key.keyData):
+            if isinstance(key_plan, card_data.KeyMap):
+                key_plan.success(nSector, key)
+            return key, card_data.status.S_OK
+        keyError = keyError  and  session.keyError
+        if session.lastError == do_comm.apduError.E_NO_RESPONSE:
+            break   #card left the field: no other key can pass
+    return None, card_data.status.S_KEY_ERROR if keyError else card_data.status.S_AUTH_ERROR
+
+
+#Search of sector keys among known (historic) keys. Candidates are tried in order of hits (how many
+#sectors each key opened so far), a key which opened the sector of the same card (UID) before is tried first.
+#Search goes over the open connection through AuthSession: a candidate costs AUTH (and LOAD KEYS when
+#the key is not in a reader slot yet), never a reconnect. UID -> {sector: key} cache and hits are kept
+#in JSON file: {"hits": {"A:FFFFFFFFFFFF": 12}, "cards": {"DEADBEEF": {"1": "B:A0A1A2A3A4A5"}}}
+class KeySearch:
+    #key plan of one card: KeyMap which orders candidates and learns keys that opened sectors
+    class cardPlan(card_data.KeyMap):
+        def __init__(self, search: "KeySearch", uid: str = None):
+            super().__init__(search.candidates)
+            self.search = search
+            self.uid    = uid
+
+        def candidates(self, nSector: int) -> list[card_data.key]:
+            keys  = sorted(self.defaultKeys, key=lambda k: -self.search.hits.get(KeySearch.keyToStr(k), 0))
+            known = self.search.cards.get(self.uid, {}).get(str(nSector)) if self.uid is not None else None
+            if known is not None:
+                keys.sort(key=lambda k: KeySearch.keyToStr(k) != known) #stable: cached key first
+            return keys
+
+        def success(self, nSector: int, k: card_data.key) -> None:
+            self.search.record(self.uid, nSector, k)
+
+    def __init__(self, candidates: list[card_data.key], cacheFile: str = None):
+        self.candidates = list(candidates)
+        self.cacheFile  = cacheFile
+        self.hits       = {}   #"A:FFFFFFFFFFFF" -> number of sectors opened
+        self.cards      = {}   #UID hex -> {"sector": "A:FFFFFFFFFFFF"}
+        self.changed    = False
+        if cacheFile is not None:
+            self.load()
+
+    @staticmethod
+    def keyToStr(k: card_data.key) -> str:
+        return f"{k.keyType.value}:{bytes(k.keyData).hex().upper()}"
+
+    def load(self) -> None:
+        try:
+            with open(self.cacheFile, encoding="utf-8") as f:
+                cache = json.load(f)
+            self.hits, self.cards = dict(cache.get("hits", {})), dict(cache.get("cards", {}))
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError) as e:
+            print(f"key cache {self.cacheFile} is ignored: {e}")
+
+    #write cache file if something was learned (temporary file + rename, cache is never half written)
+    def save(self) -> None:
+        if self.cacheFile is None  or  not self.changed:
+            return
+        tmpFile = self.cacheFile + ".tmp"
+        with open(tmpFile, "w", encoding="utf-8") as f:
+            json.dump({"hits": self.hits, "cards": self.cards}, f, indent=1, sort_keys=True)
+        os.replace(tmpFile, self.cacheFile)
+        self.changed = False
+
+    def record(self, uid: str, nSector: int, k: card_data.key) -> None:
+        keyStr = KeySearch.keyToStr(k)
+        self.hits[keyStr] = self.hits.get(keyStr, 0) + 1
+        if uid is not None:
+            self.cards.setdefault(uid, {})[str(nSector)] = keyStr
+        self.changed = True
+
+    def planFor(self, uid) -> "KeySearch.cardPlan":
+        return KeySearch.cardPlan(self, bytes(uid).hex().upper() if uid is not None else None)
+
+    #plan for card in the field, UID is read with GET DATA (one APDU, no keys)
+    def planForConnection(self, connection: CardConnection) -> "KeySearch.cardPlan":
+        isOk, uid = do_comm.fnGetUID(connection)
+        return self.planFor(uid if isOk else None)
+
+    #find key of each sector (AUTH only, no reads), returns {sector: key} for sectors opened
+    def findKeys(self, connection: CardConnection, sectors=None) -> dict[int, card_data.key]:
+        plan    = self.planForConnection(connection)
+        session = do_comm.sessionFor(connection)
+        found   = {}
+        for nSector in (range(card_data.MIFARE_1K_total_sectors) if sectors is None else sectors):
+            key, _ = authenticateSector(session, nSector * card_data.MIFARE_1K_blocks_per_sector, plan)
+            if key is not None:
+                found[nSector] = key
+        self.save()
+        return found
+
+
+#read card with keys found by key search, learned keys are saved to cache file
+def fnReadWithKeySearch(connection: CardConnection, dump: card_data.dumpMifare_1k, search: KeySearch, sectors=None) -> bool:
+    result = fnRead(connection, dump, search.planForConnection(connection), sectors)
+    search.save()
+    return result
+
+
+#yield (block in sector, status, data) of blocks of one sector (all by default) while READ BINARY answers arrive.
+#A failed block drops card authentication, so the rest of blocks is sent again after re-authentication;
+#with retry policy (do_comm.RetryPolicy) a block failed with transient status word is sent again first.
+def _iterSectorBlocks(connection: CardConnection, session: do_comm.AuthSession, nBlock0: int, key: card_data.key,
+                      blocks=range(card_data.MIFARE_1K_blocks_per_sector), retry: do_comm.RetryPolicy = None):
+    pending  = list(blocks)
+    failures = {} #block -> number of failed READ
+    while len(pending) > 0:
+        if not session.authenticate(nBlock0, key.keyType.value, key.keyData):
+            break
+        answered = 0
+        cardGone = False
+        retried  = None
+        for iBlock, result in zip(pending, do_comm.iter_transmit(connection, (do_comm.APDU_READ_BLOCK[nBlock0 + iBlock] for iBlock in pending))):
+            answered += 1
+            if result.ok:
+                yield iBlock, card_data.status.S_OK, result.data
             else:
-                if not do_comm.fnSelectBlock(connection, nBlock0, key.keyType.value):
-                    sector.status = card_data.status.S_AUTH_ERROR
-                    totalFailCount += 1
+                session.invalidate() #batch bypasses connection observers
+                cardGone = result.error == do_comm.apduError.E_NO_RESPONSE
+                failures[iBlock] = failures.get(iBlock, 0) + 1
+                if retry is not None  and  retry.shouldRetry(result.sw, failures[iBlock]):
+                    retry.wait(failures[iBlock])
+                    retried = iBlock
                 else:
-                    failCount = 0
+                    yield iBlock, card_data.status.S_READ_ERROR, None
+        pending = pending[answered:]
+        if retried is not None:
+            pending.insert(0, retried)
+        if answered == 0  or  cardGone:
+            break
+    for iBlock in pending:
+        yield iBlock, card_data.status.S_READ_ERROR, None
+
+
+#Plan reading of data blocks by access bits of sector trailer.
+#Returns {key type: [blocks in sector]} for blocks readable with key types of available keys
+#(current key type first) and list of blocks no available key may read.
+def planSectorRead(conditions, keyTypes: list[card_data.keyType]) -> (dict, list[int]):
+    keyBUsable = card_data.keyType.KT_A.value not in card_data.TRAILER_RIGHTS[conditions[-1]][3] #readable key B does not authenticate
+    plan       = {keyType: [] for keyType in keyTypes}
+    forbidden  = []
+    for iBlock in range(card_data.MIFARE_1K_blocks_per_sector - 1):
+        rights = card_data.DATA_BLOCK_RIGHTS[conditions[iBlock]][0]
+        usable = [t for t in keyTypes if t.value in rights  and  (t == card_data.keyType.KT_A  or  keyBUsable)]
+        if len(usable) == 0:
+            forbidden.append(iBlock)
+        else:
+            plan[usable[0]].append(iBlock)
+    return plan, forbidden
+
+
+#read sector authenticated with key: trailer first, then data blocks by its access bits, every block
+#with the key type allowed to read it (one more AUTH only for blocks the first key may not read);
+#blocks no available key may read are yielded as S_NO_ACCESS without APDU. Trailer is yielded last.
+#Without readable valid access bits data blocks are read with key as they are.
+def _iterPlannedSectorBlocks(connection: CardConnection, session: do_comm.AuthSession, nBlock0: int,
+                             key: card_data.key, key_plan, retry: do_comm.RetryPolicy = None):
+    nTrailer = card_data.MIFARE_1K_blocks_per_sector - 1
+    trailer  = next(_iterSectorBlocks(connection, session, nBlock0, key, [nTrailer], retry))
+    valid    = False
+    if trailer[1] == card_data.status.S_OK:
+        valid, conditions = card_data.decodeAccessBits(trailer[2][6:9])
+    if not valid:
+        yield from _iterSectorBlocks(connection, session, nBlock0, key, range(nTrailer), retry)
+        yield trailer
+        return
+    candidates = keysForSector(key_plan, nBlock0 // card_data.MIFARE_1K_blocks_per_sector)
+    keyTypes   = [key.keyType] + [t for t in card_data.keyType if t != key.keyType  and  any(k.keyType == t for k in candidates)]
+    plan, forbidden = planSectorRead(conditions, keyTypes)
+    for keyType, blocks in plan.items():
+        if len(blocks) == 0:
+            continue
+        blockKey, authStatus = key, card_data.status.S_OK
+        if keyType != key.keyType:
+            blockKey, authStatus = authenticateSector(session, nBlock0, [k for k in candidates if k.keyType == keyType])
+        if blockKey is None:
+            for iBlock in blocks:
+                yield iBlock, authStatus, None
+        else:
+            yield from _iterSectorBlocks(connection, session, nBlock0, blockKey, blocks, retry)
+    for iBlock in forbidden:
+        yield iBlock, card_data.status.S_NO_ACCESS, None
+    yield trailer
+
+
+def iter_blocks(connection: CardConnection, key_plan, sectors=None, useAccessBits: bool = True,
+                retry: do_comm.RetryPolicy = None):
+    """
+    Read card block by block, yielding (sector, block, status, data) as soon as each APDU completes.
+
+    key_plan is one card_data.key for all sectors, card_data.KeyMap with candidate keys tried
+    in order, or a mapping {sector: key or [keys]}. sectors are sector numbers to read (all
+    sectors of MIFARE 1K by default). Every block of requested sectors is yielded exactly once,
+    block is number inside sector and data is None when status is not S_OK: a sector that can
+    not be authenticated gives S_KEY_ERROR (keys are not accepted by reader, or sector has no
+    key in plan) or S_AUTH_ERROR for all its blocks.
+    With useAccessBits the trailer is read first and its access bits choose key A or B for
+    every data block; blocks no key of plan may read are yielded as S_NO_ACCESS without any
+    APDU. Data blocks then come in order of keys used, trailer is always the last block of
+    its sector. Without useAccessBits all blocks are read in order with the first key.
+    With retry (do_comm.RetryPolicy) a READ failed with transient status word is sent
+    again after re-authentication of the sector, only a block failed on every attempt
+    (or with definitive status word) is yielded as S_READ_ERROR.
+    Nothing is sent before the consumer asks for the next block, so a consumer that stops
+    iterating (e.g. after the block it was looking for) ends the card communication there.
+    """
+    session = do_comm.sessionFor(connection) #skips LOAD KEYS/AUTH already done on this connection
+    for nSector in (range(card_data.MIFARE_1K_total_sectors) if sectors is None else sectors):
+        nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
+        key, authStatus = authenticateSector(session, nBlock0, key_plan)
+        if key is None:
+            for iBlock in range(card_data.MIFARE_1K_blocks_per_sector):
+                yield nSector, iBlock, authStatus, None
+            continue
+        if useAccessBits:
+            blocks = _iterPlannedSectorBlocks(connection, session, nBlock0, key, key_plan, retry)
+        else:
+            blocks = _iterSectorBlocks(connection, session, nBlock0, key, retry=retry)
+        for iBlock, blockStatus, data in blocks:
+            yield nSector, iBlock, blockStatus, data
+
+
+#mark sector as not read: its data in dump is not data of card in the field
+def fnMarkNotRead(sector: card_data.dumpMifare_1k.sector):
+    sector.status = card_data.status.S_NOT_READ
+    sector.trailer.status = card_data.status.S_NOT_READ
+    for block in sector.blocks:
+        block.status = card_data.status.S_NOT_READ
+
+
+#read card info into dump (collects iter_blocks): all sectors or only sectors given by numbers,
+#other sectors of dump are marked S_NOT_READ (reading only what will be used saves LOAD KEYS/AUTH/READ
+#round trips, e.g. head is in sector 0), or are kept as they are with keepOthers (sectors loaded one by one).
+#key is card_data.key or key plan (card_data.KeyMap, {sector: key}). Blocks which access bits forbid to read
+#with available keys are marked S_NO_ACCESS and are not counted as blocks to read. retry: see iter_blocks.
+def fnRead(connection: CardConnection, dump: card_data.dumpMifare_1k, key, sectors=None,
+           keepOthers: bool = False, retry: do_comm.RetryPolicy = None) -> bool:
+    sectorsToRead     = [n for n in range(len(dump.sectors)) if sectors is None  or  n in sectors]
+    totalBlocksToRead = len(sectorsToRead) * card_data.MIFARE_1K_blocks_per_sector
+    totalBlocksRead   = 0
+    try:
+        if not keepOthers:
+            for iSector, sector in enumerate(dump.sectors):
+                if iSector not in sectorsToRead:
+                    fnMarkNotRead(sector)
+            dump.restored &= card_data.sectorMask(sectorsToRead)
+        for iSector, iBlock, blockStatus, data in iter_blocks(connection, key, sectorsToRead, retry=retry):
+            sector       = dump.sectors[iSector]
+            block        = sector.blocks[iBlock]
+            block.status = blockStatus
+            if blockStatus == card_data.status.S_OK:
+                block.data       = data
+                totalBlocksRead += 1
+                if (iBlock + 1) == card_data.MIFARE_1K_blocks_per_sector:
+                    sector.trailer.processLastBlock(block.data)
+            elif blockStatus == card_data.status.S_NO_ACCESS: #forbidden by access bits, not to be read
+                totalBlocksToRead -= 1
+            if (iBlock + 1) == card_data.MIFARE_1K_blocks_per_sector: #sector is complete
+                dump.restored &= ~card_data.sectorMask([iSector])
+                statuses   = set(b.status for b in sector.blocks)
+                authErrors = statuses & {card_data.status.S_KEY_ERROR, card_data.status.S_AUTH_ERROR}
+                if statuses <= {card_data.status.S_OK, card_data.status.S_NO_ACCESS}:
                     sector.status = card_data.status.S_OK
-                    for iBlock, block in enumerate(sector.blocks):
-                        readOk, data = do_comm.fnReadBlock(connection, nBlock0 + iBlock)
-                        if readOk:
-                            block.data = data
-                            block.status = card_data.status.S_OK
-                            totalBlocksRead += 1
-                            if (iBlock + 1) == card_data.MIFARE_1K_blocks_per_sector:
-                                sector.trailer.processLastBlock(block.data)   
-                        else:
-                            failCount += 1
-                            totalFailCount += 1
-                            block.status = card_data.status.S_READ_ERROR
-                    if failCount != 0:
-                        sector.status = card_data.status.S_READ_ERROR
-                        printFailBlocks(iSector, sector)
-        dump.head.read(dump.sectors[0].blocks[0])
+                elif card_data.status.S_OK not in statuses  and  len(authErrors) > 0:
+                    sector.status = authErrors.pop()
+                else:
+                    sector.status = card_data.status.S_READ_ERROR
+                    printFailBlocks(iSector, sector)
+        if 0 in sectorsToRead:
+            dump.head.read(dump.sectors[0].blocks[0])
     except Exception as e:
         dump.status = card_data.status.S_READ_ERROR
         print(f"dump error: {e}\n")
 
     print(f"read {totalBlocksRead}/{totalBlocksToRead})")
-    return totalBlocksRead == len(dump.sectors) * len(dump.sectors[0].blocks)
+    return totalBlocksRead == totalBlocksToRead
+
+
+#sectors (of given ones) with blocks not read yet: status other than S_OK or S_NO_ACCESS
+def fnMissingSectors(dump: card_data.dumpMifare_1k, sectors: list[int]) -> list[int]:
+    done = (card_data.status.S_OK, card_data.status.S_NO_ACCESS)
+    return [n for n in sectors if any(block.status not in done for block in dump.sectors[n].blocks)]
+
+
+#copy blocks with their status (and trailers, head which are parsed from blocks) from one dump to other,
+#works for dumpMifare_1k and compactDumpMifare_1k in both directions
+def fnCopyDump(source, dump: card_data.dumpMifare_1k) -> None:
+    for sector, target in zip(source.sectors, dump.sectors):
+        for block, targetBlock in zip(sector.blocks, target.blocks):
+            targetBlock.data   = bytearray(block.data)
+            targetBlock.status = block.status
+        target.status = sector.status
+        if target.blocks[-1].status == card_data.status.S_OK:
+            target.trailer.processLastBlock(target.blocks[-1].data)
+        else:
+            target.trailer.status = target.blocks[-1].status
+    dump.head.read(dump.sectors[0].blocks[0])
+
+
+#Partial dumps of cards kept by UID (compact copies with status of every block), so a card which left the field
+#during reading continues with its missing sectors when it is tapped again, instead of starting over from sector 0.
+#Only partial dumps are kept: data of complete card may change before next tap. The oldest cards are dropped
+#above maxCards.
+class ResumableReads:
+    def __init__(self, maxCards: int = 32):
+        self.maxCards = maxCards
+        self.partial  = {}  #UID hex -> compactDumpMifare_1k, in order of insertion (oldest first)
+
+    #remove and return partial dump of card, None if there is none
+    def take(self, uid: str) -> card_data.compactDumpMifare_1k:
+        return self.partial.pop(uid, None)
+
+    def keep(self, uid: str, dump: card_data.dumpMifare_1k) -> None:
+        self.partial.pop(uid, None)
+        self.partial[uid] = card_data.compactDumpMifare_1k.fromDump(dump)
+        while len(self.partial) > self.maxCards:
+            del self.partial[next(iter(self.partial))]
+
+
+#read card into dump resuming its partial dump: card is identified by UID (GET DATA), sectors already read
+#in previous taps are restored without any APDU and only sectors with missing blocks are read (AUTH is per
+#sector, so a sector interrupted in the middle is read again). Without UID the card is read as by fnRead.
+#Restored sectors are marked in dump.restored (sectorMask): the card may have changed since, so diff-write reads them again.
+def fnReadResumable(connection: CardConnection, dump: card_data.dumpMifare_1k, key, resume: ResumableReads,
+                    sectors=None, retry: do_comm.RetryPolicy = None) -> bool:
+    sectorsToRead = [n for n in range(len(dump.sectors)) if sectors is None  or  n in sectors]
+    isOk, uid     = do_comm.fnGetUID(connection)
+    uidStr        = bytes(uid).hex().upper() if isOk else None
+    saved         = resume.take(uidStr) if uidStr is not None else None
+    if saved is None:
+        fnRead(connection, dump, key, sectorsToRead, retry=retry)
+    else:
+        fnCopyDump(saved, dump)
+        dump.restored = card_data.sectorMask(n for n, sector in enumerate(dump.sectors)
+                                             if any(block.status == card_data.status.S_OK for block in sector.blocks))
+        missing = fnMissingSectors(dump, sectorsToRead)
+        if len(missing) > 0:
+            print(f"resume reading from sector {missing[0]}")
+            fnRead(connection, dump, key, missing, keepOthers=True, retry=retry)
+    isComplete = len(fnMissingSectors(dump, sectorsToRead)) == 0
+    if not isComplete  and  uidStr is not None:
+        resume.keep(uidStr, dump)
+    return isComplete
 
 
 ############################################################################################################
+#Writes of many blocks in one card session: one connection for all writes, blocks are grouped by sector
+#and every sector is authenticated once (LOAD KEYS only for a key not in reader yet). Writes are collected
+#by write() and sent by flush(), which is called on exit of with block (not after an exception):
+#    with BulkWriter(card_data.key(card_data.keyType.KT_B, keyB)) as writer:
+#        writer.write(1, 0, data)
+#        writer.writeStr(1, 1, "hello")
+#Without connection BulkWriter waits for card (CardRequest) and disconnects on exit, a given connection
+#(e.g. of CardProcessor) stays open. key is card_data.key or key plan (card_data.KeyMap, {sector: key}).
+class BulkWriter:
+    def __init__(self, key, connection: CardConnection = None, timeout: int = 10, verify: bool = False,
+                 retry: do_comm.RetryPolicy = None):
+        self.key          = key
+        self.connection   = connection
+        self.ownConnection= connection is None
+        self.timeout      = timeout
+        self.verify       = verify
+        self.retry        = retry   #do_comm.RetryPolicy of failed WRITE, verify mode retries by fnVerifyRetryPolicy without it
+        self.pending      = {}  #sector -> {block inside sector: 16 bytes}, later write of block replaces earlier
+        self.blockStatus  = {}  #absolute block number -> status of flushed write
+
+    def __enter__(self) -> "BulkWriter":
+        if self.ownConnection:
+            service = CardRequest(timeout=self.timeout).waitforcard()
+            self.connection = service.connection
+            self.connection.connect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_UNPOWER_CARD)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            if self.ownConnection  and  self.connection is not None:
+                self.connection.disconnect()
+                self.connection = None
+        return False
+
+    #data shorter than block is padded with zeros
+    def write(self, nSector: int, nBlock: int, blockData) -> None:
+        if not 0 <= nSector < card_data.MIFARE_1K_total_sectors  or  not 0 <= nBlock < card_data.MIFARE_1K_blocks_per_sector:
+            raise ValueError(f"invalid block {nSector}:{nBlock}")
+        if len(blockData) > card_data.MIFARE_1K_bytes_per_block:
+            raise ValueError(f"block data must be at most {card_data.MIFARE_1K_bytes_per_block} bytes")
+        self.pending.setdefault(nSector, {})[nBlock] = bytes(blockData).ljust(card_data.MIFARE_1K_bytes_per_block, b"\x00")
+
+    def writeStr(self, nSector: int, nBlock: int, blockDataStr: str) -> None:
+        self.write(nSector, nBlock, blockDataStr.encode())
+
+    #send collected writes sector by sector, returns True if all of them were written
+    def flush(self) -> bool:
+        isOk    = True
+        session = do_comm.sessionFor(self.connection)
+        for nSector in sorted(self.pending):
+            nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
+            blocks  = [(nBlock0 + nBlock, data) for nBlock, data in sorted(self.pending[nSector].items())]
+            sectorKey, authStatus = authenticateSector(session, nBlock0, self.key)
+            if sectorKey is None:
+                print(f"fail to write sector {nSector}: {authStatus.value}")
+                sectorStatus = {nBlockThrowCard: authStatus for nBlockThrowCard, _ in blocks}
+            elif self.verify:
+                sectorStatus = fnWriteVerifySectorBlocks(self.connection, session, nBlock0, blocks, sectorKey,
+                                                         self.retry if self.retry is not None else fnVerifyRetryPolicy())
+            else:
+                sectorStatus = fnWriteSectorBlocks(self.connection, session, nBlock0, blocks, sectorKey, self.retry)
+            self.blockStatus.update(sectorStatus)
+            isOk = isOk  and  all(s == card_data.status.S_OK for s in sectorStatus.values())
+        self.pending.clear()
+        return isOk
+
+
+#write one block in own card session (key A), scripts writing many blocks use BulkWriter
 def fnWriteBlock(nSector: int, nBlock: int, blockData: list[bytes], key: list[bytes]) -> bool:
     Result = False
     try:
-        request = CardRequest(timeout=10)
-        service = request.waitforcard()
-        connection = service.connection
-        connection.connect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_UNPOWER_CARD)        
-        try:
-            if do_comm.fnLoadKey(connection, key):
-                nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
-                if do_comm.fnSelectBlock(connection, nBlock0, "B"):
-                    if do_comm.fnWriteBlock(connection, nBlock0 + nBlock, blockData):
-                        print(f"Successfully wrote block {nSector}:{nBlock}.")
-                        Result = True
-        finally:
-            connection.disconnect()
+        with BulkWriter(card_data.key(card_data.keyType.KT_A, key)) as writer:
+            writer.write(nSector, nBlock, blockData)
+        Result = writer.blockStatus.get(nSector * card_data.MIFARE_1K_blocks_per_sector + nBlock) == card_data.status.S_OK
     except Exception as e:
         sys.stdout.write(f"Error writing block: {e}")
     return Result
@@ -84,9 +476,157 @@ def fnWriteBlockStr(nSector: int, nBlock: int, blockDataStr: str, key: list[byte
     return fnWriteBlock(nSector, nBlock, list(blockDataStr.encode()), key)
 
 #==============================================================================================
-def fnWrite(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWrite, key:card_data.key) -> bool:
+#write blocks [(absolute block number, 16 bytes)] of one sector as one planned batch of UPDATE BINARY APDUs,
+#re-authenticating for the rest of the batch after a failed block; with retry policy (do_comm.RetryPolicy)
+#a block failed with transient status word is written again first (WRITE of the same data is idempotent).
+#Returns {absolute block number: S_OK | S_WRITE_ERROR | S_AUTH_ERROR (block not sent, sector not authenticated)}.
+def fnWriteSectorBlocks(connection: CardConnection, session: do_comm.AuthSession, nBlock0: int,
+                        blocks: list[tuple[int, bytes]], key: card_data.key, retry: do_comm.RetryPolicy = None) -> dict:
+    blockStatus = {nBlockThrowCard: card_data.status.S_AUTH_ERROR for nBlockThrowCard, _ in blocks}
+    pending     = list(blocks)
+    failures    = {} #absolute block number -> number of failed WRITE
+    while len(pending) > 0:
+        if not session.authenticate(nBlock0, key.keyType.value, key.keyData):
+            break
+        #generator: each APDU is assembled in the write buffer of the batch right before it is sent
+        buffer  = do_comm.newWriteBuffer()
+        results = do_comm.transmit_batch(connection, (do_comm.apduWriteBlock(nBlock, data, buffer) for nBlock, data in pending))
+        retried = False
+        for (nBlockThrowCard, blockData), result in zip(pending, results):
+            nBlockInsideSector = nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
+            if result.ok:
+                blockStatus[nBlockThrowCard] = card_data.status.S_OK
+                print(f"Successfully wrote sector[{nBlock0 // card_data.MIFARE_1K_blocks_per_sector}]:block[{nBlockInsideSector}] <-- {do_comm.bytes2str(blockData)}")
+            else:
+                blockStatus[nBlockThrowCard] = card_data.status.S_WRITE_ERROR
+                session.invalidate() #batch bypasses connection observers
+                failures[nBlockThrowCard] = failures.get(nBlockThrowCard, 0) + 1
+                if retry is not None  and  retry.shouldRetry(result.sw, failures[nBlockThrowCard]):
+                    retry.wait(failures[nBlockThrowCard])
+                    retried = True
+                else:
+                    print(f"fail to write block: {nBlock0 // card_data.MIFARE_1K_blocks_per_sector}:{nBlockInsideSector}")
+        pending = pending[len(results) - 1:] if retried else pending[len(results):] #retried block stays pending
+        if len(results) == 0  or  results[-1].error == do_comm.apduError.E_NO_RESPONSE: #card is gone
+            break
+    return blockStatus
+
+
+def isTrailerBlock(nBlockThrowCard: int) -> bool:
+    return nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector == card_data.MIFARE_1K_blocks_per_sector - 1
+
+
+#default retry policy of verify mode: block is written at most VERIFY_RETRIES more times
+def fnVerifyRetryPolicy() -> do_comm.RetryPolicy:
+    return do_comm.RetryPolicy(attempts=VERIFY_RETRIES + 1)
+
+
+#bytes of block compared by read-back verification: key A of sector trailer always reads back as zeros
+#and key B only when access bits allow reading it, so only access bits and GPB of a trailer are compared
+def fnVerifiedBytes(nBlockThrowCard: int, data) -> bytes:
+    return bytes(data)[6:10] if isTrailerBlock(nBlockThrowCard) else bytes(data)
+
+
+#write blocks of one sector, every block is read back by READ BINARY right after its WRITE, in the sector
+#session which is already authenticated, and compared in place. A failed command is written again as
+#retry policy allows (transient status word, backoff); a block acknowledged but read back different
+#(write lost without error status) is written again while retry.attempts are not used up.
+#Returns {absolute block number: S_OK (verified) | S_VERIFY_ERROR | S_WRITE_ERROR | S_AUTH_ERROR}.
+def fnWriteVerifySectorBlocks(connection: CardConnection, session: do_comm.AuthSession, nBlock0: int,
+                              blocks: list[tuple[int, bytes]], key: card_data.key, retry: do_comm.RetryPolicy) -> dict:
+    blockStatus = {nBlockThrowCard: card_data.status.S_AUTH_ERROR for nBlockThrowCard, _ in blocks}
+    for nBlockThrowCard, blockData in blocks:
+        nBlockInsideSector = nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
+        failures = 0
+        while session.authenticate(nBlock0, key.keyType.value, key.keyData):
+            results = do_comm.transmit_batch(connection, (do_comm.apduWriteBlock(nBlockThrowCard, blockData),
+                                                          do_comm.APDU_READ_BLOCK[nBlockThrowCard]))
+            if not results[0].ok:
+                blockStatus[nBlockThrowCard] = card_data.status.S_WRITE_ERROR
+            elif not results[-1].ok  or  fnVerifiedBytes(nBlockThrowCard, results[-1].data) != fnVerifiedBytes(nBlockThrowCard, blockData):
+                blockStatus[nBlockThrowCard] = card_data.status.S_VERIFY_ERROR
+            else:
+                blockStatus[nBlockThrowCard] = card_data.status.S_OK
+                break
+            if not results[-1].ok:
+                session.invalidate() #batch bypasses connection observers
+            if results[-1].error == do_comm.apduError.E_NO_RESPONSE: #card is gone
+                return blockStatus
+            failures += 1
+            if results[-1].ok: #mismatch
+                canRetry = failures < retry.attempts
+            else:
+                canRetry = retry.shouldRetry(results[-1].sw, failures)
+            if not canRetry:
+                break
+            retry.wait(failures)
+        if blockStatus[nBlockThrowCard] == card_data.status.S_OK:
+            print(f"Successfully wrote and verified sector[{nBlock0 // card_data.MIFARE_1K_blocks_per_sector}]:block[{nBlockInsideSector}] <-- {do_comm.bytes2str(blockData)}")
+        else:
+            print(f"fail to write block: {nBlock0 // card_data.MIFARE_1K_blocks_per_sector}:{nBlockInsideSector} {blockStatus[nBlockThrowCard].value}")
+    return blockStatus
+
+
+#keep dump the data of card after write of blocks [(absolute block number, 16 bytes)] of sector:
+#written blocks are stored, failed blocks are marked not read (their content on card is unknown).
+def fnStoreWrittenBlocks(sector: card_data.dumpMifare_1k.sector, blocks: list[tuple[int, bytes]], blockStatus: dict):
+    for nBlockThrowCard, blockData in blocks:
+        block = sector.blocks[nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector]
+        if blockStatus[nBlockThrowCard] == card_data.status.S_OK:
+            block.data   = bytearray(blockData)
+            block.status = card_data.status.S_OK
+        else:
+            block.status = card_data.status.S_NOT_READ
+
+
+#plan of sequential write of data from nStartBlock: {sector: [(absolute block number, 16 bytes)]},
+#diff-write only drops blocks from plan. Data running past the last data block of a sector continues
+#in the next sector: trailers are stepped over (keys and access bits are written only by BulkWriter),
+#as do_prompt counts data size of sector and entire card without trailers. Start block must not be
+#a trailer (fnWriteBlocks refuses it), the write is never moved to another address than the given one.
+def planWriteBlocks(nStartBlock: int, data: bytes) -> dict:
+    sectorPlans = {}
+    nBlockThrowCard = nStartBlock
+    for i in range(len(data) // card_data.MIFARE_1K_bytes_per_block):
+        if i > 0  and  isTrailerBlock(nBlockThrowCard):
+            nBlockThrowCard += 1
+        blockDataSlice = data[i * card_data.MIFARE_1K_bytes_per_block:(i + 1) * card_data.MIFARE_1K_bytes_per_block]
+        sectorPlans.setdefault(nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector, []).append((nBlockThrowCard, blockDataSlice))
+        nBlockThrowCard += 1
+    return sectorPlans
+
+
+#diff-write: drop blocks of write plan which card already holds. Blocks are compared with dump (data of
+#card in the field cached by previous reads, e.g. CardProcessor.dump); sectors with planned blocks not read
+#OK in dump, or restored from an earlier tap (dump.restored), are read first, only these sectors (into dump).
+#Blocks that can not be read stay in plan.
+#Returns (plan of changed blocks, number of unchanged blocks).
+def fnDiffWritePlan(connection: CardConnection, sectorPlans: dict, dump: card_data.dumpMifare_1k, key,
+                    retry: do_comm.RetryPolicy = None) -> (dict, int):
+    def isCached(nBlockThrowCard: int) -> bool:
+        nSector = nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector
+        block   = dump.sectors[nSector].blocks[nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector]
+        return block.status == card_data.status.S_OK  and  not dump.restored & card_data.sectorMask([nSector])
+
+    sectorsToRead = [nSector for nSector, blocks in sectorPlans.items() if not all(isCached(n) for n, _ in blocks)]
+    if len(sectorsToRead) > 0:
+        fnRead(connection, dump, key, sectorsToRead, keepOthers=True, retry=retry)
+    changedPlans, nUnchanged = {}, 0
+    for nSector, blocks in sectorPlans.items():
+        for nBlockThrowCard, blockData in blocks:
+            block = dump.sectors[nSector].blocks[nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector]
+            if block.status == card_data.status.S_OK  and  bytes(block.data) == bytes(blockData):
+                nUnchanged += 1
+            else:
+                changedPlans.setdefault(nSector, []).append((nBlockThrowCard, blockData))
+    return changedPlans, nUnchanged
+
+
+def fnWriteBlocks(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWrite, key,
+                  dump: card_data.dumpMifare_1k = None, diff: bool = False,
+                  verify: bool = False, retry: do_comm.RetryPolicy = None) -> (bool, dict):
     """
-    Write data to a MIFARE 1K card.
+    Write data to a MIFARE 1K card and report the result of every block.
     
     This function writes data blocks to the card, handling sector authentication
     automatically when entering a new sector. The starting block is determined
@@ -95,16 +635,30 @@ def fnWrite(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWri
     Args:
         writeData: Contains the data to write, address type (block/sector), and
                    sector/block numbers indicating where to start writing.
-        key: Authentication key object containing key data and key type (A/B).
+        key: Authentication key object containing key data and key type (A/B),
+             or key plan (card_data.KeyMap, {sector: key}) with keys tried per sector.
+        dump: Cached data of the card in the field (e.g. CardProcessor.dump). Written
+              blocks are stored into it, so it stays the data of the card.
+        diff: Write only blocks whose content differs from the card. Blocks are compared
+              with dump, sectors not cached in dump are read first (only these sectors).
+              Unchanged blocks count as written.
+        verify: Read every block back right after its WRITE, in the same authenticated
+                sector session, and write it again while it does not match, as retry
+                allows (only access bits and GPB of a sector trailer are compared).
+        retry: do_comm.RetryPolicy for WRITE failed with transient status word
+               (written again after re-authentication of the sector); in verify mode
+               VERIFY_RETRIES repeated writes with default backoff if not given.
     
     Returns:
-        bool: True if the write operation was successful, False otherwise.
+        (bool, dict): True if all blocks were written (and verified), and status of
+                      every planned block by absolute block number: S_OK, S_WRITE_ERROR,
+                      S_VERIFY_ERROR, or S_AUTH_ERROR/S_KEY_ERROR of its sector.
     """
     # Validate data length - must be a multiple of block size (16 bytes)
     dataLen = len(writeData.data)
     if dataLen == 0  or  dataLen % card_data.MIFARE_1K_bytes_per_block != 0:
         print(f"Data length {dataLen} is not valid - must be multiple of {card_data.MIFARE_1K_bytes_per_block}")
-        return False
+        return False, {}
     
     # Determine starting block based on address type
     # For A_BLOCK: start at specific block within sector
@@ -117,38 +671,49 @@ def fnWrite(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWri
             #first block of first sector is special
             if writeData.nSector != 0:
                 nStartBlock = writeData.nSector * card_data.MIFARE_1K_blocks_per_sector
+    if isTrailerBlock(nStartBlock):
+        print(f"Block {nStartBlock} is sector trailer - data is not written over keys and access bits")
+        return False, {}
+    blockStatus = {}
     try:
-        # absolute block number from start of card
-        startNewSector = True # Track if we're entering a new sector (requires authentication)
-        totalBlocksToWrite = dataLen // card_data.MIFARE_1K_bytes_per_block 
-        totalBlockWritten = 0
-        # Write each block of data
-        for i in range(totalBlocksToWrite):
-            # Calculate absolute block number across entire card
-            nBlockThrowCard = nStartBlock + i
-            # Calculate which sector this block belongs to
-            nSector = nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector
-            # Calculate block number within the sector (0-3)
-            nBlockInsideSector = nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
-            # If we're continuing in the same sector, no need to re-authenticate
-            isOk = not startNewSector
-            # If entering a new sector, authenticate with the key
-            if startNewSector:
-                # Get first block of the sector (block 0 of the sector)
-                nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
-                # Load key and authenticate to the sector
-                isOk = do_comm.fnLoadKey(connection, key.keyData) and do_comm.fnSelectBlock(connection, nBlock0, key.keyType.value)
-            # If authentication succeeded (or not needed), write the block
-            if isOk:
-                # Extract and write block data from the write buffer with convertation to list of bytes
-                blockDataSlice = list[bytes](writeData.data[i * card_data.MIFARE_1K_bytes_per_block:(i + 1) * card_data.MIFARE_1K_bytes_per_block])
-                # Write the block to the card
-                if do_comm.fnWriteBlock(connection, nBlockThrowCard, (blockDataSlice)):
-                    totalBlockWritten += 1
-                    print(f"Successfully wrote sector[{nSector}]:block[{nBlockInsideSector}] <-- {do_comm.bytes2str(blockDataSlice)}") 
-            # Check if next iteration will be in a new sector (if current block is last in sector)
-            startNewSector = nBlockInsideSector == (card_data.MIFARE_1K_blocks_per_sector - 1)
+        # Session remembers authenticated sector: AUTH is sent only when entering a new sector
+        # (or after a failed command), LOAD KEYS only when key is not in the reader yet
+        session = do_comm.sessionFor(connection)
+        # Plan writes: absolute block number across entire card and slice of data for it, grouped by sector
+        sectorPlans = planWriteBlocks(nStartBlock, writeData.data)
+        blockStatus = {nBlockThrowCard: card_data.status.S_NOINIT for blocks in sectorPlans.values() for nBlockThrowCard, _ in blocks}
+        if diff:
+            # EEPROM write is the slowest command: skip blocks the card already holds
+            if dump is None:
+                dump = card_data.dumpMifare_1k()
+            sectorPlans, nUnchanged = fnDiffWritePlan(connection, sectorPlans, dump, key, retry)
+            changed = set(nBlockThrowCard for blocks in sectorPlans.values() for nBlockThrowCard, _ in blocks)
+            blockStatus.update((n, card_data.status.S_OK) for n in blockStatus if n not in changed)
+            print(f"unchanged blocks skipped: {nUnchanged}")
+        # Write each sector as one batch with the first key of plan accepted for the sector
+        for nSector, blocks in sectorPlans.items():
+            nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
+            sectorKey, authStatus = authenticateSector(session, nBlock0, key)
+            if sectorKey is None:
+                print(f"fail to write sector {nSector}: {authStatus.value}")
+                blockStatus.update((nBlockThrowCard, authStatus) for nBlockThrowCard, _ in blocks)
+                continue
+            if verify:
+                sectorStatus = fnWriteVerifySectorBlocks(connection, session, nBlock0, blocks, sectorKey,
+                                                         retry if retry is not None else fnVerifyRetryPolicy())
+            else:
+                sectorStatus = fnWriteSectorBlocks(connection, session, nBlock0, blocks, sectorKey, retry)
+            blockStatus.update(sectorStatus)
+            if dump is not None:
+                fnStoreWrittenBlocks(dump.sectors[nSector], blocks, sectorStatus)
     except Exception as e:
         sys.stdout.write(f"Error writing block: {e}")
 
-    return totalBlocksToWrite == totalBlockWritten
+    return len(blockStatus) > 0  and  all(s == card_data.status.S_OK for s in blockStatus.values()), blockStatus
+
+
+#Write data to a MIFARE 1K card (see fnWriteBlocks), True if all blocks were written.
+def fnWrite(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWrite, key,
+            dump: card_data.dumpMifare_1k = None, diff: bool = False, verify: bool = False,
+            retry: do_comm.RetryPolicy = None) -> bool:
+    return fnWriteBlocks(connection, writeData, key, dump, diff, verify, retry=retry)[0]
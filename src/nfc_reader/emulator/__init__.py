@@ -0,0 +1,12 @@
+"""Software MIFARE Classic 1K card and PC/SC reader for running do_comm/do_wr without hardware."""
+from .card   import MifareClassic1K, decodeAccessConditions
+from .reader import EmulatedReader, EmulatedCard, EmulatedConnection, ATR_MIFARE_1K
+
+__all__ = [
+    "MifareClassic1K",
+    "decodeAccessConditions",
+    "EmulatedReader",
+    "EmulatedCard",
+    "EmulatedConnection",
+    "ATR_MIFARE_1K",
+]
@@ -0,0 +1,247 @@
+"""
+Software model of a MIFARE Classic 1K card.
+
+The card keeps its whole memory in one 1024-byte image (16 sectors x 4 blocks x
+16 bytes) and behaves like the real chip as far as the reader commands used by
+do_comm can see: one sector is authenticated at a time with key A or key B,
+the sector trailer access bits decide which key may read or write every block,
+key A is never readable and a readable key B can not be used for authentication.
+Any refused or failed operation drops the authenticated state, as the real card
+goes to HALT after an error.
+"""
+
+BLOCKS_PER_SECTOR = 4
+TOTAL_SECTORS     = 16
+BYTES_PER_BLOCK   = 16
+TOTAL_BLOCKS      = BLOCKS_PER_SECTOR * TOTAL_SECTORS
+IMAGE_SIZE        = TOTAL_BLOCKS * BYTES_PER_BLOCK
+
+DEFAULT_KEY          = bytes([0xFF] * 6)
+TRANSPORT_ACCESS     = bytes([0xFF, 0x07, 0x80, 0x69]) #access bits + GPB of a new card
+DEFAULT_MANUFACTURER = bytes([0x08, 0x04, 0x00, 0x62, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69]) #SAK, ATQA, data
+
+A, B, AB, NONE = "A", "B", "AB", ""
+
+#Access rights, access bits decoding and value block format below are written again from the MIFARE
+#Classic datasheet on purpose instead of imported from card_data: the emulator is the oracle the
+#card_data/do_wr code is tested against, and sharing the tables would let one mistake pass on both sides.
+#test_emulator checks that both copies agree (TestOracleAgreement).
+
+#access condition (C1C2C3) of data block -> keys allowed to (read, write, increment, decrement/transfer/restore)
+DATA_BLOCK_RIGHTS = {
+    0b000: (AB,   AB,   AB,   AB),
+    0b010: (AB,   NONE, NONE, NONE),
+    0b100: (AB,   B,    NONE, NONE),
+    0b110: (AB,   B,    B,    AB),
+    0b001: (AB,   NONE, NONE, AB),
+    0b011: (B,    B,    NONE, NONE),
+    0b101: (B,    NONE, NONE, NONE),
+    0b111: (NONE, NONE, NONE, NONE),
+}
+
+#access condition (C1C2C3) of sector trailer -> keys allowed to
+#(write key A, read access bits, write access bits, read key B, write key B)
+TRAILER_RIGHTS = {
+    0b000: (A,    A,  NONE, A,    A),
+    0b010: (NONE, A,  NONE, A,    NONE),
+    0b100: (B,    AB, NONE, NONE, B),
+    0b110: (NONE, AB, NONE, NONE, NONE),
+    0b001: (A,    A,  A,    A,    A),
+    0b011: (B,    AB, B,    NONE, B),
+    0b101: (NONE, AB, B,    NONE, NONE),
+    0b111: (NONE, AB, NONE, NONE, NONE),
+}
+
+
+def decodeAccessConditions(accessBytes) -> (bool, list[int]):
+    """
+    Decode bytes 6..8 of a sector trailer.
+
+    Returns (valid, [C1C2C3 of block 0, 1, 2, trailer]); valid is False when the
+    inverted copy of the bits does not match, such sector is blocked on a real card.
+    """
+    b6, b7, b8 = accessBytes[0], accessBytes[1], accessBytes[2]
+    valid = (b6 ^ 0xFF) == (((b8 & 0x0F) << 4) | (b7 >> 4))  and  ((b7 ^ 0xFF) & 0x0F) == (b8 >> 4)
+    conditions = [(((b7 >> (4 + i)) & 1) << 2) | (((b8 >> i) & 1) << 1) | ((b8 >> (4 + i)) & 1)
+                  for i in range(BLOCKS_PER_SECTOR)]
+    return valid, conditions
+
+
+#value block: value, ~value, value (signed 32-bit little endian), address, ~address, address, ~address
+def encodeValue(value: int, address: int) -> bytes:
+    direct = (value & 0xFFFFFFFF).to_bytes(4, "little")
+    return direct + (~value & 0xFFFFFFFF).to_bytes(4, "little") + direct + bytes((address, ~address & 0xFF) * 2)
+
+
+def decodeValue(data) -> (bool, int, int):
+    """Returns (valid, value, address) of a block in value block format."""
+    data  = bytes(data)
+    value = int.from_bytes(data[0:4], "little", signed=True)
+    valid = data[0:4] == data[8:12]  and  data[4:8] == bytes(b ^ 0xFF for b in data[0:4])  and  \
+            data[12] == data[14]  and  data[13] == data[15] == data[12] ^ 0xFF
+    return valid, value, data[12]
+
+
+class MifareClassic1K:
+    def __init__(self, uid=bytes([0xDE, 0xAD, 0xBE, 0xEF]), image=None):
+        if image is not None:
+            if len(image) != IMAGE_SIZE:
+                raise ValueError(f"card image must be {IMAGE_SIZE} bytes")
+            self.image = bytearray(image)
+        else:
+            self.image = bytearray(IMAGE_SIZE)
+            uid = bytes(uid)
+            bcc = uid[0] ^ uid[1] ^ uid[2] ^ uid[3]
+            self.image[0:BYTES_PER_BLOCK] = uid + bytes([bcc]) + DEFAULT_MANUFACTURER
+            for nSector in range(TOTAL_SECTORS):
+                self.setTrailer(nSector, DEFAULT_KEY, TRANSPORT_ACCESS, DEFAULT_KEY)
+        self.reset()
+
+    @property
+    def uid(self) -> bytes:
+        return bytes(self.image[0:4])
+
+    #power up / HALT: card is not authenticated to any sector
+    def reset(self) -> None:
+        self.authSector  = -1
+        self.authKeyType = NONE
+
+    def block(self, nBlock: int) -> bytes:
+        return bytes(self.image[nBlock * BYTES_PER_BLOCK:(nBlock + 1) * BYTES_PER_BLOCK])
+
+    def setBlock(self, nBlock: int, data) -> None:
+        self.image[nBlock * BYTES_PER_BLOCK:(nBlock + 1) * BYTES_PER_BLOCK] = bytes(data)
+
+    #write trailer directly into image (personalisation of test cards, no access check)
+    def setTrailer(self, nSector: int, keyA, accessBytes, keyB) -> None:
+        self.setBlock(nSector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1, bytes(keyA) + bytes(accessBytes) + bytes(keyB))
+
+    def _trailer(self, nSector: int) -> bytes:
+        return self.block(nSector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1)
+
+    def _conditions(self, nSector: int) -> (bool, list[int]):
+        return decodeAccessConditions(self._trailer(nSector)[6:9])
+
+    def _keyBReadable(self, nSector: int) -> bool:
+        valid, conditions = self._conditions(nSector)
+        return valid  and  A in TRAILER_RIGHTS[conditions[-1]][3]
+
+    #key type of current authentication if it is allowed by rights, key B is useless while it is readable
+    def _allowed(self, nBlock: int, rights: str) -> bool:
+        nSector = nBlock // BLOCKS_PER_SECTOR
+        if self.authSector != nSector  or  self.authKeyType not in rights:
+            return False
+        return self.authKeyType == A  or  not self._keyBReadable(nSector)
+
+    def _fail(self) -> bool:
+        self.reset()
+        return False
+
+    def _refuse(self):
+        self.reset()
+        return None
+
+    def authenticate(self, nBlock: int, keyTypeAB: str, keyData) -> bool:
+        if not 0 <= nBlock < TOTAL_BLOCKS:
+            return self._fail()
+        nSector = nBlock // BLOCKS_PER_SECTOR
+        trailer = self._trailer(nSector)
+        sectorKey = trailer[0:6] if keyTypeAB == A else trailer[10:16]
+        if sectorKey != bytes(keyData):
+            return self._fail()
+        self.authSector, self.authKeyType = nSector, keyTypeAB
+        return True
+
+    def read(self, nBlock: int):
+        #return 16 bytes of block or None if access is refused
+        if not 0 <= nBlock < TOTAL_BLOCKS:
+            return self._refuse()
+        nSector = nBlock // BLOCKS_PER_SECTOR
+        valid, conditions = self._conditions(nSector)
+        if not valid:
+            return self._refuse()
+        nInSector = nBlock % BLOCKS_PER_SECTOR
+        if nInSector != BLOCKS_PER_SECTOR - 1:
+            if not self._allowed(nBlock, DATA_BLOCK_RIGHTS[conditions[nInSector]][0]):
+                return self._refuse()
+            return self.block(nBlock)
+        if self.authSector != nSector:
+            return self._refuse()
+        #trailer: key A is never readable, other parts are masked by rights
+        trailer = self._trailer(nSector)
+        rights  = TRAILER_RIGHTS[conditions[-1]]
+        access  = trailer[6:10] if self._allowed(nBlock, rights[1]) else bytes(4)
+        keyB    = trailer[10:16] if self._allowed(nBlock, rights[3]) else bytes(6)
+        return bytes(6) + access + keyB
+
+    def write(self, nBlock: int, data) -> bool:
+        if not 0 < nBlock < TOTAL_BLOCKS  or  len(data) != BYTES_PER_BLOCK: #block 0 is read only
+            return self._fail()
+        nSector = nBlock // BLOCKS_PER_SECTOR
+        valid, conditions = self._conditions(nSector)
+        if not valid:
+            return self._fail()
+        nInSector = nBlock % BLOCKS_PER_SECTOR
+        if nInSector != BLOCKS_PER_SECTOR - 1:
+            if not self._allowed(nBlock, DATA_BLOCK_RIGHTS[conditions[nInSector]][1]):
+                return self._fail()
+            self.setBlock(nBlock, data)
+            return True
+        #trailer: parts which are not writable with current key keep their values
+        rights  = TRAILER_RIGHTS[conditions[-1]]
+        trailer = bytearray(self._trailer(nSector))
+        data    = bytes(data)
+        written = False
+        for (begin, end), right in (((0, 6), rights[0]), ((6, 10), rights[2]), ((10, 16), rights[4])):
+            if self._allowed(nBlock, right):
+                trailer[begin:end] = data[begin:end]
+                written = True
+        if not written:
+            return self._fail()
+        self.setBlock(nBlock, trailer)
+        return True
+
+    #value of data block allowed by rights index of DATA_BLOCK_RIGHTS, None (refused) if block is not
+    #a data block of authenticated sector in value block format
+    def _value(self, nBlock: int, right: int) -> (int, int):
+        if not 0 <= nBlock < TOTAL_BLOCKS  or  nBlock % BLOCKS_PER_SECTOR == BLOCKS_PER_SECTOR - 1:
+            return None
+        valid, conditions = self._conditions(nBlock // BLOCKS_PER_SECTOR)
+        if not valid  or  not self._allowed(nBlock, DATA_BLOCK_RIGHTS[conditions[nBlock % BLOCKS_PER_SECTOR]][right]):
+            return None
+        valid, value, address = decodeValue(self.block(nBlock))
+        return (value, address) if valid else None
+
+    def readValue(self, nBlock: int):
+        #return value of value block or None if access is refused
+        value = self._value(nBlock, 0)
+        return self._refuse() if value is None else value[0]
+
+    #WRITE of value block format
+    def storeValue(self, nBlock: int, value: int) -> bool:
+        return self.write(nBlock, encodeValue(value, nBlock))
+
+    #INCREMENT (increment right) or DECREMENT (decrement right) by delta followed by TRANSFER into the same block
+    def changeValue(self, nBlock: int, delta: int, increment: bool) -> bool:
+        value = self._value(nBlock, 2 if increment else 3)
+        if value is None  or  self._value(nBlock, 3) is None:
+            return self._fail()
+        result = value[0] + delta if increment else value[0] - delta
+        if not -(1 << 31) <= result < (1 << 31):
+            return self._fail()
+        self.setBlock(nBlock, encodeValue(result, value[1]))
+        return True
+
+    #RESTORE of source followed by TRANSFER into target block of the same sector (address byte of target is kept)
+    def restoreValue(self, nSource: int, nTarget: int) -> bool:
+        value = self._value(nSource, 3)
+        if value is None  or  nSource // BLOCKS_PER_SECTOR != nTarget // BLOCKS_PER_SECTOR:
+            return self._fail()
+        if not 0 <= nTarget < TOTAL_BLOCKS  or  nTarget % BLOCKS_PER_SECTOR == BLOCKS_PER_SECTOR - 1:
+            return self._fail()
+        valid, conditions = self._conditions(nTarget // BLOCKS_PER_SECTOR)
+        if not self._allowed(nTarget, DATA_BLOCK_RIGHTS[conditions[nTarget % BLOCKS_PER_SECTOR]][3]):
+            return self._fail()
+        target = decodeValue(self.block(nTarget))
+        self.setBlock(nTarget, encodeValue(value[0], target[2] if target[0] else value[1]))
+        return True
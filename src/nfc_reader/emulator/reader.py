@@ -0,0 +1,208 @@
+"""
+PC/SC reader emulator for MIFARE Classic cards.
+
+EmulatedReader answers the ACR122-style pseudo APDUs sent by do_comm
+(FF 82 load key, FF 86 authenticate, FF B0 read, FF D6 write, FF CA get UID,
+FF D7/FF B1 value block operations)
+against a MifareClassic1K placed in its field. EmulatedConnection is a regular
+smartcard CardConnection, so observers (KeySlotCache, AuthSession) see the same
+connect/response events as with real hardware, and EmulatedCard stands for the
+smartcard.Card objects delivered by CardMonitor. Every APDU can be delayed by a
+configurable latency with random jitter to reproduce reader timing.
+"""
+import time
+import random
+import threading
+from collections import Counter
+
+import smartcard.scard
+from smartcard.CardConnection import CardConnection
+from smartcard.Exceptions     import CardConnectionException, NoCardException
+
+from .card import MifareClassic1K
+
+ATR_MIFARE_1K = [0x3B, 0x8F, 0x80, 0x01, 0x80, 0x4F, 0x0C, 0xA0, 0x00, 0x00,
+                 0x03, 0x06, 0x03, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x6A]
+
+SW_OK            = (0x90, 0x00)
+SW_FAIL          = (0x63, 0x00) #operation failed (wrong key, access refused)
+SW_WRONG_LENGTH  = (0x67, 0x00)
+SW_WRONG_PARAM   = (0x6A, 0x81) #function not supported
+SW_INS_UNKNOWN   = (0x6D, 0x00)
+SW_CLA_UNKNOWN   = (0x6E, 0x00)
+
+KEY_SLOTS = 2
+
+
+class EmulatedReader:
+    """
+    Reader with a field for one card, volatile key slots and APDU timing.
+
+    latency:      seconds added to every APDU
+    jitter:       maximal random deviation (+/-) of latency in seconds
+    latencyByIns: {INS: seconds} overriding latency for some commands (e.g. 0xD6 write)
+    """
+    def __init__(self, name: str = "Emulated PICC Reader 00", latency: float = 0.0, jitter: float = 0.0,
+                 latencyByIns: dict = None, seed=None):
+        self.name         = name
+        self.latency      = latency
+        self.jitter       = jitter
+        self.latencyByIns = dict(latencyByIns or {})
+        self.random       = random.Random(seed)
+        self.card         = None                    #MifareClassic1K in the field
+        self.keySlots     = [None] * KEY_SLOTS
+        self.observers    = []                      #CardObserver-like objects (see insert/remove)
+        self.stats        = Counter()               #INS -> number of APDUs
+        self.lock         = threading.Lock()
+
+    # CardMonitor interface, so LocalCardObeserver can be driven by the emulator
+    def addObserver(self, observer) -> None:
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def deleteObserver(self, observer) -> None:
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def insert(self, card: MifareClassic1K) -> "EmulatedCard":
+        with self.lock:
+            self.card = card
+            card.reset()
+        inserted = EmulatedCard(self, card)
+        for observer in list(self.observers):
+            observer.update(self, ([inserted], []))
+        return inserted
+
+    def remove(self) -> None:
+        with self.lock:
+            card, self.card = self.card, None
+        if card is not None:
+            for observer in list(self.observers):
+                observer.update(self, ([], [EmulatedCard(self, card)]))
+
+    def createConnection(self) -> "EmulatedConnection":
+        return EmulatedConnection(self)
+
+    def _delay(self, ins: int) -> None:
+        delay = self.latencyByIns.get(ins, self.latency)
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    #execute one APDU, returns (data, sw1, sw2)
+    def process(self, apdu) -> (list[int], int, int):
+        apdu = bytes(apdu)
+        if len(apdu) < 4:
+            return [], *SW_WRONG_LENGTH
+        cla, ins, p1, p2 = apdu[0], apdu[1], apdu[2], apdu[3]
+        self._delay(ins)
+        with self.lock:
+            self.stats[ins] += 1
+            card = self.card
+            if card is None:
+                raise CardConnectionException("Card removed")
+            if cla != 0xFF:
+                return [], *SW_CLA_UNKNOWN
+            body = apdu[5:5 + apdu[4]] if len(apdu) > 4 else b""
+            match ins:
+                case 0x82: #LOAD KEYS
+                    if p2 >= KEY_SLOTS:
+                        return [], *SW_WRONG_PARAM
+                    if len(body) != 6:
+                        return [], *SW_WRONG_LENGTH
+                    self.keySlots[p2] = body
+                    return [], *SW_OK
+                case 0x86: #GENERAL AUTHENTICATE: 01 00 block keyType(60/61) slot
+                    if len(body) != 5  or  body[0] != 0x01  or  body[3] not in (0x60, 0x61)  or  body[4] >= KEY_SLOTS:
+                        return [], *SW_WRONG_PARAM
+                    keyData = self.keySlots[body[4]]
+                    if keyData is None  or  not card.authenticate(body[2], "A" if body[3] == 0x60 else "B", keyData):
+                        return [], *SW_FAIL
+                    return [], *SW_OK
+                case 0xB0: #READ BINARY, Le is optional
+                    if len(apdu) > 4  and  apdu[4] not in (0x00, 0x10):
+                        return [], *SW_WRONG_LENGTH
+                    data = card.read(p2)
+                    if data is None:
+                        return [], *SW_FAIL
+                    return list(data), *SW_OK
+                case 0xD6: #UPDATE BINARY
+                    if not card.write(p2, body):
+                        return [], *SW_FAIL
+                    return [], *SW_OK
+                case 0xD7: #VALUE BLOCK OPERATION: op (00 store, 01 increment, 02 decrement) value MSB first, 03 target
+                    if len(body) == 5  and  body[0] in (0x00, 0x01, 0x02):
+                        value = int.from_bytes(body[1:5], "big", signed=True)
+                        match body[0]:
+                            case 0x00:
+                                isOk = card.storeValue(p2, value)
+                            case 0x01:
+                                isOk = card.changeValue(p2, value, True)
+                            case 0x02:
+                                isOk = card.changeValue(p2, value, False)
+                    elif len(body) == 2  and  body[0] == 0x03:
+                        isOk = card.restoreValue(p2, body[1])
+                    else:
+                        return [], *SW_WRONG_PARAM
+                    return [], *(SW_OK if isOk else SW_FAIL)
+                case 0xB1: #READ VALUE BLOCK
+                    value = card.readValue(p2)
+                    if value is None:
+                        return [], *SW_FAIL
+                    return list(value.to_bytes(4, "big", signed=True)), *SW_OK
+                case 0xCA: #GET DATA: P1 = 00 UID
+                    if p1 != 0x00:
+                        return [], *SW_WRONG_PARAM
+                    return list(card.uid), *SW_OK
+            return [], *SW_INS_UNKNOWN
+
+
+class EmulatedCard:
+    #stands for smartcard.Card.Card delivered by CardMonitor for inserted/removed card
+    def __init__(self, reader: EmulatedReader, card: MifareClassic1K):
+        self.reader = reader
+        self.card   = card
+        self.atr    = list(ATR_MIFARE_1K)
+
+    def createConnection(self) -> "EmulatedConnection":
+        return EmulatedConnection(self.reader)
+
+
+class EmulatedConnection(CardConnection):
+    def __init__(self, reader: EmulatedReader):
+        super().__init__(reader.name)
+        self.emulatedReader = reader
+        self.disposition    = smartcard.scard.SCARD_UNPOWER_CARD
+        self.connected      = False
+
+    def connect(self, protocol=None, mode=None, disposition=None):
+        if self.emulatedReader.card is None:
+            raise NoCardException("No card in the field", 0)
+        self.emulatedReader.card.reset() #power up: anticollision and select, nothing authenticated
+        self.disposition = smartcard.scard.SCARD_UNPOWER_CARD if disposition is None else disposition
+        self.connected   = True
+        super().connect(protocol, mode, disposition)
+
+    def reconnect(self, protocol=None, mode=None, disposition=None):
+        if self.emulatedReader.card is None:
+            raise CardConnectionException("Card removed")
+        if disposition not in (None, smartcard.scard.SCARD_LEAVE_CARD):
+            self.emulatedReader.card.reset()
+        self.connected = True
+        super().reconnect(protocol, mode, disposition)
+
+    def disconnect(self):
+        card = self.emulatedReader.card
+        if card is not None  and  self.disposition != smartcard.scard.SCARD_LEAVE_CARD:
+            card.reset()
+        self.connected = False
+        super().disconnect()
+
+    def getATR(self):
+        return list(ATR_MIFARE_1K)
+
+    def doTransmit(self, command, protocol=None):
+        if not self.connected:
+            raise CardConnectionException("Card not connected")
+        return self.emulatedReader.process(command)
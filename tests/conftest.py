@@ -0,0 +1,24 @@
+"""
+Shared fixtures for tests running do_comm/do_wr against the emulator.
+"""
+import pytest
+import sys
+import os
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+from nfc_reader.emulator import MifareClassic1K, EmulatedReader
+
+
+@pytest.fixture
+def connectedReader():
+    """Factory of emulated reader with a card (blank one by default) and its open connection."""
+    def connect(card=None, **kwargs):
+        reader = EmulatedReader(**kwargs)
+        reader.insert(card if card is not None else MifareClassic1K())
+        connection = reader.createConnection()
+        connection.connect()
+        return reader, connection
+    return connect
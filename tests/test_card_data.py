@@ -25,12 +25,18 @@ from nfc_reader.card_data import (
     MIFARE_1K_default_key,
     status,
     parseAccessBits,
+    decodeAccessBits,
+    ACCESS_TABLE,
     bitAccessMap,
     bytes2str,
     accessBitsToStr,
     keyType,
     key,
+    KeyMap,
+    encodeValueBlock,
+    decodeValueBlock,
     dumpMifare_1k,
+    compactDumpMifare_1k,
     printSector,
     printDump,
     printATR,
@@ -74,6 +80,7 @@ class TestStatus:
         assert status.S_READ_ERROR.value == "READ ERROR"
         assert status.S_WRITE_ERROR.value == "WRITE ERROR"
         assert status.S_KEY_ERROR.value == "KEY ERROR"
+        assert status.S_NO_ACCESS.value == "NO ACCESS"
         assert status.S_NO_READERS.value == "NO READERS"
 
 
@@ -134,6 +141,78 @@ class TestParseAccessBits:
                 for val in result:
                     assert 0 <= val <= 7, f"Access bit value {val} out of range for b6={b6}, b7={b7}"
 
+    def test_parseAccessBits_transport(self):
+        """Test transport configuration FF 07 gives 000 data blocks and 001 trailer."""
+        assert parseAccessBits(0xFF, 0x07) == bytearray([0b000, 0b000, 0b000, 0b001])
+    
+    def test_parseAccessBits_c2(self):
+        """Test C2 bit is decoded (0F 07: data blocks 010, trailer 011)."""
+        assert parseAccessBits(0x0F, 0x07) == bytearray([0b010, 0b010, 0b010, 0b011])
+
+
+class TestDecodeAccessBits:
+    """Test table driven decodeAccessBits function."""
+    
+    def test_decode_transport(self):
+        """Test access bits of a new card."""
+        assert decodeAccessBits([0xFF, 0x07, 0x80]) == (True, (0b000, 0b000, 0b000, 0b001))
+    
+    def test_decode_per_block(self):
+        """Test different condition per block (block 1 = 101)."""
+        valid, conditions = decodeAccessBits(bytes([0x7D, 0x25, 0xA8]))
+        assert valid is True
+        assert conditions[1] == 0b101
+    
+    def test_decode_invalid_check_byte(self):
+        """Test broken inverted copy is reported."""
+        assert decodeAccessBits([0xFF, 0x07, 0x81])[0] is False
+        assert decodeAccessBits([0xFE, 0x07, 0x80])[0] is False
+        assert decodeAccessBits([0x00, 0x00, 0x00])[0] is False
+    
+    def test_table_matches_bitwise_decoder(self):
+        """Test every table row against emulator bitwise decoder for all valid access bytes."""
+        from nfc_reader.emulator import decodeAccessConditions
+        assert len(ACCESS_TABLE) == 4096
+        for index in range(4096):
+            c1, c2, c3 = index & 0x0F, (index >> 4) & 0x0F, index >> 8
+            accessBytes = [(~((c2 << 4) | c1)) & 0xFF, (c1 << 4) | (~c3 & 0x0F), (c3 << 4) | c2]
+            valid, conditions = decodeAccessBits(accessBytes)
+            assert (valid, list(conditions)) == decodeAccessConditions(accessBytes)
+            assert valid is True
+            assert parseAccessBits(accessBytes[0], accessBytes[1]) == bytearray(conditions)
+
+
+class TestValueBlock:
+    """Test value block encoding."""
+
+    def test_encode_layout(self):
+        """Test value, inverted value, value and address bytes."""
+        assert encodeValueBlock(1, 4) == bytes([0x01, 0x00, 0x00, 0x00, 0xFE, 0xFF, 0xFF, 0xFF,
+                                                0x01, 0x00, 0x00, 0x00, 0x04, 0xFB, 0x04, 0xFB])
+
+    def test_round_trip(self):
+        """Test decode of encoded values including negative and limits."""
+        for value in (0, 100, -1, -(1 << 31), (1 << 31) - 1):
+            assert decodeValueBlock(encodeValueBlock(value, 9)) == (True, value, 9)
+
+    def test_decode_corrupted(self):
+        """Test block with broken copy is not a value block."""
+        data = bytearray(encodeValueBlock(500, 5))
+        data[8] ^= 0x01
+        assert decodeValueBlock(data)[0] is False
+        data = bytearray(encodeValueBlock(500, 5))
+        data[13] = 0x05
+        assert decodeValueBlock(data)[0] is False
+        assert decodeValueBlock(bytes(16))[0] is False
+        assert decodeValueBlock(bytes(4))[0] is False
+
+    def test_encode_out_of_range(self):
+        """Test value not fitting 32 bits is refused."""
+        with pytest.raises(ValueError):
+            encodeValueBlock(1 << 31)
+        with pytest.raises(ValueError):
+            encodeValueBlock(0, 256)
+
 
 class TestBitAccessMap:
     """Test bitAccessMap dictionary."""
@@ -220,6 +299,60 @@ class TestKey:
         assert "[00 11 22 33 44 55]" in result
 
 
+class TestKeyMap:
+    """Test KeyMap class."""
+    
+    def test_keymap_default(self):
+        """Test new key map has default key for every sector."""
+        keyMap = KeyMap()
+        candidates = keyMap.candidates(5)
+        assert len(candidates) == 1
+        assert candidates[0].keyType == keyType.KT_A
+        assert candidates[0].keyData == MIFARE_1K_default_key
+    
+    def test_keymap_sector_keys_first(self):
+        """Test own keys of sector are tried before default keys, without duplicates."""
+        keyMap = KeyMap()
+        keyMap.addKey(key(keyType.KT_B, [0xB0] * 6), 3)
+        keyMap.addKey(key(keyType.KT_A, [0xFF] * 6), 3)
+        keyMap.addKey(key(keyType.KT_B, [0xB0] * 6), 3)
+        
+        assert [k.toStr() for k in keyMap.candidates(3)] == ["B:[B0 B0 B0 B0 B0 B0]", "A:[FF FF FF FF FF FF]"]
+        assert [k.toStr() for k in keyMap.candidates(4)] == ["A:[FF FF FF FF FF FF]"]
+    
+    def test_keymap_fromLines(self):
+        """Test key file parsing."""
+        keyMap = KeyMap.fromLines([
+            "# sector type key",
+            "*  A  FFFFFFFFFFFF",
+            "",
+            "1  a  A0 A1 A2 A3 A4 A5   # office",
+            "1  B  B0B1B2B3B4B5",
+        ])
+        assert [k.toStr() for k in keyMap.candidates(1)] == ["A:[A0 A1 A2 A3 A4 A5]", "B:[B0 B1 B2 B3 B4 B5]",
+                                                              "A:[FF FF FF FF FF FF]"]
+        assert [k.toStr() for k in keyMap.candidates(0)] == ["A:[FF FF FF FF FF FF]"]
+    
+    def test_keymap_only_sector_keys(self):
+        """Test sectors not in file have no keys when file has no default key."""
+        keyMap = KeyMap.fromLines(["2 A A0A1A2A3A4A5"])
+        assert keyMap.candidates(0) == []
+        assert len(keyMap.candidates(2)) == 1
+    
+    @pytest.mark.parametrize("line", ["1 A FFFF", "16 A FFFFFFFFFFFF", "1 C FFFFFFFFFFFF", "1 A", "x A FFFFFFFFFFFF"])
+    def test_keymap_fromLines_errors(self, line):
+        """Test wrong lines are reported with line number."""
+        with pytest.raises(ValueError, match="line 2"):
+            KeyMap.fromLines(["* A FFFFFFFFFFFF", line])
+    
+    def test_keymap_fromFile(self, tmp_path):
+        """Test loading key map from file."""
+        fileName = tmp_path / "keys.txt"
+        fileName.write_text("0 B 112233445566\n")
+        keyMap = KeyMap.fromFile(str(fileName))
+        assert keyMap.candidates(0)[0].toStr() == "B:[11 22 33 44 55 66]"
+
+
 class TestDumpMifare1kBlock:
     """Test dumpMifare_1k.block class."""
     
@@ -390,6 +523,14 @@ class TestDumpMifare1k:
         assert len(dump.ATR) == 0
         assert dump.status == status.S_NOINIT
     
+    def test_dumpMifare1k_parts_slotted(self):
+        """Test dump parts have no per-instance __dict__."""
+        dump = dumpMifare_1k()
+        for part in (dump.head, dump.sectors[0], dump.sectors[0].blocks[0], dump.sectors[0].trailer, dump.sectors[0].trailer.keyB):
+            assert not hasattr(part, "__dict__")
+        with pytest.raises(AttributeError):
+            dump.sectors[0].blocks[0].unknown = 1
+    
     def test_dumpMifare1k_sectors_initialized(self):
         """Test dump sectors are properly initialized."""
         dump = dumpMifare_1k()
@@ -398,6 +539,96 @@ class TestDumpMifare1k:
             assert len(sector.blocks) == MIFARE_1K_blocks_per_sector
 
 
+class TestCompactDumpMifare1k:
+    """Test compactDumpMifare_1k single buffer card image."""
+    
+    def test_compact_init(self):
+        """Test compact dump has one image and status arrays."""
+        dump = compactDumpMifare_1k()
+        assert len(dump.image) == 1024
+        assert len(dump.sectors) == MIFARE_1K_total_sectors
+        assert len(dump.sectors[0].blocks) == MIFARE_1K_blocks_per_sector
+        assert dump.sectors[15].blocks[3].status == status.S_NOINIT
+        assert dump.sectors[3].status == status.S_NOINIT
+        assert dump.status == status.S_NOINIT
+        assert dump.restored == 0
+    
+    def test_compact_block_view(self):
+        """Test block data is a view into the image."""
+        dump = compactDumpMifare_1k()
+        block = dump.sectors[2].blocks[1]
+        block.data = [0x11] * MIFARE_1K_bytes_per_block
+        block.status = status.S_OK
+        
+        assert isinstance(block.data, memoryview)
+        assert dump.image[9 * 16:10 * 16] == bytes([0x11] * 16)
+        assert dump.sectors[2].blocks[1].status == status.S_OK
+        assert dump.blockStatus[9] != 0
+    
+    def test_compact_block_wrong_length(self):
+        """Test block data of wrong length does not resize image."""
+        dump = compactDumpMifare_1k()
+        with pytest.raises(ValueError):
+            dump.sectors[0].blocks[1].data = [0x00] * 4
+        assert len(dump.image) == 1024
+    
+    def test_compact_sector_index(self):
+        """Test sector list indexing."""
+        dump = compactDumpMifare_1k()
+        assert dump.sectors[-1].nSector == 15
+        with pytest.raises(IndexError):
+            dump.sectors[16]
+        assert [s.nSector for s in dump.sectors] == list(range(16))
+    
+    def test_compact_head_and_trailer(self):
+        """Test head and trailer views decode image bytes."""
+        dump = compactDumpMifare_1k()
+        dump.sectors[0].blocks[0].data = bytes([1, 2, 3, 4, 4, 8, 4, 0] + [0x62] * 8)
+        trailerData = bytes([0x00] * 6 + [0xFF, 0x07, 0x80, 0x69] + [0x12, 0x34, 0x56, 0x78, 0x9A, 0xBC])
+        sector = dump.sectors[1]
+        sector.blocks[3].data = trailerData
+        sector.trailer.processLastBlock(sector.blocks[3].data)
+        
+        assert bytes(dump.head.UID) == bytes([1, 2, 3, 4])
+        assert dump.head.BCC == 4
+        assert bytes(sector.trailer.accessBits) == bytes([0xFF, 0x07, 0x80])
+        assert sector.trailer.GPB == 0x69
+        assert bytes(sector.trailer.keyB.keyData) == bytes([0x12, 0x34, 0x56, 0x78, 0x9A, 0xBC])
+        assert sector.trailer.status == status.S_OK
+        assert bytes(sector.blocks[3].data) == trailerData
+    
+    def test_compact_same_text_as_dump(self):
+        """Test toStr of compact views matches dumpMifare_1k."""
+        dump = dumpMifare_1k()
+        for iSector, sector in enumerate(dump.sectors):
+            sector.status = status.S_OK
+            for iBlock, block in enumerate(sector.blocks):
+                block.data = bytearray([0x41 + iSector] * 15 + [iBlock])
+                block.status = status.S_OK
+            sector.trailer.processLastBlock(sector.blocks[3].data)
+        dump.head.read(dump.sectors[0].blocks[0])
+        dump.sectors[5].blocks[2].status = status.S_READ_ERROR
+        
+        compact = compactDumpMifare_1k.fromDump(dump)
+        
+        assert compact.head.toStr() == dump.head.toStr()
+        for sector, compactSector in zip(dump.sectors, compact.sectors):
+            assert compactSector.status == sector.status
+            assert compactSector.trailer.toStr() == sector.trailer.toStr()
+            for block, compactBlock in zip(sector.blocks, compactSector.blocks):
+                assert compactBlock.toStr(True) == block.toStr(True)
+    
+    @patch('builtins.print')
+    def test_compact_printDump(self, mock_print):
+        """Test printDump works with compact dump."""
+        compact = compactDumpMifare_1k()
+        compact.sectors[0].status = status.S_OK
+        
+        printDump(compact, sectors=list(range(16)))
+        
+        assert mock_print.call_count == 1 + 16 * 5
+
+
 class TestPrintSector:
     """Test printSector function."""
     
@@ -15,13 +15,42 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 from nfc_reader.do_comm import (
     bytes2str,
     fnDoTransmit,
+    fnTransmit,
+    TransmitResult,
+    apduError,
     fnLoadKey,
     fnSelectBlock,
     fnWriteBlock,
     fnReadBlock,
+    fnGetUID,
+    fnValueStore,
+    fnValueIncrement,
+    fnValueRestore,
+    fnValueRead,
+    apduValueBlock,
+    RetryPolicy,
+    KeySlotCache,
+    keySlotsFor,
+    AuthSession,
+    sessionFor,
+    transmit_batch,
+    iter_transmit,
+    apduReadBlock,
+    apduWriteBlock,
+    newWriteBuffer,
+    SW_OK,
+    SW_NO_RESPONSE,
+    APDU_READ_BLOCK,
+    APDU_AUTH_BLOCK,
 )
 
 
+def transmitted(data=None, error=apduError.E_OK):
+    """Result of fnTransmit: OK (90 00) or failed with error class (63 00)."""
+    sw = SW_OK if error == apduError.E_OK else 0x6300
+    return TransmitResult(sw >> 8, sw & 0xFF, data if data is not None else [], error, 0.001)
+
+
 class TestBytes2Str:
     """Test bytes2str function."""
     
@@ -95,21 +124,183 @@ class TestFnDoTransmit:
         
         assert success is True
         assert response == []
+    
+    @patch('builtins.print')
+    def test_fnDoTransmit_prints_nothing(self, mock_print):
+        """Test failed and raising transmit print nothing."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [([], 0x63, 0x00), Exception("Card removed")]
+        
+        assert fnDoTransmit(mock_connection, [0xFF, 0xB0, 0x00, 0x04, 0x10]) == (False, None)
+        assert fnDoTransmit(mock_connection, [0xFF, 0xB0, 0x00, 0x04, 0x10]) == (False, None)
+        mock_print.assert_not_called()
+
+
+class TestFnTransmit:
+    """Test fnTransmit structured results."""
+    
+    def test_fnTransmit_success(self):
+        """Test successful APDU carries data, status word and timing."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([0x01, 0x02], 0x90, 0x00)
+        
+        result = fnTransmit(mock_connection, [0xFF, 0xB0, 0x00, 0x04, 0x10])
+        
+        assert result.ok is True
+        assert result.error == apduError.E_OK
+        assert (result.sw1, result.sw2, result.sw) == (0x90, 0x00, SW_OK)
+        assert result.data == [0x01, 0x02]
+        assert result.elapsed >= 0
+    
+    @pytest.mark.parametrize("apdu,sw1,sw2,error", [
+        ([0xFF, 0x86, 0x00, 0x00, 0x05], 0x63, 0x00, apduError.E_AUTH),
+        ([0xFF, 0x82, 0x00, 0x00, 0x06], 0x63, 0x00, apduError.E_AUTH),
+        ([0xFF, 0xB0, 0x00, 0x04, 0x10], 0x63, 0x00, apduError.E_TRANSIENT),
+        ([0xFF, 0xD6, 0x00, 0x04, 0x10], 0x64, 0x00, apduError.E_TRANSIENT),
+        ([0xFF, 0xB0, 0x00, 0x04, 0x10], 0x6A, 0x81, apduError.E_REFUSED),
+        ([0xFF, 0xB0, 0x00, 0x04, 0x10], 0x67, 0x00, apduError.E_REFUSED),
+    ])
+    def test_fnTransmit_error_class(self, apdu, sw1, sw2, error):
+        """Test status word is classified by INS of the APDU."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], sw1, sw2)
+        
+        result = fnTransmit(mock_connection, apdu)
+        
+        assert result.ok is False
+        assert result.error == error
+        assert result.sw == (sw1 << 8) | sw2
+    
+    def test_fnTransmit_exception(self):
+        """Test raising transmit is no response with the reason kept."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = Exception("Card removed")
+        
+        result = fnTransmit(mock_connection, [0xFF, 0xB0, 0x00, 0x04, 0x10])
+        
+        assert result.error == apduError.E_NO_RESPONSE
+        assert result.sw == SW_NO_RESPONSE
+        assert result.data is None
+        assert result.reason == "Card removed"
+
+
+class TestTransmitBatch:
+    """Test transmit_batch function."""
+    
+    def test_transmit_batch_success(self):
+        """Test all APDUs are sent and results carry status word and data."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [([0x01], 0x90, 0x00), ([0x02], 0x90, 0x00)]
+        
+        results = transmit_batch(mock_connection, [apduReadBlock(4), apduReadBlock(5)])
+        
+        assert [(r.sw, r.data) for r in results] == [(SW_OK, [0x01]), (SW_OK, [0x02])]
+        assert all(r.ok and r.error == apduError.E_OK and r.elapsed >= 0 for r in results)
+        assert mock_connection.transmit.call_count == 2
+    
+    def test_transmit_batch_stop_on_error(self):
+        """Test batch stops after first failed APDU."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [([], 0x63, 0x00), ([0x02], 0x90, 0x00)]
+        
+        results = transmit_batch(mock_connection, [apduReadBlock(4), apduReadBlock(5)])
+        
+        assert [(r.sw, r.data) for r in results] == [(0x6300, [])]
+        assert results[0].error == apduError.E_TRANSIENT
+    
+    def test_transmit_batch_continue_on_error(self):
+        """Test batch continues after failure without stop_on_error."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [([], 0x63, 0x00), ([0x02], 0x90, 0x00)]
+        
+        results = transmit_batch(mock_connection, [apduReadBlock(4), apduReadBlock(5)], stop_on_error=False)
+        
+        assert [(r.sw, r.data) for r in results] == [(0x6300, []), (SW_OK, [0x02])]
+    
+    @patch('builtins.print')
+    def test_transmit_batch_exception(self, mock_print):
+        """Test exception ends batch with SW_NO_RESPONSE and nothing is printed."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = Exception("Card removed")
+        
+        results = transmit_batch(mock_connection, [apduReadBlock(4), apduReadBlock(5)], stop_on_error=False)
+        
+        assert [(r.sw, r.data) for r in results] == [(SW_NO_RESPONSE, None)]
+        assert results[0].error == apduError.E_NO_RESPONSE
+        assert results[0].reason == "Card removed"
+        mock_print.assert_not_called()
+    
+    def test_iter_transmit_lazy(self):
+        """Test iter_transmit sends next APDU only when next result is requested."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([0x01], 0x90, 0x00)
+        
+        results = iter_transmit(mock_connection, [apduReadBlock(4), apduReadBlock(5)])
+        result = next(results)
+        assert (result.sw, result.data) == (SW_OK, [0x01])
+        assert mock_connection.transmit.call_count == 1
+        results.close()
+        assert mock_connection.transmit.call_count == 1
+    
+    def test_transmit_batch_sends_lists(self):
+        """Test table APDUs (bytes) are passed to transmit as lists."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+        
+        transmit_batch(mock_connection, [apduReadBlock(4)])
+        
+        assert mock_connection.transmit.call_args[0][0] == [0xFF, 0xB0, 0x00, 4]
+    
+    def test_apdu_builders(self):
+        """Test read and write APDU builders."""
+        assert apduReadBlock(8) == bytes([0xFF, 0xB0, 0x00, 8])
+        assert apduWriteBlock(9, bytes([1, 2])) == bytes([0xFF, 0xD6, 0x00, 9, 2, 1, 2])
+
+
+class TestApduTables:
+    """Test precomputed APDU tables."""
+    
+    def test_read_table(self):
+        """Test READ BINARY table covers all block addresses."""
+        assert len(APDU_READ_BLOCK) == 256
+        assert APDU_READ_BLOCK[63] == bytes([0xFF, 0xB0, 0x00, 63])
+        assert isinstance(APDU_READ_BLOCK[0], bytes)
+    
+    def test_auth_table(self):
+        """Test GENERAL AUTHENTICATE table by key type and slot."""
+        assert APDU_AUTH_BLOCK[0][0][4] == bytes([0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 4, 0x60, 0x00])
+        assert APDU_AUTH_BLOCK[1][1][255] == bytes([0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 255, 0x61, 0x01])
+    
+    def test_write_buffer_reused(self):
+        """Test full block write APDU is assembled in the buffer given by caller."""
+        buffer = newWriteBuffer()
+        first = apduWriteBlock(4, [0x11] * 16, buffer)
+        assert first is buffer
+        assert bytes(first) == bytes([0xFF, 0xD6, 0x00, 4, 16] + [0x11] * 16)
+        second = apduWriteBlock(5, bytes([0x22] * 16), buffer)
+        assert second is first
+        assert bytes(second) == bytes([0xFF, 0xD6, 0x00, 5, 16] + [0x22] * 16)
+
+    def test_write_without_buffer_not_shared(self):
+        """Test write APDU built without buffer is a new one on every call."""
+        first = apduWriteBlock(4, [0x11] * 16)
+        assert apduWriteBlock(5, [0x22] * 16) is not first
+        assert bytes(first) == bytes([0xFF, 0xD6, 0x00, 4, 16] + [0x11] * 16)
 
 
 class TestFnLoadKey:
     """Test fnLoadKey function."""
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnLoadKey_success(self, mock_transmit):
         """Test fnLoadKey with successful key loading."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         key_data = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
         
         result = fnLoadKey(mock_connection, key_data)
         
-        assert result is True
+        assert result.ok is True
         mock_transmit.assert_called_once()
         # Check APDU command structure
         call_args = mock_transmit.call_args[0]
@@ -122,41 +313,31 @@ class TestFnLoadKey:
         assert apdu[4] == len(key_data)  # Lc
         assert apdu[5:] == key_data  # Key data
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     @patch('nfc_reader.do_comm.bytes2str')
     @patch('builtins.print')
     def test_fnLoadKey_failure(self, mock_print, mock_bytes2str, mock_transmit):
-        """Test fnLoadKey with failed transmission.
-        
-        Note: Current implementation has a bug - it checks the tuple directly
-        instead of the first element. A tuple (False, None) is still truthy in Python.
-        This test reflects the current (buggy) behavior.
-        """
+        """Test fnLoadKey with failed transmission: False, nothing printed."""
         mock_connection = MagicMock()
-        # Return a tuple that should indicate failure, but due to the bug,
-        # the function will treat it as success
-        mock_transmit.return_value = (False, None)
+        mock_transmit.return_value = transmitted(error=apduError.E_AUTH)
         mock_bytes2str.return_value = "[FF FF FF FF FF FF]"
         key_data = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
         
         result = fnLoadKey(mock_connection, key_data)
         
-        # Due to the bug in fnLoadKey (checking tuple instead of first element),
-        # this will actually return True. The correct behavior would be False.
-        # TODO: Fix fnLoadKey to check result[0] instead of result
-        assert result is True  # Current buggy behavior
-        # When fixed, this should be: assert result is False
+        assert result.ok is False
+        mock_print.assert_not_called()
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnLoadKey_empty_key(self, mock_transmit):
         """Test fnLoadKey with empty key data."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         key_data = []
         
         result = fnLoadKey(mock_connection, key_data)
         
-        assert result is True
+        assert result.ok is True
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
         assert apdu[4] == 0  # Lc = 0 for empty key
@@ -165,96 +346,101 @@ class TestFnLoadKey:
 class TestFnSelectBlock:
     """Test fnSelectBlock function."""
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnSelectBlock_success_key_a(self, mock_transmit):
         """Test fnSelectBlock with Key A authentication."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         
         result = fnSelectBlock(mock_connection, 4, 'A')
         
-        assert result is True
+        assert result.ok is True
         mock_transmit.assert_called_once()
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
         assert apdu[0] == 0xFF  # CLA
         assert apdu[1] == 0x86  # INS
-        assert apdu[5] == 0x00  # KeyType = Key A
+        assert apdu[8] == 0x60  # KeyType = Key A
         assert apdu[7] == 4     # BlockAddr
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnSelectBlock_success_key_b(self, mock_transmit):
         """Test fnSelectBlock with Key B authentication."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         
         result = fnSelectBlock(mock_connection, 8, 'B')
         
-        assert result is True
+        assert result.ok is True
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
-        assert apdu[5] == 0x01  # KeyType = Key B
+        assert apdu[8] == 0x61  # KeyType = Key B
         assert apdu[7] == 8     # BlockAddr
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnSelectBlock_success_key_lowercase(self, mock_transmit):
         """Test fnSelectBlock with lowercase key type."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         
         result = fnSelectBlock(mock_connection, 12, 'a')
         
-        assert result is True
+        assert result.ok is True
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
-        assert apdu[5] == 0x00  # KeyType = Key A (lowercase converted)
+        assert apdu[8] == 0x60  # KeyType = Key A (lowercase converted)
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     @patch('builtins.print')
     def test_fnSelectBlock_failure(self, mock_print, mock_transmit):
-        """Test fnSelectBlock with failed authentication.
-        
-        Note: Current implementation has a bug - it checks the tuple directly
-        instead of the first element. This test reflects the current (buggy) behavior.
-        """
+        """Test fnSelectBlock with failed authentication: False, nothing printed."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (False, None)
+        mock_transmit.return_value = transmitted(error=apduError.E_AUTH)
         
         result = fnSelectBlock(mock_connection, 4, 'A')
         
-        # Due to the bug, this will actually return True
-        # TODO: Fix fnSelectBlock to check result[0] instead of result
-        assert result is True  # Current buggy behavior
-        # When fixed, this should be: assert result is False
+        assert result.ok is False
+        mock_print.assert_not_called()
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnSelectBlock_apdu_structure(self, mock_transmit):
         """Test fnSelectBlock APDU command structure."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         
         fnSelectBlock(mock_connection, 16, 'B')
         
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
         # Verify complete APDU structure
-        assert apdu == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 16, 0x60, 0x00]
+        assert list(apdu) == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 16, 0x61, 0x00]
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_fnSelectBlock_key_slot(self, mock_transmit):
+        """Test fnSelectBlock passes reader key slot as last byte."""
+        mock_connection = MagicMock()
+        mock_transmit.return_value = transmitted()
+        
+        fnSelectBlock(mock_connection, 16, 'A', 1)
+        
+        apdu = mock_transmit.call_args[0][1]
+        assert list(apdu) == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 16, 0x60, 0x01]
 
 
 class TestFnWriteBlock:
     """Test fnWriteBlock function."""
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnWriteBlock_success(self, mock_transmit):
         """Test fnWriteBlock with successful write."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         block_data = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08,
                       0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E, 0x0F, 0x10]
         
         result = fnWriteBlock(mock_connection, 4, block_data)
         
-        assert result is True
+        assert result.ok is True
         mock_transmit.assert_called_once()
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
@@ -263,45 +449,39 @@ class TestFnWriteBlock:
         assert apdu[2] == 0x00  # P1
         assert apdu[3] == 4     # BlockAddr
         assert apdu[4] == len(block_data)  # Lc
-        assert apdu[5:] == block_data  # Data
+        assert list(apdu[5:]) == block_data  # Data
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     @patch('builtins.print')
     def test_fnWriteBlock_failure(self, mock_print, mock_transmit):
-        """Test fnWriteBlock with failed write.
-        
-        Note: Current implementation has a bug - it checks the tuple directly
-        instead of the first element. This test reflects the current (buggy) behavior.
-        """
+        """Test fnWriteBlock with failed write: False, nothing printed."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (False, None)
+        mock_transmit.return_value = transmitted(error=apduError.E_AUTH)
         block_data = [0xFF] * 16
         
         result = fnWriteBlock(mock_connection, 8, block_data)
         
-        # Due to the bug, this will actually return True
-        # TODO: Fix fnWriteBlock to check result[0] instead of result
-        assert result is True  # Current buggy behavior
-        # When fixed, this should be: assert result is False
+        assert result.ok is False
+        mock_print.assert_not_called()
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnWriteBlock_empty_data(self, mock_transmit):
         """Test fnWriteBlock with empty data."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         
         result = fnWriteBlock(mock_connection, 12, [])
         
-        assert result is True
+        assert result.ok is True
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
         assert apdu[4] == 0  # Lc = 0 for empty data
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_fnWriteBlock_block_address_calculation(self, mock_transmit):
         """Test fnWriteBlock with different block addresses."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         block_data = [0x00] * 16
         
         # Test block 0 (sector 0, block 0)
@@ -373,47 +553,348 @@ class TestFnReadBlock:
             assert call_args[1][3] == block_addr
 
 
+class TestKeySlotCache:
+    """Test KeySlotCache reader key slot tracking."""
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_loadKey_skips_same_key(self, mock_transmit):
+        """Test second load of the same key does not send LOAD KEYS again."""
+        mock_transmit.return_value = transmitted()
+        cache = KeySlotCache(MagicMock())
+        key_data = [0xFF] * 6
+        
+        assert cache.loadKey(key_data).ok is True
+        assert cache.loadKey(bytearray(key_data)) is None  # no APDU sent
+        
+        assert mock_transmit.call_count == 1
+        assert cache.hits == 1
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_loadKey_other_key_or_slot(self, mock_transmit):
+        """Test different key or different slot is loaded."""
+        mock_transmit.return_value = transmitted()
+        cache = KeySlotCache(MagicMock())
+        
+        cache.loadKey([0xFF] * 6)
+        cache.loadKey([0xA0] * 6)
+        cache.loadKey([0xA0] * 6, nSlot=1)
+        
+        assert mock_transmit.call_count == 3
+        assert mock_transmit.call_args[0][1][3] == 1  # P2 = slot 1
+        assert cache.findSlot([0xA0] * 6) == 0
+        assert cache.findSlot([0x00] * 6) == -1
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    @patch('builtins.print')
+    def test_loadKey_failure_invalidates(self, mock_print, mock_transmit):
+        """Test failed LOAD KEYS drops remembered slots."""
+        cache = KeySlotCache(MagicMock())
+        mock_transmit.return_value = transmitted()
+        cache.loadKey([0xFF] * 6, nSlot=1)
+        mock_transmit.return_value = transmitted(error=apduError.E_AUTH)
+        
+        assert cache.loadKey([0xA0] * 6).error == apduError.E_AUTH
+        assert cache.slots == [None, None]
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_connection_events_invalidate(self, mock_transmit):
+        """Test disconnect and failed response events drop remembered slots."""
+        mock_transmit.return_value = transmitted()
+        cache = KeySlotCache(MagicMock())
+        
+        cache.loadKey([0xFF] * 6)
+        cache.update(None, MagicMock(type="response", args=[0x01, 0x90, 0x00]))
+        assert cache.findSlot([0xFF] * 6) == 0
+        cache.update(None, MagicMock(type="response", args=[0x63, 0x00]))
+        assert cache.findSlot([0xFF] * 6) == -1
+        
+        cache.loadKey([0xFF] * 6)
+        cache.update(None, MagicMock(type="disconnect", args=None))
+        assert cache.findSlot([0xFF] * 6) == -1
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_slotFor_least_recently_used(self, mock_transmit):
+        """Test new key fills free slot first, then replaces least recently used one."""
+        mock_transmit.return_value = transmitted()
+        cache = KeySlotCache(MagicMock())
+        
+        assert cache.slotFor([0xFF] * 6)[0] == 0
+        assert cache.slotFor([0xA0] * 6)[0] == 1
+        assert cache.slotFor([0xFF] * 6) == (0, None)  # hit, slot 1 is least recently used now
+        assert cache.slotFor([0xB0] * 6)[0] == 1
+        
+        assert mock_transmit.call_count == 3
+        assert cache.slots == [bytes([0xFF] * 6), bytes([0xB0] * 6)]
+        assert cache.hits == 1
+    
+    def test_keySlotsFor_same_connection(self):
+        """Test keySlotsFor returns one cache per connection."""
+        connection = MagicMock()
+        assert keySlotsFor(connection) is keySlotsFor(connection)
+        assert keySlotsFor(connection) is not keySlotsFor(MagicMock())
+        connection.addObserver.assert_called_once()
+
+
+class TestAuthSession:
+    """Test AuthSession authenticated sector tracking."""
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_authenticate_same_sector_skipped(self, mock_transmit):
+        """Test repeated authentication to the same sector sends LOAD KEYS and AUTH once."""
+        mock_transmit.return_value = transmitted()
+        session = AuthSession(MagicMock())
+        key_data = [0xFF] * 6
+        
+        assert session.authenticate(4, 'B', key_data) is True
+        assert session.authenticate(6, 'b', key_data) is True
+        
+        assert mock_transmit.call_count == 2
+        assert session.skipped == 1
+        assert session.sector == 1
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_authenticate_new_sector_or_key(self, mock_transmit):
+        """Test other sector, key type or key re-authenticates."""
+        mock_transmit.return_value = transmitted()
+        session = AuthSession(MagicMock())
+        
+        session.authenticate(4, 'B', [0xFF] * 6)
+        session.authenticate(8, 'B', [0xFF] * 6)   # new sector: AUTH only
+        session.authenticate(8, 'A', [0xFF] * 6)   # new key type: AUTH only
+        session.authenticate(8, 'A', [0xA0] * 6)   # new key: LOAD KEYS + AUTH
+        
+        assert mock_transmit.call_count == 6
+        assert session.skipped == 0
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_alternating_keys_use_both_slots(self, mock_transmit):
+        """Test key A and key B used in turn are loaded once each."""
+        mock_transmit.return_value = transmitted()
+        session = AuthSession(MagicMock())
+        
+        for nBlock in (4, 8, 12, 16):
+            session.authenticate(nBlock, 'A', [0xA0] * 6)
+            session.authenticate(nBlock, 'B', [0xB0] * 6)
+        
+        loads = [c for c in mock_transmit.call_args_list if c[0][1][1] == 0x82]
+        assert [c[0][1][3] for c in loads] == [0, 1]
+        assert mock_transmit.call_count == 2 + 8
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    @patch('builtins.print')
+    def test_authenticate_failure(self, mock_print, mock_transmit):
+        """Test failed AUTH leaves session unauthenticated."""
+        session = AuthSession(MagicMock())
+        mock_transmit.side_effect = [transmitted(), transmitted(error=apduError.E_AUTH)]
+        
+        assert session.authenticate(4, 'A', [0xFF] * 6) is False
+        assert session.keyError is False
+        assert session.sector == -1
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    @patch('builtins.print')
+    def test_authenticate_key_failure(self, mock_print, mock_transmit):
+        """Test failed LOAD KEYS is reported as key error."""
+        session = AuthSession(MagicMock())
+        mock_transmit.return_value = transmitted(error=apduError.E_AUTH)
+        
+        assert session.authenticate(4, 'A', [0xFF] * 6) is False
+        assert session.keyError is True
+    
+    def test_authenticate_error_class(self):
+        """Test failed authenticate keeps error class of the failed APDU."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [([], 0x90, 0x00), ([], 0x63, 0x00), Exception("Card removed")]
+        session = AuthSession(mock_connection)
+        
+        assert session.authenticate(4, 'A', [0xFF] * 6) is False
+        assert session.lastError == apduError.E_AUTH
+        assert session.lastResult.sw == 0x6300
+        assert session.authenticate(4, 'A', [0xFF] * 6) is False
+        assert session.lastError == apduError.E_NO_RESPONSE
+        assert session.lastResult.reason == "Card removed"
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_authenticate_success_clears_error(self, mock_transmit):
+        """Test failure result does not outlive a later successful or skipped authenticate."""
+        session = AuthSession(MagicMock())
+        mock_transmit.side_effect = [transmitted(), transmitted(error=apduError.E_AUTH), transmitted()]
+        
+        assert session.authenticate(4, 'A', [0xFF] * 6) is False
+        assert session.keyError is False
+        assert session.lastError == apduError.E_AUTH
+        assert session.authenticate(4, 'A', [0xFF] * 6) is True
+        assert session.lastResult is None
+        assert session.authenticate(5, 'A', [0xFF] * 6) is True   # skipped, no APDU
+        assert session.lastError is None
+    
+    @patch('nfc_reader.do_comm.fnTransmit')
+    def test_failed_response_invalidates(self, mock_transmit):
+        """Test failed APDU and reconnect events drop authenticated state."""
+        mock_transmit.return_value = transmitted()
+        session = AuthSession(MagicMock())
+        
+        session.authenticate(4, 'A', [0xFF] * 6)
+        session.update(None, MagicMock(type="response", args=[0x63, 0x00]))
+        assert session.isAuthenticated(4, 'A', [0xFF] * 6) is False
+        
+        session.authenticate(4, 'A', [0xFF] * 6)
+        session.update(None, MagicMock(type="reconnect", args=None))
+        assert session.isAuthenticated(4, 'A', [0xFF] * 6) is False
+    
+    def test_sessionFor_same_connection(self):
+        """Test sessionFor returns one session per connection sharing its key slots."""
+        connection = MagicMock()
+        assert sessionFor(connection) is sessionFor(connection)
+        assert sessionFor(connection).keySlots is keySlotsFor(connection)
+
+
 class TestIntegration:
     """Integration tests for multiple operations."""
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_load_key_then_authenticate(self, mock_transmit):
         """Test loading key and then authenticating to a block."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [])
+        mock_transmit.return_value = transmitted()
         key_data = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
         
         # Load key
         key_loaded = fnLoadKey(mock_connection, key_data)
-        assert key_loaded is True
+        assert key_loaded.ok is True
         
         # Authenticate to block
         authenticated = fnSelectBlock(mock_connection, 4, 'A')
-        assert authenticated is True
+        assert authenticated.ok is True
         
         # Verify both operations were called
         assert mock_transmit.call_count == 2
     
-    @patch('nfc_reader.do_comm.fnDoTransmit')
+    @patch('nfc_reader.do_comm.fnTransmit')
     def test_authenticate_then_read_write(self, mock_transmit):
         """Test authenticating, then reading and writing blocks."""
         mock_connection = MagicMock()
-        mock_transmit.return_value = (True, [0x00] * 16)
+        mock_transmit.return_value = transmitted([0x00] * 16)
         block_data = [0x01] * 16
         
         # Authenticate
-        assert fnSelectBlock(mock_connection, 4, 'A') is True
+        assert fnSelectBlock(mock_connection, 4, 'A').ok is True
         
         # Read block
         success, data = fnReadBlock(mock_connection, 4)
         assert success is True
         
         # Write block
-        assert fnWriteBlock(mock_connection, 4, block_data) is True
+        assert fnWriteBlock(mock_connection, 4, block_data).ok is True
         
         # Verify all operations were called
         assert mock_transmit.call_count == 3
 
 
+class TestFnGetUID:
+    """Test fnGetUID function."""
+    
+    def test_fnGetUID_success(self):
+        """Test fnGetUID sends GET DATA and returns UID."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([0xDE, 0xAD, 0xBE, 0xEF], 0x90, 0x00)
+        
+        success, uid = fnGetUID(mock_connection)
+        
+        assert success is True
+        assert uid == [0xDE, 0xAD, 0xBE, 0xEF]
+        mock_connection.transmit.assert_called_once_with([0xFF, 0xCA, 0x00, 0x00, 0x00])
+    
+    @patch('builtins.print')
+    def test_fnGetUID_failure(self, mock_print):
+        """Test fnGetUID when reader does not support GET DATA."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x6A, 0x81)
+        
+        assert fnGetUID(mock_connection) == (False, None)
+
+
+class TestValueBlockCommands:
+    """Test value block APDUs."""
+
+    def test_apduValueBlock(self):
+        """Test value is sent signed, MSB first."""
+        assert apduValueBlock(5, 0x01, 0x01020304) == bytes([0xFF, 0xD7, 0x00, 0x05, 0x05, 0x01, 0x01, 0x02, 0x03, 0x04])
+        assert apduValueBlock(5, 0x02, -1)[6:] == bytes([0xFF] * 4)
+        with pytest.raises(ValueError):
+            apduValueBlock(5, 0x01, 1 << 31)
+
+    def test_fnValueIncrement(self):
+        """Test increment is one APDU."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+
+        result = fnValueIncrement(mock_connection, 4, 10)
+        assert result.ok is True
+        mock_connection.transmit.assert_called_once_with([0xFF, 0xD7, 0x00, 0x04, 0x05, 0x01, 0x00, 0x00, 0x00, 0x0A])
+
+    def test_fnValueRestore(self):
+        """Test restore carries target block."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+
+        assert fnValueRestore(mock_connection, 4, 5).ok is True
+        mock_connection.transmit.assert_called_once_with([0xFF, 0xD7, 0x00, 0x04, 0x02, 0x03, 0x05])
+
+    @patch('builtins.print')
+    def test_fnValueRead(self, mock_print):
+        """Test value is decoded from MSB first answer."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([0xFF, 0xFF, 0xFF, 0xFE], 0x90, 0x00)
+        result, value = fnValueRead(mock_connection, 4)
+        assert (result.ok, value) == (True, -2)
+        mock_connection.transmit.assert_called_once_with([0xFF, 0xB1, 0x00, 0x04, 0x04])
+
+        mock_connection.transmit.return_value = ([], 0x63, 0x00)
+        result, value = fnValueRead(mock_connection, 4)
+        assert (result.ok, value) == (False, None)
+        assert (result.sw, result.error) == (0x6300, apduError.E_TRANSIENT)
+
+    def test_value_refused_status_kept(self):
+        """Test status word and error class of refused value operation are returned."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x6A, 0x81)
+
+        result = fnValueStore(mock_connection, 4, 1)
+        assert not result
+        assert (result.sw, result.error) == (0x6A81, apduError.E_REFUSED)
+
+
+class TestRetryPolicy:
+    """Test RetryPolicy classification and backoff."""
+
+    @patch('nfc_reader.do_comm.time.sleep')
+    def test_transient_retried_with_backoff(self, mock_sleep):
+        """Test transient status word is retried with growing pause until attempts are used."""
+        policy = RetryPolicy(attempts=3, backoff=0.01, factor=2.0)
+        for failures in (1, 2):
+            assert policy.shouldRetry(0x6300, failures) is True
+            policy.wait(failures)
+        assert policy.shouldRetry(0x6300, 3) is False
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [0.01, 0.02]
+        assert policy.retries == 2
+
+    @patch('nfc_reader.do_comm.time.sleep')
+    def test_shouldRetry_is_pure(self, mock_sleep):
+        """Test asking whether a retry is allowed neither waits nor counts a retry."""
+        policy = RetryPolicy(backoff=0.01)
+        assert policy.shouldRetry(0x6300, 1) is True
+        assert policy.shouldRetry(0x6300, 1) is True
+        mock_sleep.assert_not_called()
+        assert policy.retries == 0
+
+    def test_definitive_not_retried(self):
+        """Test unsupported command, wrong length and lost card are definitive."""
+        policy = RetryPolicy(backoff=0)
+        for sw in (0x6A81, 0x6700, 0x6D00, SW_NO_RESPONSE):
+            assert policy.shouldRetry(sw, 1) is False
+        assert policy.retries == 0
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,190 @@
+"""
+Tests for do_trace module.
+
+This module tests recording APDU traces of emulated card sessions and
+replaying them without the card, with original or scaled timing.
+"""
+import pytest
+from unittest.mock import patch
+import sys
+import os
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+from smartcard.Exceptions import CardConnectionException
+
+from nfc_reader.emulator import MifareClassic1K, EmulatedReader
+
+import card_data
+import do_comm
+import do_wr
+import do_trace
+
+KEY_FF = card_data.key(card_data.keyType.KT_A, [0xFF] * 6)
+
+
+def recordedRead(path, sectors=(0, 1), latency=0.0):
+    #read sectors of emulated card through TraceRecorder, returns (dump, recorder)
+    card = MifareClassic1K(uid=bytes([1, 2, 3, 4]))
+    card.image[64:80] = bytes(range(16))
+    reader = EmulatedReader(latency=latency)
+    reader.insert(card)
+    recorder = do_trace.TraceRecorder(reader.createConnection(), path)
+    recorder.connect()
+    dump = card_data.dumpMifare_1k()
+    with patch('builtins.print'):
+        do_wr.fnRead(recorder, dump, KEY_FF, list(sectors))
+    recorder.close()
+    return dump, recorder
+
+
+class TestTraceRecorder:
+    """Test TraceRecorder connection wrapper."""
+
+    def test_records_every_apdu(self, tmp_path):
+        """Test every APDU is recorded with response, SW and timing."""
+        path = str(tmp_path / "tap.trace")
+        dump, recorder = recordedRead(path)
+
+        records = do_trace.readTrace(path)
+
+        assert len(records) == recorder.records > 0
+        assert records[0].command[:2] == bytes([0xFF, 0x82])  # LOAD KEYS first
+        assert all(r.sw == do_comm.SW_OK for r in records)
+        assert all(r.elapsed >= 0 for r in records)
+        assert [r.time for r in records] == sorted(r.time for r in records)
+        read4 = next(r for r in records if r.command == bytes(do_comm.APDU_READ_BLOCK[4]))
+        assert read4.response == bytes(range(16))
+
+    def test_append_only(self, tmp_path):
+        """Test second session is appended after the first one under one header."""
+        path = str(tmp_path / "tap.trace")
+        _, first = recordedRead(path, sectors=[0])
+        _, second = recordedRead(path, sectors=[1])
+
+        assert len(do_trace.readTrace(path)) == first.records + second.records
+
+    def test_card_removed_recorded(self, tmp_path):
+        """Test APDU without answer is recorded as SW_NO_RESPONSE and still raises."""
+        path = str(tmp_path / "tap.trace")
+        reader = EmulatedReader()
+        reader.insert(MifareClassic1K())
+        recorder = do_trace.TraceRecorder(reader.createConnection(), path)
+        recorder.connect()
+        reader.remove()
+
+        with pytest.raises(CardConnectionException):
+            recorder.transmit(list(do_comm.APDU_READ_BLOCK[4]))
+        recorder.close()
+
+        records = do_trace.readTrace(path)
+        assert [(r.sw, r.response) for r in records] == [(do_comm.SW_NO_RESPONSE, b"")]
+
+    def test_batches_recorded(self, tmp_path):
+        """Test APDUs of iter_transmit are not sent around the recorder."""
+        path = str(tmp_path / "tap.trace")
+        reader = EmulatedReader()
+        reader.insert(MifareClassic1K())
+        recorder = do_trace.TraceRecorder(reader.createConnection(), path)
+        recorder.connect()
+
+        assert do_comm._rawTransmitter(recorder) is None
+        do_comm.transmit_batch(recorder, [do_comm.APDU_READ_BLOCK[4]] * 3, stop_on_error=False)
+        recorder.close()
+
+        assert len(do_trace.readTrace(path)) == 3
+
+
+class TestTraceFile:
+    """Test binary trace format."""
+
+    def test_truncated_record_ignored(self, tmp_path):
+        """Test record cut by crash of recording process is dropped."""
+        path = str(tmp_path / "tap.trace")
+        recordedRead(path, sectors=[0])
+        data = open(path, "rb").read()
+
+        records = do_trace.decodeTrace(data)
+
+        assert len(do_trace.decodeTrace(data[:-1])) == len(records) - 1
+
+    def test_not_a_trace(self):
+        """Test foreign file and unknown version are refused."""
+        with pytest.raises(do_trace.TraceError):
+            do_trace.decodeTrace(b"\x00" * 32)
+        with pytest.raises(do_trace.TraceError):
+            do_trace.decodeTrace(do_trace.TRACE_HEADER.pack(do_trace.TRACE_MAGIC, 99))
+
+    def test_record_roundtrip(self):
+        """Test record is encoded with microsecond resolution."""
+        record = do_trace.TraceRecord(1700000000.123456, 0.012345, 0x6300, b"\xff\x86", b"")
+        data = do_trace.TRACE_HEADER.pack(do_trace.TRACE_MAGIC, do_trace.TRACE_VERSION) + record.toBytes()
+
+        decoded, = do_trace.decodeTrace(data)
+
+        assert decoded.time == pytest.approx(record.time, abs=1e-6)
+        assert decoded.elapsed == pytest.approx(0.012345, abs=1e-6)
+        assert (decoded.sw, decoded.command, decoded.response) == (0x6300, b"\xff\x86", b"")
+
+
+class TestReplayConnection:
+    """Test ReplayConnection answering from trace."""
+
+    def test_replay_reads_same_dump(self, tmp_path):
+        """Test replayed session reproduces the recorded dump without card."""
+        path = str(tmp_path / "tap.trace")
+        recorded, _ = recordedRead(path)
+        connection = do_trace.ReplayConnection.fromFile(path, scale=0)
+        connection.connect()
+        dump = card_data.dumpMifare_1k()
+
+        with patch('builtins.print'):
+            assert do_wr.fnRead(connection, dump, KEY_FF, [0, 1]) is True
+
+        assert connection.error is None
+        assert connection.remaining() == 0
+        assert dump.sectors[1].blocks[0].data == recorded.sectors[1].blocks[0].data
+
+    def test_scaled_timing(self, tmp_path):
+        """Test replay waits recorded transmit time multiplied by scale."""
+        path = str(tmp_path / "tap.trace")
+        recordedRead(path, sectors=[0], latency=0.002)
+        records = do_trace.readTrace(path)
+        connection = do_trace.ReplayConnection(records, scale=0.5)
+        connection.connect()
+
+        with patch('nfc_reader.do_trace.time.sleep') as mock_sleep, patch('builtins.print'):
+            do_wr.fnRead(connection, card_data.dumpMifare_1k(), KEY_FF, [0])
+
+        assert mock_sleep.call_count == len(records)
+        assert connection.waited == pytest.approx(sum(r.elapsed for r in records) * 0.5)
+        assert all(r.elapsed >= 0.002 for r in records)
+
+    def test_changed_apdus_detected(self, tmp_path):
+        """Test session sending other APDUs than recorded fails with mismatch kept."""
+        path = str(tmp_path / "tap.trace")
+        recordedRead(path, sectors=[0])
+        connection = do_trace.ReplayConnection.fromFile(path, scale=0)
+        connection.connect()
+
+        with patch('builtins.print'):
+            assert do_wr.fnRead(connection, card_data.dumpMifare_1k(), KEY_FF, [1]) is False
+
+        assert connection.error is not None
+        assert "recorded" in connection.error
+
+    def test_removed_card_replayed(self):
+        """Test APDU recorded without answer raises as removed card."""
+        record = do_trace.TraceRecord(0.0, 0.0, do_comm.SW_NO_RESPONSE, bytes(do_comm.APDU_READ_BLOCK[4]), b"")
+        connection = do_trace.ReplayConnection([record], scale=0)
+        connection.connect()
+
+        with pytest.raises(CardConnectionException):
+            connection.transmit(list(do_comm.APDU_READ_BLOCK[4]))
+        assert connection.error is None
@@ -0,0 +1,693 @@
+"""
+Tests for do_wr module.
+
+This module tests the card read and write engines against the software
+MIFARE Classic 1K card from the emulator package.
+"""
+import pytest
+from unittest.mock import patch
+import sys
+import os
+import json
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+from nfc_reader.emulator import MifareClassic1K, EmulatedReader
+
+import card_data
+import do_prompt
+import do_wr
+import do_comm
+
+KEY_FF = [0xFF] * 6
+KEY_A0 = [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5]
+KEY_B0 = [0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5]
+
+# access bits: blocks 0,2 readable by A/B, block 1 readable only by B (101), trailer 011
+ACCESS_BLOCK1_KEY_B = [0x7D, 0x25, 0xA8, 0x69]
+
+
+class TearingCard(MifareClassic1K):
+    """Card which acknowledges the first `lost` writes without storing them."""
+
+    def __init__(self, lost):
+        super().__init__()
+        self.lost = lost
+
+    def write(self, nBlock, data):
+        if self.lost > 0:
+            self.lost -= 1
+            return True
+        return super().write(nBlock, data)
+
+
+class NoisyCard(MifareClassic1K):
+    """Card which fails READ/WRITE of some blocks the given number of times (RF noise)."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = dict(failures) #block -> number of failed commands
+
+    def _noise(self, nBlock):
+        if self.failures.get(nBlock, 0) > 0:
+            self.failures[nBlock] -= 1
+            return True
+        return False
+
+    def read(self, nBlock):
+        return self._refuse() if self._noise(nBlock) else super().read(nBlock)
+
+    def write(self, nBlock, data):
+        return self._fail() if self._noise(nBlock) else super().write(nBlock, data)
+
+
+class FlakyReader(EmulatedReader):
+    """Reader whose card leaves the field after `reads` READ BINARY commands."""
+
+    def __init__(self, reads):
+        super().__init__()
+        self.reads = reads
+
+    def process(self, apdu):
+        if bytes(apdu)[1] == 0xB0:
+            if self.reads == 0:
+                self.card = None
+            self.reads -= 1
+        return super().process(apdu)
+
+
+class RefusingReader(EmulatedReader):
+    """Reader which answers every WRITE BINARY with the given status word."""
+
+    def __init__(self, sw):
+        super().__init__()
+        self.sw = sw
+
+    def process(self, apdu):
+        if bytes(apdu)[1] == 0xD6:
+            self.stats[0xD6] += 1
+            return [], self.sw >> 8, self.sw & 0xFF
+        return super().process(apdu)
+
+
+def writeAnswer(nSector, nBlock, data):
+    answer = do_prompt.PromptAnswer_ForWrite(nSector, nBlock)
+    answer.data = bytearray(data)
+    return answer
+
+
+class TestFnRead:
+    """Test fnRead function."""
+
+    @patch('builtins.print')
+    def test_fnRead_sector_batches(self, mock_print, connectedReader):
+        """Test fnRead sends one AUTH and four READ per sector."""
+        card = MifareClassic1K()
+        card.setBlock(5, bytes(range(16)))
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.key()) is True
+        assert bytes(dump.sectors[1].blocks[1].data) == bytes(range(16))
+        assert dump.sectors[1].status == card_data.status.S_OK
+        assert reader.stats[0x86] == 16
+
+    @patch('builtins.print')
+    def test_fnRead_unreadable_block(self, mock_print, connectedReader):
+        """Test block forbidden for available keys by access bits is skipped without APDU."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_FF, ACCESS_BLOCK1_KEY_B, KEY_B0)
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.key()) is True
+        sector = dump.sectors[2]
+        assert sector.status == card_data.status.S_OK
+        assert [block.status for block in sector.blocks] == [card_data.status.S_OK, card_data.status.S_NO_ACCESS,
+                                                             card_data.status.S_OK, card_data.status.S_OK]
+        assert reader.stats[0x86] == 16
+        assert reader.stats[0xB0] == 63
+        assert sector.trailer.status == card_data.status.S_OK
+        assert bytes(sector.trailer.accessBits) == bytes(ACCESS_BLOCK1_KEY_B[:3])
+
+    @patch('builtins.print')
+    def test_fnRead_key_b_for_block(self, mock_print, connectedReader):
+        """Test block readable only by key B is read with key B, the rest with key A."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_FF, ACCESS_BLOCK1_KEY_B, KEY_B0)
+        card.setBlock(9, b"key B only block")
+        reader, connection = connectedReader(card)
+        plan = {2: [card_data.key(card_data.keyType.KT_A), card_data.key(card_data.keyType.KT_B, KEY_B0)]}
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, plan, sectors=[2]) is True
+        assert bytes(dump.sectors[2].blocks[1].data) == b"key B only block"
+        assert reader.stats[0x86] == 2
+        assert reader.stats[0xB0] == 4
+
+    @patch('builtins.print')
+    def test_fnRead_wrong_key(self, mock_print, connectedReader):
+        """Test sector with other key is reported as auth error."""
+        card = MifareClassic1K()
+        card.setTrailer(3, KEY_B0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.key()) is False
+        assert dump.sectors[3].status == card_data.status.S_AUTH_ERROR
+        assert dump.sectors[4].status == card_data.status.S_OK
+
+
+class TestKeyMap:
+    """Test read and write engines with keys per sector."""
+
+    @patch('builtins.print')
+    def test_fnRead_key_map_one_pass(self, mock_print, connectedReader):
+        """Test sectors with different keys are read in one pass."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_A0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        card.setTrailer(5, KEY_B0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        reader, connection = connectedReader(card)
+        keyMap = card_data.KeyMap()
+        keyMap.addKey(card_data.key(card_data.keyType.KT_A, KEY_A0), 2)
+        keyMap.addKey(card_data.key(card_data.keyType.KT_A, KEY_B0))
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, keyMap) is True
+        assert all(sector.status == card_data.status.S_OK for sector in dump.sectors)
+        # sector 5: default FF key refused, then second default key
+        assert reader.stats[0x86] == 16 + 1
+
+    @patch('builtins.print')
+    def test_fnRead_key_map_no_key(self, mock_print, connectedReader):
+        """Test sector no key fits is auth error, others are read."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_A0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.KeyMap()) is False
+        assert dump.sectors[2].status == card_data.status.S_AUTH_ERROR
+        assert dump.sectors[3].status == card_data.status.S_OK
+
+    @patch('builtins.print')
+    def test_fnWrite_key_map(self, mock_print, connectedReader):
+        """Test write uses key of the sector from key map."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_A0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        reader, connection = connectedReader(card)
+        keyMap = card_data.KeyMap.fromLines(["* A FFFFFFFFFFFF", "2 A A0A1A2A3A4A5"])
+
+        assert do_wr.fnWrite(connection, writeAnswer(2, 0, b"key map write 16"), keyMap) is True
+        assert card.block(8) == b"key map write 16"
+
+
+class TestRetryPolicy:
+    """Test retries of transient errors in read and write engines."""
+
+    @patch('builtins.print')
+    def test_read_retries_transient_error(self, mock_print, connectedReader):
+        """Test block failed once is read again after re-authentication, dump is complete."""
+        card = NoisyCard({5: 1})
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+        retry = do_comm.RetryPolicy(backoff=0)
+
+        assert do_wr.fnRead(connection, dump, card_data.key(), sectors=[1], retry=retry) is True
+        assert retry.retries == 1
+        assert reader.stats[0x86] == 2
+        assert reader.stats[0xB0] == 5
+
+    @patch('builtins.print')
+    def test_read_attempts_are_bounded(self, mock_print, connectedReader):
+        """Test block failing on every attempt is reported as read error."""
+        card = NoisyCard({5: 10})
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.key(), sectors=[1], retry=do_comm.RetryPolicy(attempts=3, backoff=0)) is False
+        assert dump.sectors[1].blocks[1].status == card_data.status.S_READ_ERROR
+        assert [b.status for i, b in enumerate(dump.sectors[1].blocks) if i != 1] == [card_data.status.S_OK] * 3
+        assert card.failures[5] == 10 - 3
+
+    @patch('builtins.print')
+    def test_wrong_key_is_not_retried(self, mock_print, connectedReader):
+        """Test AUTH refused with 63 00 is definitive."""
+        card = MifareClassic1K()
+        card.setTrailer(1, KEY_A0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        reader, connection = connectedReader(card)
+        retry = do_comm.RetryPolicy(backoff=0)
+
+        assert do_wr.fnRead(connection, card_data.dumpMifare_1k(), card_data.key(), sectors=[1], retry=retry) is False
+        assert reader.stats[0x86] == 1
+        assert retry.retries == 0
+
+    @patch('builtins.print')
+    def test_write_retries_transient_error(self, mock_print, connectedReader):
+        """Test failed WRITE is sent again and the rest of the batch follows."""
+        card = NoisyCard({4: 1})
+        reader, connection = connectedReader(card)
+
+        assert do_wr.fnWrite(connection, writeAnswer(1, 0, b"A" * 16 + b"B" * 16), card_data.key(),
+                             retry=do_comm.RetryPolicy(backoff=0)) is True
+        assert card.block(4) == b"A" * 16
+        assert card.block(5) == b"B" * 16
+        assert reader.stats[0xD6] == 3
+
+
+class TestResumableRead:
+    """Test reading resumed after card removal."""
+
+    @patch('builtins.print')
+    def test_resume_from_missing_sector(self, mock_print):
+        """Test second tap of the same card reads only sectors missing after the first one."""
+        card = MifareClassic1K()
+        card.setBlock(40, b"sector 10 data  ")
+        reader = FlakyReader(reads=9 * 4 + 2)
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        resume = do_wr.ResumableReads()
+
+        assert do_wr.fnReadResumable(connection, card_data.dumpMifare_1k(), card_data.key(), resume) is False
+        assert list(resume.partial) == ["DEADBEEF"]
+
+        reader.reads = -1
+        reader.insert(card)
+        connection.connect()
+        reads = reader.stats[0xB0]
+        dump  = card_data.dumpMifare_1k()
+        assert do_wr.fnReadResumable(connection, dump, card_data.key(), resume) is True
+        assert reader.stats[0xB0] - reads == 7 * 4
+        assert bytes(dump.sectors[10].blocks[0].data) == b"sector 10 data  "
+        assert dump.sectors[3].status == card_data.status.S_OK
+        assert dump.sectors[3].trailer.status == card_data.status.S_OK
+        assert bytes(dump.head.UID) == bytes([0xDE, 0xAD, 0xBE, 0xEF])
+        assert resume.partial == {}
+
+    @patch('builtins.print')
+    def test_restored_sector_not_trusted_by_diff_write(self, mock_print):
+        """Test diff-write reads restored sector again: card may have changed since earlier tap."""
+        card = MifareClassic1K()
+        card.setBlock(4, b"A" * 16)
+        reader = FlakyReader(reads=9 * 4 + 2)
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        resume = do_wr.ResumableReads()
+        do_wr.fnReadResumable(connection, card_data.dumpMifare_1k(), card_data.key(), resume)
+
+        card.setBlock(4, b"X" * 16)  # changed by other reader between taps
+        reader.reads = -1
+        reader.insert(card)
+        connection.connect()
+        dump = card_data.dumpMifare_1k()
+        assert do_wr.fnReadResumable(connection, dump, card_data.key(), resume) is True
+        assert bytes(dump.sectors[1].blocks[0].data) == b"A" * 16
+        assert dump.restored == card_data.sectorMask(range(9))
+
+        assert do_wr.fnWrite(connection, writeAnswer(1, 0, b"A" * 16), card_data.key(), dump, diff=True) is True
+        assert card.block(4) == b"A" * 16
+        assert reader.stats[0xD6] == 1
+        assert dump.restored == card_data.sectorMask(n for n in range(9) if n != 1)
+
+    @patch('builtins.print')
+    def test_other_card_starts_over(self, mock_print):
+        """Test partial dump of one card is not used for other card."""
+        reader = FlakyReader(reads=4)
+        reader.insert(MifareClassic1K())
+        connection = reader.createConnection()
+        connection.connect()
+        resume = do_wr.ResumableReads(maxCards=1)
+        do_wr.fnReadResumable(connection, card_data.dumpMifare_1k(), card_data.key(), resume, sectors=[0, 1])
+
+        reader.reads = -1
+        reader.insert(MifareClassic1K(uid=bytes([1, 2, 3, 4])))
+        connection.connect()
+        reads = reader.stats[0xB0]
+        assert do_wr.fnReadResumable(connection, card_data.dumpMifare_1k(), card_data.key(), resume, sectors=[0, 1]) is True
+        assert reader.stats[0xB0] - reads == 8
+        assert list(resume.partial) == ["DEADBEEF"]
+
+
+class TestKeySearch:
+    """Test KeySearch engine."""
+
+    CANDIDATES = [card_data.key(card_data.keyType.KT_A, [n] * 6) for n in range(1, 6)]
+
+    @staticmethod
+    def legacyCard(uid):
+        # sectors 0-7 use key 05..., sectors 8-15 key 03...
+        card = MifareClassic1K(uid=uid)
+        for nSector in range(16):
+            keyData = [5] * 6 if nSector < 8 else [3] * 6
+            card.setTrailer(nSector, keyData, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        return card
+
+    def test_findKeys_and_cache(self, tmp_path, connectedReader):
+        """Test keys are found, cached per UID and tried first on next tap."""
+        cacheFile = str(tmp_path / "keys.json")
+        search = do_wr.KeySearch(self.CANDIDATES, cacheFile)
+        reader, connection = connectedReader(self.legacyCard(bytes([1, 2, 3, 4])))
+
+        found = search.findKeys(connection)
+
+        assert {n: bytes(k.keyData) for n, k in found.items()} == {n: bytes([5 if n < 8 else 3] * 6) for n in range(16)}
+        # sector 0: 5 candidates, sectors 1-7: key 05 is first by hits,
+        # sector 8: 05, 01, 02 fail, 03 fits; sectors 9-15: 05 (more hits) fails, 03 fits
+        assert reader.stats[0x86] == 5 + 7 + 4 + 7 * 2
+        assert json.load(open(cacheFile))["cards"]["01020304"]["8"] == "A:030303030303"
+
+        # next tap of the same card, new process: one AUTH per sector
+        search = do_wr.KeySearch(self.CANDIDATES, cacheFile)
+        reader, connection = connectedReader(self.legacyCard(bytes([1, 2, 3, 4])))
+        assert len(search.findKeys(connection)) == 16
+        assert reader.stats[0x86] == 16
+
+    def test_hits_order_for_new_card(self, tmp_path, connectedReader):
+        """Test unknown card tries keys by hit frequency."""
+        search = do_wr.KeySearch(self.CANDIDATES, str(tmp_path / "keys.json"))
+        search.hits = {"A:030303030303": 8, "A:050505050505": 9}
+        reader, connection = connectedReader(self.legacyCard(bytes([9, 9, 9, 9])))
+
+        assert len(search.findKeys(connection)) == 16
+        assert reader.stats[0x86] == 8 + 8 * 2
+
+    def test_card_gone_stops_candidates(self, tmp_path, connectedReader):
+        """Test card which left the field costs one attempt per sector, not one per candidate."""
+        search = do_wr.KeySearch(self.CANDIDATES, str(tmp_path / "keys.json"))
+        reader, connection = connectedReader(self.legacyCard(bytes([1, 2, 3, 4])))
+        search.planForConnection(connection)
+        reader.remove()
+
+        assert search.findKeys(connection) == {}
+        assert reader.stats[0x82] + reader.stats[0x86] == 16
+
+    @patch('builtins.print')
+    def test_fnReadWithKeySearch(self, mock_print, tmp_path, connectedReader):
+        """Test read with key search fills dump and saves cache."""
+        cacheFile = tmp_path / "keys.json"
+        search = do_wr.KeySearch(self.CANDIDATES, str(cacheFile))
+        reader, connection = connectedReader(self.legacyCard(bytes([1, 2, 3, 4])))
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnReadWithKeySearch(connection, dump, search) is True
+        assert len(json.loads(cacheFile.read_text())["cards"]["01020304"]) == 16
+
+    @patch('builtins.print')
+    def test_broken_cache_ignored(self, mock_print, tmp_path):
+        """Test unreadable cache file does not stop search."""
+        cacheFile = tmp_path / "keys.json"
+        cacheFile.write_text("{not json")
+        search = do_wr.KeySearch(self.CANDIDATES, str(cacheFile))
+        assert search.cards == {}
+
+
+class TestIterBlocks:
+    """Test iter_blocks streaming read."""
+
+    def test_iter_blocks_all(self, connectedReader):
+        """Test every block is yielded once in card order."""
+        reader, connection = connectedReader(MifareClassic1K(uid=bytes([1, 2, 3, 4])))
+
+        items = list(do_wr.iter_blocks(connection, card_data.key()))
+
+        assert [(nSector, nBlock) for nSector, nBlock, _, _ in items] == [(s, b) for s in range(16) for b in range(4)]
+        assert all(blockStatus == card_data.status.S_OK for _, _, blockStatus, _ in items)
+        assert bytes(items[0][3][0:4]) == bytes([1, 2, 3, 4])
+
+    def test_iter_blocks_early_stop(self, connectedReader):
+        """Test consumer stopping after wanted block ends card communication."""
+        card = MifareClassic1K()
+        card.setBlock(5, b"badge 0000000042")
+        reader, connection = connectedReader(card)
+
+        for nSector, nBlock, blockStatus, data in do_wr.iter_blocks(connection, card_data.key(), sectors=[1, 2, 3]):
+            if (nSector, nBlock) == (1, 1):
+                assert bytes(data) == b"badge 0000000042"
+                break
+
+        # trailer of sector is read first for access bits, then blocks 0 and 1
+        assert reader.stats[0x86] == 1
+        assert reader.stats[0xB0] == 3
+
+    def test_iter_blocks_key_plan(self, connectedReader):
+        """Test key plan per sector, sector without key is not authenticated."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_B0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        reader, connection = connectedReader(card)
+        plan = {1: card_data.key(), 2: card_data.key(card_data.keyType.KT_A, KEY_B0)}
+
+        items = list(do_wr.iter_blocks(connection, plan, sectors=[1, 2, 3]))
+
+        assert [blockStatus for nSector, _, blockStatus, _ in items if nSector in (1, 2)] == [card_data.status.S_OK] * 8
+        assert [blockStatus for nSector, _, blockStatus, _ in items if nSector == 3] == [card_data.status.S_KEY_ERROR] * 4
+        assert reader.stats[0x86] == 2
+
+    def test_iter_blocks_unreadable_block(self, connectedReader):
+        """Test failed block is yielded with error and the rest of sector is read after re-authentication."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_FF, ACCESS_BLOCK1_KEY_B, KEY_B0)
+        reader, connection = connectedReader(card)
+
+        items = list(do_wr.iter_blocks(connection, card_data.key(), sectors=[2], useAccessBits=False))
+
+        assert [blockStatus for _, _, blockStatus, _ in items] == [card_data.status.S_OK, card_data.status.S_READ_ERROR,
+                                                                   card_data.status.S_OK, card_data.status.S_OK]
+        assert items[1][3] is None
+        assert reader.stats[0x86] == 2
+
+    def test_iter_blocks_readable_key_b(self, connectedReader):
+        """Test key B is not used for data blocks while key B is readable (transport trailer)."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+        plan = {1: [card_data.key(card_data.keyType.KT_A), card_data.key(card_data.keyType.KT_B)]}
+
+        items = list(do_wr.iter_blocks(connection, plan, sectors=[1]))
+
+        assert [blockStatus for _, _, blockStatus, _ in items] == [card_data.status.S_OK] * 4
+        assert reader.stats[0x86] == 1
+
+
+class TestFnWrite:
+    """Test fnWrite function."""
+
+    @patch('builtins.print')
+    def test_fnWrite_sector_batch(self, mock_print, connectedReader):
+        """Test blocks of one sector are written after one AUTH."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+
+        assert do_wr.fnWrite(connection, writeAnswer(1, 0, b"A" * 16 + b"B" * 16), card_data.key()) is True
+        assert card.block(4) == b"A" * 16
+        assert card.block(5) == b"B" * 16
+        assert reader.stats[0x86] == 1
+        assert reader.stats[0xD6] == 2
+
+    @patch('builtins.print')
+    def test_fnWrite_invalid_length(self, mock_print, connectedReader):
+        """Test data not aligned to block size is refused."""
+        reader, connection = connectedReader()
+        assert do_wr.fnWrite(connection, writeAnswer(1, 0, b"A" * 10), card_data.key()) is False
+        assert reader.stats[0xD6] == 0
+
+    def test_planWriteBlocks_steps_over_trailer(self):
+        """Test write plan continues after sector trailer in the next sector, grouped by sector."""
+        plan = do_wr.planWriteBlocks(5, b"A" * 16 + b"B" * 16 + b"C" * 16)
+
+        assert plan == {1: [(5, b"A" * 16), (6, b"B" * 16)], 2: [(8, b"C" * 16)]}
+
+    @patch('builtins.print')
+    def test_fnWrite_skips_trailer(self, mock_print, connectedReader):
+        """Test sequential write steps over sector trailer."""
+        card = MifareClassic1K()
+        trailer = card.block(7)
+        reader, connection = connectedReader(card)
+
+        assert do_wr.fnWrite(connection, writeAnswer(1, 1, b"A" * 16 + b"B" * 16 + b"C" * 16), card_data.key()) is True
+        assert card.block(7) == trailer
+        assert card.block(8) == b"C" * 16
+
+    @patch('builtins.print')
+    def test_fnWrite_trailer_start_refused(self, mock_print, connectedReader):
+        """Test write addressed to sector trailer is refused, not moved to the next sector."""
+        card = MifareClassic1K()
+        trailer = card.block(7)
+        reader, connection = connectedReader(card)
+
+        isOk, blockStatus = do_wr.fnWriteBlocks(connection, writeAnswer(1, 3, b"A" * 16), card_data.key())
+
+        assert (isOk, blockStatus) == (False, {})
+        assert reader.stats[0xD6] == 0
+        assert card.block(7) == trailer
+        assert card.block(8) == bytes(16)
+
+    @patch('builtins.print')
+    def test_fnWrite_diff_cached_dump(self, mock_print, connectedReader):
+        """Test diff-write sends WRITE only for blocks which differ from cached dump."""
+        card = MifareClassic1K()
+        card.setBlock(4, b"A" * 16)
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+        do_wr.fnRead(connection, dump, card_data.key(), sectors=[1])
+        reads = reader.stats[0xB0]
+
+        assert do_wr.fnWrite(connection, writeAnswer(1, 0, b"A" * 16 + b"B" * 16), card_data.key(), dump, diff=True) is True
+        assert card.block(5) == b"B" * 16
+        assert reader.stats[0xD6] == 1
+        assert reader.stats[0xB0] == reads
+        assert bytes(dump.sectors[1].blocks[1].data) == b"B" * 16
+
+    @patch('builtins.print')
+    def test_fnWrite_diff_reads_target_sectors(self, mock_print, connectedReader):
+        """Test diff-write without cached data reads only sectors it writes to."""
+        card = MifareClassic1K()
+        card.setBlock(4, b"A" * 16)
+        card.setBlock(5, b"B" * 16)
+        reader, connection = connectedReader(card)
+
+        assert do_wr.fnWrite(connection, writeAnswer(1, 0, b"A" * 16 + b"B" * 16), card_data.key(), diff=True) is True
+        assert reader.stats[0xD6] == 0
+        assert reader.stats[0xB0] == 4
+
+
+class TestWriteVerify:
+    """Test read-after-write verification."""
+
+    @patch('builtins.print')
+    def test_verify_retries_lost_write(self, mock_print, connectedReader):
+        """Test block which did not stick is written again in the same session."""
+        card = TearingCard(lost=1)
+        reader, connection = connectedReader(card)
+
+        isOk, blockStatus = do_wr.fnWriteBlocks(connection, writeAnswer(1, 0, b"A" * 16 + b"B" * 16), card_data.key(), verify=True)
+        assert isOk is True
+        assert blockStatus == {4: card_data.status.S_OK, 5: card_data.status.S_OK}
+        assert card.block(4) == b"A" * 16
+        assert reader.stats[0xD6] == 3
+        assert reader.stats[0xB0] == 3
+        assert reader.stats[0x86] == 1
+
+    @patch('builtins.print')
+    def test_verify_bounded_retries(self, mock_print, connectedReader):
+        """Test block which never sticks is reported after retries, the rest is still written."""
+        card = TearingCard(lost=1 + do_wr.VERIFY_RETRIES)
+        reader, connection = connectedReader(card)
+
+        isOk, blockStatus = do_wr.fnWriteBlocks(connection, writeAnswer(1, 0, b"A" * 16 + b"B" * 16), card_data.key(), verify=True)
+        assert isOk is False
+        assert blockStatus == {4: card_data.status.S_VERIFY_ERROR, 5: card_data.status.S_OK}
+        assert reader.stats[0xD6] == 2 + do_wr.VERIFY_RETRIES
+
+    @patch('builtins.print')
+    def test_verify_write_refused(self, mock_print, connectedReader):
+        """Test block forbidden for write by access bits is reported as write error."""
+        card = MifareClassic1K()
+        card.setTrailer(2, KEY_FF, ACCESS_BLOCK1_KEY_B, KEY_B0)
+        reader, connection = connectedReader(card)
+
+        isOk, blockStatus = do_wr.fnWriteBlocks(connection, writeAnswer(2, 0, b"A" * 16 + b"B" * 16), card_data.key(),
+                                                verify=True, retry=do_comm.RetryPolicy(attempts=1))
+        assert isOk is False
+        assert blockStatus == {8: card_data.status.S_OK, 9: card_data.status.S_WRITE_ERROR}
+
+    @patch('builtins.print')
+    def test_verify_trailer_masks_keys(self, mock_print, connectedReader):
+        """Test trailer is verified by access bits and GPB: key A always reads back as zeros."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+
+        with do_wr.BulkWriter(card_data.key(), connection, verify=True) as writer:
+            writer.write(1, 3, bytes(KEY_FF) + bytes([0xFF, 0x07, 0x80, 0x69]) + bytes(KEY_B0))
+        assert writer.blockStatus == {7: card_data.status.S_OK}
+        assert reader.stats[0xD6] == 1
+        assert card.block(7)[10:] == bytes(KEY_B0)
+
+    @patch('nfc_reader.do_comm.time.sleep')
+    @patch('builtins.print')
+    def test_verify_transient_write_retried_with_backoff(self, mock_print, mock_sleep, connectedReader):
+        """Test WRITE failed with transient status word is repeated after backoff of retry policy."""
+        card = NoisyCard({4: 1})
+        reader, connection = connectedReader(card)
+        retry = do_comm.RetryPolicy(backoff=0.01)
+
+        isOk, blockStatus = do_wr.fnWriteBlocks(connection, writeAnswer(1, 0, b"A" * 16), card_data.key(), verify=True, retry=retry)
+        assert (isOk, blockStatus) == (True, {4: card_data.status.S_OK})
+        assert reader.stats[0xD6] == 2
+        mock_sleep.assert_called_once_with(0.01)
+        assert retry.retries == 1
+
+    @patch('nfc_reader.do_comm.time.sleep')
+    @patch('builtins.print')
+    def test_verify_definitive_error_not_retried(self, mock_print, mock_sleep):
+        """Test WRITE refused with definitive status word is not repeated."""
+        reader = RefusingReader(0x6A81)
+        reader.insert(MifareClassic1K())
+        connection = reader.createConnection()
+        connection.connect()
+
+        isOk, blockStatus = do_wr.fnWriteBlocks(connection, writeAnswer(1, 0, b"A" * 16), card_data.key(), verify=True)
+        assert (isOk, blockStatus) == (False, {4: card_data.status.S_WRITE_ERROR})
+        assert reader.stats[0xD6] == 1
+        mock_sleep.assert_not_called()
+
+
+class TestBulkWriter:
+    """Test BulkWriter context manager."""
+
+    @patch('builtins.print')
+    def test_bulk_writer_groups_by_sector(self, mock_print, connectedReader):
+        """Test writes are sent on exit, each sector authenticated once."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+
+        with do_wr.BulkWriter(card_data.key(), connection) as writer:
+            writer.write(2, 0, b"sector 2 block 0")
+            writer.writeStr(1, 0, "short")
+            writer.write(2, 1, b"sector 2 block 1")
+            writer.write(1, 2, b"sector 1 block 2")
+            assert reader.stats[0xD6] == 0
+        assert card.block(4) == b"short" + bytes(11)
+        assert card.block(6) == b"sector 1 block 2"
+        assert card.block(9) == b"sector 2 block 1"
+        assert reader.stats[0xD6] == 4
+        assert reader.stats[0x86] == 2
+        assert all(s == card_data.status.S_OK for s in writer.blockStatus.values())
+
+    @patch('builtins.print')
+    def test_bulk_writer_no_flush_on_exception(self, mock_print, connectedReader):
+        """Test nothing is written when the with block raises."""
+        reader, connection = connectedReader()
+
+        with pytest.raises(RuntimeError):
+            with do_wr.BulkWriter(card_data.key(), connection) as writer:
+                writer.write(1, 0, b"A" * 16)
+                raise RuntimeError("abort")
+        assert reader.stats[0xD6] == 0
+
+    def test_bulk_writer_refuses_long_data(self):
+        """Test data longer than block is refused."""
+        writer = do_wr.BulkWriter(card_data.key(), object())
+        with pytest.raises(ValueError):
+            writer.write(1, 0, b"A" * 17)
+
+    @patch('builtins.print')
+    def test_fnWriteBlock_connects_once(self, mock_print, connectedReader):
+        """Test fnWriteBlock waits for card, writes through BulkWriter and disconnects."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+        with patch.object(do_wr, 'CardRequest') as request:
+            request.return_value.waitforcard.return_value.connection = connection
+            assert do_wr.fnWriteBlockStr(1, 1, "0123456789ABCDEF", KEY_FF) is True
+        assert card.block(5) == b"0123456789ABCDEF"
+        assert reader.stats[0x86] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
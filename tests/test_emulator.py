@@ -0,0 +1,450 @@
+"""
+Tests for emulator package.
+
+This module tests the software MIFARE Classic 1K card (access conditions,
+authentication state) and the emulated PC/SC reader, including running
+do_wr and CardProcessor against it.
+"""
+import pytest
+from unittest.mock import patch
+import sys
+import os
+import threading
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+from smartcard.Exceptions import CardConnectionException
+
+from nfc_reader.emulator import (
+    MifareClassic1K,
+    decodeAccessConditions,
+    EmulatedReader,
+)
+from nfc_reader.emulator import card as emulatedCard
+
+import card_data
+import do_card
+import do_prompt
+import do_wr
+import do_comm
+import do_trace
+
+KEY_FF = [0xFF] * 6
+KEY_A0 = [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5]
+KEY_B0 = [0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5]
+
+
+def auth(connection, nBlock, keyType, keyData):
+    connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + list(keyData))
+    return connection.transmit([0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, nBlock,
+                                0x60 if keyType == 'A' else 0x61, 0x00])[1:]
+
+
+class TestDecodeAccessConditions:
+    """Test decodeAccessConditions function."""
+
+    def test_transport_configuration(self):
+        """Test access bits of a new card (FF 07 80)."""
+        valid, conditions = decodeAccessConditions([0xFF, 0x07, 0x80])
+        assert valid is True
+        assert conditions == [0b000, 0b000, 0b000, 0b001]
+
+    def test_read_only_configuration(self):
+        """Test access bits 0F 00 FF: read-only data, locked trailer."""
+        valid, conditions = decodeAccessConditions([0x0F, 0x00, 0xFF])
+        assert valid is True
+        assert conditions == [0b011, 0b011, 0b011, 0b011]
+
+    def test_invalid_inverted_copy(self):
+        """Test broken inverted copy is reported."""
+        valid, _ = decodeAccessConditions([0xFF, 0x07, 0x81])
+        assert valid is False
+
+
+class TestOracleAgreement:
+    """Test independent emulator definitions agree with card_data ones."""
+
+    def test_rights_tables(self):
+        """Test access rights of data blocks and trailers are the same."""
+        assert emulatedCard.DATA_BLOCK_RIGHTS == card_data.DATA_BLOCK_RIGHTS
+        assert emulatedCard.TRAILER_RIGHTS == card_data.TRAILER_RIGHTS
+
+    def test_access_bits_decoding(self):
+        """Test every access bytes value decodes to the same conditions and validity."""
+        for b7 in range(256):
+            for b8 in range(256):
+                valid_b6 = ((~b8 & 0x0F) << 4) | (~b7 >> 4 & 0x0F)
+                for b6 in (valid_b6, valid_b6 ^ 0x01):
+                    valid, conditions = decodeAccessConditions([b6, b7, b8])
+                    assert (valid, tuple(conditions)) == card_data.decodeAccessBits([b6, b7, b8])
+
+    def test_value_block_format(self):
+        """Test value block encoding and decoding are the same."""
+        for value, address in ((0, 0), (1, 5), (-1, 0xFF), (0x7FFFFFFF, 4), (-0x80000000, 0x3C)):
+            data = emulatedCard.encodeValue(value, address)
+            assert data == card_data.encodeValueBlock(value, address)
+            assert emulatedCard.decodeValue(data) == card_data.decodeValueBlock(data)
+
+
+class TestMifareClassic1K:
+    """Test MifareClassic1K card model."""
+
+    def test_new_card_image(self):
+        """Test new card has UID, BCC and transport trailers."""
+        card = MifareClassic1K(uid=bytes([1, 2, 3, 4]))
+        assert card.uid == bytes([1, 2, 3, 4])
+        assert card.block(0)[4] == 1 ^ 2 ^ 3 ^ 4
+        assert card.block(7) == bytes(KEY_FF) + bytes([0xFF, 0x07, 0x80, 0x69]) + bytes(KEY_FF)
+
+    def test_image_size_checked(self):
+        """Test wrong image size is refused."""
+        with pytest.raises(ValueError):
+            MifareClassic1K(image=bytes(100))
+
+    def test_read_requires_authentication(self):
+        """Test read fails without authentication to the sector."""
+        card = MifareClassic1K()
+        assert card.read(4) is None
+        assert card.authenticate(4, 'A', KEY_FF) is True
+        assert card.read(5) == bytes(16)
+        assert card.read(8) is None
+        # error drops authentication
+        assert card.read(5) is None
+
+    def test_trailer_read_masks_key_a(self):
+        """Test key A is never readable in trailer."""
+        card = MifareClassic1K()
+        card.authenticate(3, 'A', KEY_FF)
+        trailer = card.read(3)
+        assert trailer[0:6] == bytes(6)
+        assert trailer[6:10] == bytes([0xFF, 0x07, 0x80, 0x69])
+        assert trailer[10:16] == bytes(KEY_FF)
+
+    def test_readable_key_b_useless(self):
+        """Test key B readable in transport configuration does not give access."""
+        card = MifareClassic1K()
+        assert card.authenticate(4, 'B', KEY_FF) is True
+        assert card.read(4) is None
+
+    def test_access_bits_enforced(self):
+        """Test read-only sector refuses write and key A read."""
+        card = MifareClassic1K()
+        card.setTrailer(1, KEY_A0, [0x0F, 0x00, 0xFF, 0x69], KEY_B0)
+        card.authenticate(4, 'A', KEY_A0)
+        assert card.read(4) is None
+        card.authenticate(4, 'B', KEY_B0)
+        assert card.read(4) == bytes(16)
+        assert card.write(4, bytes(16)) is True
+        card.setTrailer(1, KEY_A0, [0x0F, 0x07, 0x8F, 0x69], KEY_B0)  # 010 data blocks: read only
+        card.authenticate(4, 'B', KEY_B0)
+        assert card.write(4, bytes([1] * 16)) is False
+
+    def test_block_zero_read_only(self):
+        """Test manufacturer block can not be written."""
+        card = MifareClassic1K()
+        card.authenticate(0, 'A', KEY_FF)
+        assert card.write(0, bytes(16)) is False
+
+    def test_trailer_write_keeps_locked_parts(self):
+        """Test trailer write changes only parts writable with current key."""
+        card = MifareClassic1K()
+        card.setTrailer(1, KEY_A0, [0xF7, 0x8F, 0x00, 0x69], KEY_B0)  # trailer 100: key A/B writable by B
+        card.authenticate(7, 'B', KEY_B0)
+        assert card.write(7, bytes(KEY_FF) + bytes([0xFF, 0x07, 0x80, 0x00]) + bytes(KEY_FF)) is True
+        assert card.block(7) == bytes(KEY_FF) + bytes([0xF7, 0x8F, 0x00, 0x69]) + bytes(KEY_FF)
+
+
+class TestEmulatedReader:
+    """Test EmulatedReader APDU processing."""
+
+    def test_get_uid(self, connectedReader):
+        """Test GET DATA returns UID."""
+        reader, connection = connectedReader(MifareClassic1K(uid=bytes([9, 8, 7, 6])))
+        assert connection.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00]) == ([9, 8, 7, 6], 0x90, 0x00)
+
+    def test_auth_and_read_write(self, connectedReader):
+        """Test LOAD KEYS, AUTH, UPDATE BINARY and READ BINARY."""
+        reader, connection = connectedReader()
+        assert auth(connection, 4, 'A', KEY_FF) == (0x90, 0x00)
+        assert connection.transmit([0xFF, 0xD6, 0x00, 0x05, 0x10] + [0x55] * 16)[1:] == (0x90, 0x00)
+        assert connection.transmit([0xFF, 0xB0, 0x00, 0x05, 0x10]) == ([0x55] * 16, 0x90, 0x00)
+        assert reader.stats[0xB0] == 1
+
+    def test_wrong_key(self, connectedReader):
+        """Test wrong key gives 63 00."""
+        reader, connection = connectedReader()
+        assert auth(connection, 4, 'A', KEY_A0) == (0x63, 0x00)
+
+    def test_unknown_instruction(self, connectedReader):
+        """Test unsupported instruction and class."""
+        reader, connection = connectedReader()
+        assert connection.transmit([0xFF, 0x12, 0x00, 0x00])[1:] == (0x6D, 0x00)
+        assert connection.transmit([0x00, 0xB0, 0x00, 0x00])[1:] == (0x6E, 0x00)
+
+    def test_removed_card(self, connectedReader):
+        """Test transmit fails when card left the field."""
+        reader, connection = connectedReader()
+        reader.remove()
+        with pytest.raises(CardConnectionException):
+            connection.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00])
+
+    def test_latency(self, connectedReader):
+        """Test configured latency is applied per APDU."""
+        with patch('nfc_reader.emulator.reader.time.sleep') as mock_sleep:
+            reader, connection = connectedReader(latency=0.002, latencyByIns={0xD6: 0.01})
+            connection.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00])
+            connection.transmit([0xFF, 0xD6, 0x00, 0x05, 0x10] + [0] * 16)
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [0.002, 0.01]
+
+
+class TestValueBlocks:
+    """Test value block operations of emulated card through do_comm."""
+
+    def test_store_increment_decrement(self, connectedReader):
+        """Test balance changes are done on card."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+        assert auth(connection, 4, 'A', KEY_FF) == (0x90, 0x00)
+
+        assert do_comm.fnValueStore(connection, 4, 100).ok is True
+        assert card_data.decodeValueBlock(card.block(4)) == (True, 100, 4)
+        assert do_comm.fnValueIncrement(connection, 4, 50).ok is True
+        assert do_comm.fnValueDecrement(connection, 4, 170).ok is True
+        assert do_comm.fnValueRead(connection, 4)[1] == -20
+        assert do_comm.fnValueRestore(connection, 4, 5).ok is True
+        assert card_data.decodeValueBlock(card.block(5)) == (True, -20, 4)
+
+    @patch('builtins.print')
+    def test_refused_operations(self, mock_print, connectedReader):
+        """Test format, overflow and access checks keep block unchanged."""
+        card = MifareClassic1K()
+        card.setBlock(4, card_data.encodeValueBlock((1 << 31) - 1, 4))
+        reader, connection = connectedReader(card)
+        auth(connection, 4, 'A', KEY_FF)
+
+        assert do_comm.fnValueIncrement(connection, 4, 1).ok is False
+        result, value = do_comm.fnValueRead(connection, 5) #card drops authentication on error
+        assert (result.ok, value) == (False, None)
+        auth(connection, 4, 'A', KEY_FF)
+        assert do_comm.fnValueIncrement(connection, 5, 1).ok is False #not in value block format
+        assert card.block(5) == bytes(16)
+        assert do_comm.fnValueRestore(connection, 4, 8).ok is False   #other sector
+
+    @patch('builtins.print')
+    def test_increment_right(self, mock_print, connectedReader):
+        """Test block 0 with access condition 110: key A may decrement but not increment."""
+        card = MifareClassic1K()
+        card.setTrailer(1, KEY_FF, [0x6E, 0x17, 0x89, 0x69], KEY_B0) #trailer 011: key B not readable
+        card.setBlock(4, card_data.encodeValueBlock(10, 4))
+        reader, connection = connectedReader(card)
+
+        auth(connection, 4, 'A', KEY_FF)
+        assert do_comm.fnValueDecrement(connection, 4, 1).ok is True
+        assert do_comm.fnValueIncrement(connection, 4, 1).ok is False
+        auth(connection, 4, 'B', KEY_B0)
+        assert do_comm.fnValueIncrement(connection, 4, 5).ok is True
+        assert card_data.decodeValueBlock(card.block(4))[1] == 14
+
+
+class TestDoWrOnEmulator:
+    """Test read/write engines and CardProcessor against the emulator."""
+
+    @patch('builtins.print')
+    def test_fnRead_full_dump(self, mock_print, connectedReader):
+        """Test fnRead reads all blocks with one LOAD KEYS."""
+        card = MifareClassic1K(uid=bytes([1, 2, 3, 4]))
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.key()) is True
+        assert bytes(dump.head.UID) == bytes([1, 2, 3, 4])
+        assert reader.stats[0x82] == 1
+        assert reader.stats[0x86] == 16
+        assert reader.stats[0xB0] == 64
+
+    @patch('builtins.print')
+    def test_fnRead_compact_dump(self, mock_print, connectedReader):
+        """Test fnRead fills compact single buffer dump."""
+        card = MifareClassic1K(uid=bytes([1, 2, 3, 4]))
+        card.setBlock(5, b"compact image 05")
+        reader, connection = connectedReader(card)
+        dump = card_data.compactDumpMifare_1k()
+
+        assert do_wr.fnRead(connection, dump, card_data.key()) is True
+        assert bytes(dump.head.UID) == bytes([1, 2, 3, 4])
+        assert dump.image[5 * 16:6 * 16] == b"compact image 05"
+        assert bytes(dump.sectors[1].trailer.accessBits) == bytes([0xFF, 0x07, 0x80])
+        assert all(block.status == card_data.status.S_OK for sector in dump.sectors for block in sector.blocks)
+
+    @patch('builtins.print')
+    def test_fnRead_selected_sectors(self, mock_print, connectedReader):
+        """Test fnRead reads only requested sectors and marks others not read."""
+        card = MifareClassic1K(uid=bytes([1, 2, 3, 4]))
+        reader, connection = connectedReader(card)
+        dump = card_data.dumpMifare_1k()
+        dump.sectors[3].blocks[0].status = card_data.status.S_OK
+
+        assert do_wr.fnRead(connection, dump, card_data.key(), sectors=[0]) is True
+        assert bytes(dump.head.UID) == bytes([1, 2, 3, 4])
+        assert reader.stats[0x86] == 1
+        assert reader.stats[0xB0] == 4
+        assert dump.sectors[0].status == card_data.status.S_OK
+        for sector in dump.sectors[1:]:
+            assert sector.status == card_data.status.S_NOT_READ
+            assert sector.trailer.status == card_data.status.S_NOT_READ
+            assert all(block.status == card_data.status.S_NOT_READ for block in sector.blocks)
+
+    @patch('builtins.print')
+    def test_lazy_dump_loads_sector_on_access(self, mock_print):
+        """Test lazy dump reads a sector on first access and drops cache on removal."""
+        reader = EmulatedReader()
+        processor = do_card.CardProcessor(monitor=reader)
+        processor.selfTask.start()
+        card = MifareClassic1K()
+        card.setBlock(13, b"lazy sector 3...")
+        reader.insert(card)
+
+        sector = processor.lazyDump.sectors[3]
+        assert bytes(sector.blocks[1].data) == b"lazy sector 3..."
+        assert reader.stats[0x86] == 1
+        assert reader.stats[0xB0] == 4
+        processor.lazyDump.sectors[3]
+        assert reader.stats[0xB0] == 4
+        assert processor.dump.sectors[0].status == card_data.status.S_NOINIT
+
+        reader.remove()
+        assert processor.dump.sectors[3].status == card_data.status.S_NOT_READ
+        assert processor.lazyDump.sectors[3].status == card_data.status.S_NOT_READ
+        assert reader.stats[0xB0] == 4
+
+        processor.messageQueue.put(do_prompt.actions.A_QUIT)
+        do_card.fnWaitForResponce(processor.responceQueue)
+
+    @patch('builtins.print')
+    def test_lazy_dump_print_loads_once(self, mock_print):
+        """Test printing whole lazy dump reads all missing sectors by one load."""
+        reader = EmulatedReader()
+        processor = do_card.CardProcessor(monitor=reader)
+        processor.selfTask.start()
+        reader.insert(MifareClassic1K())
+        loads = []
+        loadSectors = processor.lazyDump.loadSectors
+        processor.lazyDump.loadSectors = lambda sectors: loads.append(list(sectors)) or loadSectors(sectors)
+
+        processor.lazyDump.printDump(list(range(card_data.MIFARE_1K_total_sectors)))
+        list(processor.lazyDump.sectors)
+
+        assert loads == [list(range(card_data.MIFARE_1K_total_sectors))]
+        assert reader.stats[0x86] == card_data.MIFARE_1K_total_sectors
+
+        processor.messageQueue.put(do_prompt.actions.A_QUIT)
+        do_card.fnWaitForResponce(processor.responceQueue)
+
+    @patch('builtins.print')
+    def test_startUidObserver_no_keys(self, mock_print):
+        """Test UID mode reads UID with one APDU even with non-default sector 0 key."""
+        reader = EmulatedReader()
+        card = MifareClassic1K(uid=bytes([0x04, 0x11, 0x22, 0x33]))
+        card.setTrailer(0, KEY_A0, [0xFF, 0x07, 0x80, 0x69], KEY_B0)
+        timer = threading.Timer(0.05, reader.insert, [card])
+        timer.start()
+        with patch('sys.stdout'):
+            assert do_card.startUidObserver(monitor=reader) is True
+        timer.join()
+        mock_print.assert_any_call("UID:[04 11 22 33]")
+        assert sum(reader.stats.values()) == 1
+
+    @patch('builtins.print')
+    def test_startObserver_reads_sector_0(self, mock_print):
+        """Test console entry point reads and prints only sector 0."""
+        reader = EmulatedReader()
+        timer = threading.Timer(0.05, reader.insert, [MifareClassic1K()])
+        timer.start()
+        with patch('sys.stdout'):
+            assert do_card.startObserver(monitor=reader) is True
+        timer.join()
+        assert reader.stats[0x86] == 1
+        assert reader.stats[0xB0] == 4
+
+    @patch('builtins.print')
+    def test_fnWrite_block(self, mock_print, connectedReader):
+        """Test fnWrite writes data to the card."""
+        card = MifareClassic1K()
+        reader, connection = connectedReader(card)
+        writeData = do_prompt.PromptAnswer_ForWrite(2, 1)
+        writeData.data = bytearray(b"0123456789ABCDEF")
+
+        assert do_wr.fnWrite(connection, writeData, card_data.key()) is True
+        assert card.block(9) == b"0123456789ABCDEF"
+
+    @patch('builtins.print')
+    def test_card_processor(self, mock_print):
+        """Test CardProcessor reads through emulator and reuses connection."""
+        reader = EmulatedReader()
+        processor = do_card.CardProcessor(monitor=reader)
+        reader.insert(MifareClassic1K())
+        key = card_data.key()
+
+        for _ in range(2):
+            processor.executeCommunication(lambda conn: do_wr.fnRead(conn, processor.dump, key))
+            assert processor.responceQueue.get() == do_card.actResponce.A_RESPONCE_OK
+
+        assert processor.observer.connections.reused == 1
+        reader.remove()
+        assert processor.observer.connections.connection is None
+
+    def test_connection_not_reused_for_other_card(self):
+        """Test swapped card with the same ATR gets a new connection (recognised by UID)."""
+        reader = EmulatedReader()
+        inserted = reader.insert(MifareClassic1K(uid=bytes([1, 2, 3, 4])))
+        connections = do_card.CardConnectionManager()
+
+        first = connections.acquire(inserted.atr, inserted)
+        assert connections.acquire(inserted.atr, inserted) is first
+        assert connections.reused == 1
+
+        reader.card = MifareClassic1K(uid=bytes([5, 6, 7, 8]))  # removal not reported
+        second = connections.acquire(inserted.atr, inserted)
+
+        assert second is not first
+        assert connections.reused == 1
+        assert connections.UID == bytes([5, 6, 7, 8])
+
+    @patch('builtins.print')
+    def test_card_inserted_while_operation_waits(self, mock_print):
+        """Test card inserted during wait for connection is served by the waiting operation."""
+        reader = EmulatedReader()
+        processor = do_card.CardProcessor(monitor=reader)
+        timer = threading.Timer(0.05, reader.insert, [MifareClassic1K(uid=bytes([1, 2, 3, 4]))])
+        timer.start()
+
+        with patch('sys.stdout'):
+            processor.executeCommunication(processor.readUID)
+        timer.join()
+
+        assert processor.responceQueue.get() == do_card.actResponce.A_RESPONCE_OK
+        assert processor.UID == bytearray([1, 2, 3, 4])
+
+    @patch('builtins.print')
+    def test_card_processor_trace(self, mock_print, tmp_path):
+        """Test CardProcessor with trace file records APDUs of the card session."""
+        trace = str(tmp_path / "tap.trace")
+        reader = EmulatedReader()
+        processor = do_card.CardProcessor(monitor=reader, trace=trace)
+        reader.insert(MifareClassic1K())
+
+        processor.executeCommunication(lambda conn: do_wr.fnRead(conn, processor.dump, card_data.key(), [0]))
+        assert processor.responceQueue.get() == do_card.actResponce.A_RESPONCE_OK
+        reader.remove()
+
+        assert len(do_trace.readTrace(trace)) == reader.stats.total()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])